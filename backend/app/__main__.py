@@ -0,0 +1,13 @@
+"""Start the API server: `python -m app` from the backend directory
+
+The training pool and the cluster workers are spawned processes, and
+spawn re-imports the main module in each of them. This module therefore
+imports nothing until it is really run as the main program, so only the
+serving process builds the app with its reading log, model registry and
+pools.
+"""
+
+if __name__ == "__main__":
+    from app.api import main
+
+    main()
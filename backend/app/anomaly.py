@@ -0,0 +1,162 @@
+from datetime import datetime
+from typing import Sequence, Tuple
+import numpy as np
+
+from .store import FIELDS, PEAK_FIELDS, ReadingStore, to_datetime64
+
+HOURS = 24
+
+
+def hour_of_day(timestamps: np.ndarray) -> np.ndarray:
+    """Hour of day (0-23) of datetime64 timestamps"""
+    return np.asarray(timestamps, dtype='datetime64[h]').astype(np.int64) % HOURS
+
+
+class AnomalyDetector:
+    """Streaming per-hour-of-day baseline of a home's readings
+
+    For every hour of the day and field it keeps Welford running mean and
+    variance plus a fixed-size log-bucket quantile sketch (relative error
+    `accuracy`, values below `min_value` counted as zero), so memory is
+    constant and `update`/`score` cost O(1) per reading however long the
+    history gets. A value is flagged when its z-score exceeds `z_threshold`
+    or it falls outside the [`low_quantile`, `high_quantile`] range seen at
+    that hour, and it is more than `tolerance` away from the hour's mean
+    (so a little night-time production is not an alert). A quantile bound
+    is only used once its hour has enough readings to estimate it
+    (1 / (1 - high_quantile) for the upper one); before that it would just
+    be the most extreme value seen so far. `update_batch` and
+    `score_batch` do the same for whole column batches, e.g. to backfill
+    from stored history.
+    """
+
+    def __init__(self, fields: Sequence[str] = PEAK_FIELDS, z_threshold: float = 4.0,
+                 low_quantile: float = 0.001, high_quantile: float = 0.999,
+                 min_samples: int = 10, tolerance: float = 0.5, accuracy: float = 0.02,
+                 min_value: float = 1e-3, buckets: int = 320):
+        self.fields = tuple(fields)
+        self.columns = [FIELDS.index(name) for name in self.fields]
+        self.z_threshold = z_threshold
+        self.low_quantile = low_quantile
+        self.high_quantile = high_quantile
+        self.min_samples = min_samples  # Per hour and field before anything is flagged
+        # Readings per hour before each quantile bound is estimated well enough to use
+        self.quantile_samples = (int(np.ceil(1 / low_quantile - 1e-9)),
+                                 int(np.ceil(1 / (1 - high_quantile) - 1e-9)))
+        self.tolerance = tolerance
+        self.min_value = min_value
+        self._gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = np.log(self._gamma)
+        # Bucket 0 holds values <= min_value, bucket i (min_value * gamma^(i-1), min_value * gamma^i]
+        self._bucket_values = np.concatenate([
+            [0.0], min_value * self._gamma ** np.arange(1, buckets + 1) * 2 / (1 + self._gamma)
+        ])
+
+        shape = (HOURS, len(self.fields))
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self._m2 = np.zeros(shape, dtype=np.float64)
+        self._sketch = np.zeros(shape + (buckets + 1,), dtype=np.int64)
+
+    def _bucket(self, values: np.ndarray) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            index = np.ceil(np.log(np.maximum(values, self.min_value) / self.min_value) / self._log_gamma)
+        return np.clip(np.nan_to_num(index), 0, self._sketch.shape[-1] - 1).astype(np.int64)
+
+    def std(self) -> np.ndarray:
+        """Standard deviation per hour and field"""
+        return np.sqrt(self._m2 / np.maximum(self.count - 1, 1))
+
+    def quantile(self, q: float, hours: np.ndarray = slice(None)) -> np.ndarray:
+        """Approximate q-quantile per hour and field (0 where nothing was seen)"""
+        sketch = self._sketch[hours]
+        count = self.count[hours]
+        rank = np.maximum(np.ceil(q * count), 1)
+        index = np.argmax(np.cumsum(sketch, axis=-1) >= rank[..., None], axis=-1)
+        return np.where(count > 0, self._bucket_values[index], 0.0)
+
+    # Single readings ----------------------------------------------------------
+
+    def _hour(self, timestamp: datetime) -> int:
+        return int(hour_of_day(to_datetime64(timestamp)))
+
+    def update(self, timestamp: datetime, values: Sequence[float]):
+        """Add one reading's field values (in `fields` order) to the baseline"""
+        hour = self._hour(timestamp)
+        values = np.asarray(values, dtype=np.float64)
+        self.count[hour] += 1
+        delta = values - self.mean[hour]
+        self.mean[hour] += delta / self.count[hour]
+        self._m2[hour] += delta * (values - self.mean[hour])
+        self._sketch[hour, np.arange(len(self.fields)), self._bucket(values)] += 1
+
+    def score(self, timestamp: datetime, values: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+        """Flags (1 high, -1 low, 0 normal) and warm-up mask for one reading
+
+        The mask is False for fields whose hour has fewer than
+        `min_samples` readings; those are never flagged.
+        """
+        hour = self._hour(timestamp)
+        hours = np.array([hour])
+        flags = self._flags(np.asarray(values, dtype=np.float64)[None, :], hours,
+                            self.quantile(self.low_quantile, hours),
+                            self.quantile(self.high_quantile, hours))
+        return flags[0], self.count[hour] >= self.min_samples
+
+    # Batches ------------------------------------------------------------------
+
+    def update_batch(self, timestamps: np.ndarray, values: np.ndarray):
+        """Add a column batch of readings (values in `fields` order)
+
+        Per-hour batch statistics come from bincount and are merged into
+        the running ones with Chan's parallel variance formula.
+        """
+        hours = hour_of_day(timestamps)
+        values = np.asarray(values, dtype=np.float64).reshape(len(hours), len(self.fields))
+        count = np.bincount(hours, minlength=HOURS)[:, None]
+        total = np.stack([np.bincount(hours, values[:, i], minlength=HOURS)
+                          for i in range(len(self.fields))], axis=1)
+        mean = total / np.maximum(count, 1)
+        m2 = np.stack([np.bincount(hours, (values[:, i] - mean[hours, i]) ** 2, minlength=HOURS)
+                       for i in range(len(self.fields))], axis=1)
+
+        merged = self.count + count
+        delta = mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.mean = np.where(merged > 0, self.mean + delta * count / merged, 0.0)
+            self._m2 = np.where(merged > 0, self._m2 + m2 + delta ** 2 * self.count * count / merged, 0.0)
+        self.count = merged
+
+        buckets = self._sketch.shape[-1]
+        cells = (hours[:, None] * len(self.fields) + np.arange(len(self.fields))) * buckets + self._bucket(values)
+        self._sketch += np.bincount(cells.ravel(), minlength=self._sketch.size).reshape(self._sketch.shape)
+
+    def score_batch(self, timestamps: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """Flags (rows, fields) of a column batch against the current baseline"""
+        hours = hour_of_day(timestamps)
+        values = np.asarray(values, dtype=np.float64).reshape(len(hours), len(self.fields))
+        warm = self.count[hours] >= self.min_samples
+        # Thresholds for all 24 hours at once instead of one sketch scan per row
+        low = self.quantile(self.low_quantile)[hours]
+        high = self.quantile(self.high_quantile)[hours]
+        return np.where(warm, self._flags(values, hours, low, high), 0).astype(np.int8)
+
+    def backfill(self, store: ReadingStore) -> np.ndarray:
+        """Learn the baseline from a store's history and return its flags"""
+        values = store.values()[:, self.columns]
+        self.update_batch(store.timestamps, values)
+        return self.score_batch(store.timestamps, values)
+
+    def _flags(self, values: np.ndarray, hours: np.ndarray, low: np.ndarray,
+               high: np.ndarray) -> np.ndarray:
+        deviation = values - self.mean[hours]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = np.nan_to_num(deviation / self.std()[hours], nan=0.0)
+        count = self.count[hours]
+        # The sketch is only accurate to one bucket, so allow that much slack. It
+        # cannot hold values below min_value, so a zero lower bound is no bound
+        above = (count >= self.quantile_samples[1]) & (values > high * self._gamma)
+        below = (count >= self.quantile_samples[0]) & (low > 0) & (values < low / self._gamma)
+        high_flag = ((z > self.z_threshold) | above) & (deviation > self.tolerance)
+        low_flag = ((z < -self.z_threshold) | below) & (deviation < -self.tolerance)
+        return np.where(high_flag, 1, np.where(low_flag, -1, 0)).astype(np.int8)
@@ -1,11 +1,42 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-import uvicorn
+from datetime import datetime, timedelta, timezone
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from statistics import NormalDist
+from typing import AsyncIterator, List, Dict, Optional, Union
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import asyncio
+import binascii
+import os
+import time
 import numpy as np
+import uvicorn
 
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+if not __package__:
+    # Run as a file (`python api.py`): the app is a package with relative imports
+    raise SystemExit("Start the server with `python -m app` from the backend directory")
+
+from .cache import ForecastCache
+from .dispatch import fleet_actions
+from .energy_agents import EnergyData, PredictionAgent
+from .execution import ExecutionLayer, Overloaded, TaskTimeout
+from .features import FeatureStore
+from .homes import DEFAULT_HOME_ID, DataStore, HomeShards, Position, fit_predictor
+from .ingest import ReadingBatch, decode_message, iter_csv, iter_ndjson, parse_records
+from .metrics import REGISTRY
+from .persistence import SQLiteReadingLog
+from .pipeline import Pipeline
+from .profiling import ProfilerBusy, collapsed, sample_stacks
+from .registry import ModelRegistry
+from .responses import EXPORT_FORMATS, EXPORT_TYPES, FastJSONResponse, negotiate, records
+from .rollups import TIERS as ROLLUP_TIERS, downsample
+from .sharding import WorkerConfig, run_cluster
+from .uncertainty import interval_confidence
+from .store import FIELDS, PEAK_FIELDS, to_datetime64
 
 # Pydantic models for request/response
 class WeatherData(BaseModel):
@@ -25,6 +56,10 @@ class Prediction(BaseModel):
     predicted_production: float
     predicted_consumption: float
     confidence: float
+    production_lower: Optional[float] = None
+    production_upper: Optional[float] = None
+    consumption_lower: Optional[float] = None
+    consumption_upper: Optional[float] = None
 
 class OptimizationRecommendation(BaseModel):
     action_type: str
@@ -36,11 +71,33 @@ class OptimizationResponse(BaseModel):
     recommendations: List[OptimizationRecommendation]
     total_savings_potential: float
 
+class FleetReadings(BaseModel):
+    """Current readings of many homes as columns, one entry per home"""
+    home_ids: List[str]
+    production: List[float]
+    consumption: List[float]
+    battery_level: List[float]
+    battery_capacity: Union[float, List[float]] = 13.5  # kWh (Tesla Powerwall capacity)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if pipeline is not None:
+        pipeline.start()
+    yield
+    if pipeline is not None:
+        await pipeline.stop()
+    execution.shutdown()
+    # Commit buffered readings before the worker exits
+    if reading_log is not None:
+        reading_log.close()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Energy Management System API",
     description="API for smart home energy management with AI agents",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # Configure CORS
@@ -52,13 +109,159 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Store some data in memory (in production, use a proper database)
-class DataStore:
-    def __init__(self):
-        self.readings: List[EnergyReading] = []
-        self.battery_capacity = 13.5  # kWh (Tesla Powerwall capacity)
+# Per-home shards of readings and models; with several workers each one
+# serves the homes the consistent-hash ring assigns to it
+worker = WorkerConfig.from_env()
+model_dir = os.environ.get("ENERGY_MODEL_DIR")
+model_registry = ModelRegistry(model_dir) if model_dir else None
+# Durable readings (SQLite WAL + per-day segments) when ENERGY_DATA_DIR is set
+data_dir = os.environ.get("ENERGY_DATA_DIR")
+reading_log = SQLiteReadingLog(data_dir) if data_dir else None
+memory_window = timedelta(days=int(os.environ.get("ENERGY_MEMORY_DAYS", "30"))) if reading_log else None
+homes = HomeShards(lambda home_id: DataStore(home_id, registry=model_registry, log=reading_log,
+                                             memory_window=memory_window))
+
+def get_shard(home_id: str = DEFAULT_HOME_ID) -> DataStore:
+    """Resolve a home's shard, rejecting homes owned by another worker"""
+    if not worker.owns(home_id):
+        owner = worker.owner(home_id)
+        raise HTTPException(status_code=421, detail={
+            "message": "Home is served by another worker",
+            "owner": owner,
+            "port": worker.port_of(owner)
+        })
+    return homes.get(home_id)
+
+# Training runs in a process pool and inference in a thread pool, so
+# ingestion keeps flowing on the event loop while models are fitted
+execution = ExecutionLayer.from_env()
+
+# Ingested readings also flow through the monitor -> predict -> optimize
+# agent pipeline when ENERGY_PIPELINE=1; the endpoints store them first
+pipeline = Pipeline(homes, execution=execution, store=False) \
+    if os.environ.get("ENERGY_PIPELINE") == "1" else None
+
+@app.exception_handler(Overloaded)
+async def overloaded(request: Request, exc: Overloaded):
+    return FastJSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": "1"})
+
+@app.exception_handler(TaskTimeout)
+async def task_timeout(request: Request, exc: TaskTimeout):
+    return FastJSONResponse({"detail": str(exc)}, status_code=504)
+
+async def _current_predictor(shard: DataStore) -> Optional[PredictionAgent]:
+    """The home's predictor, trained off the event loop when missing or stale
 
-data_store = DataStore()
+    Concurrent requests for the same home share one training task. Model
+    files are loaded and saved in the thread pool.
+    """
+    job = await execution.run_thread(shard.training_job)
+    if job is None:
+        return shard.predictor
+    agent = await execution.run_cpu(fit_predictor, *job, key=("train", shard.home_id))
+    return await execution.run_thread(shard.finish_training, agent)
+
+# Forecasts keyed by (home_id, model version, hour bucket)
+forecast_cache = ForecastCache(ttl=3600)
+
+# Metrics read from the live objects at scrape time
+REQUEST_LATENCY = REGISTRY.histogram(
+    "energy_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+REGISTRY.counter("energy_forecast_cache_hits_total", "Forecasts served from the cache",
+                 callback=lambda: forecast_cache.hits)
+REGISTRY.counter("energy_forecast_cache_misses_total", "Forecasts that had to be computed",
+                 callback=lambda: forecast_cache.misses)
+REGISTRY.counter("energy_model_loads_total", "Models loaded from the registry",
+                 callback=lambda: model_registry.loads if model_registry is not None else 0)
+REGISTRY.gauge("energy_model_registry_memory_bytes", "Size of the models held by the registry",
+               callback=lambda: model_registry.memory_usage if model_registry is not None else 0)
+REGISTRY.gauge("energy_executor_pending_tasks", "Queued and running tasks per pool", ("pool",),
+               callback=lambda: {("process",): execution.cpu.pending, ("thread",): execution.threads.pending})
+REGISTRY.counter("energy_reading_log_write_errors_total", "Failed reading log commits and compactions",
+                 callback=lambda: reading_log.write_errors if reading_log is not None else 0)
+REGISTRY.gauge("energy_reading_log_healthy", "1 unless the last reading log write failed",
+               callback=lambda: float(reading_log is None or reading_log.last_error is None))
+REGISTRY.gauge("energy_homes", "Homes served by this worker", callback=lambda: len(homes))
+REGISTRY.gauge("energy_store_readings", "Readings held in memory across all homes",
+               callback=lambda: sum(len(shard.readings) for shard in homes))
+
+# Sampling profiler endpoint, off unless ENERGY_PROFILING=1
+profiling_enabled = os.environ.get("ENERGY_PROFILING") == "1"
+
+# Normal quantile of the baseline's 80% intervals
+BASELINE_Z = NormalDist().inv_cdf(0.9)
+# Least spread of the baseline, as a fraction of the forecast, so a short or
+# constant history does not give zero-width intervals
+BASELINE_MIN_SPREAD = 0.25
+# The heuristic's fixed day and night confidence, which it never exceeds
+BASELINE_CONFIDENCE = (0.8, 0.7)
+
+def _baseline_forecast(latest: Dict, start: datetime, spread: np.ndarray) -> List[Prediction]:
+    """Day/night scaling of the latest reading, used until a model can be trained
+
+    Intervals are +/- BASELINE_Z standard deviations of the home's
+    production and consumption readings so far, but at least
+    BASELINE_MIN_SPREAD of the forecast, and confidence is capped at
+    BASELINE_CONFIDENCE.
+    """
+    predictions = []
+    for hour in range(24):
+        future_time = start + timedelta(hours=hour)
+        daytime = 6 <= future_time.hour <= 18
+        if daytime:
+            pred_prod = latest['production']
+            pred_cons = latest['consumption']
+        else:  # Nighttime
+            pred_prod = latest['production'] * 0.2
+            pred_cons = latest['consumption'] * 0.7
+        predicted = np.maximum([pred_prod, pred_cons], 0)
+        scale = np.maximum(spread, BASELINE_MIN_SPREAD * predicted)
+        half_width = BASELINE_Z * scale
+        lower, upper = np.maximum(predicted - half_width, 0), predicted + half_width
+        confidence = interval_confidence(predicted, lower, upper, scale.sum())
+        predictions.append(Prediction(
+            timestamp=future_time,
+            predicted_production=predicted[0],
+            predicted_consumption=predicted[1],
+            confidence=min(float(confidence), BASELINE_CONFIDENCE[0 if daytime else 1]),
+            production_lower=lower[0],
+            production_upper=upper[0],
+            consumption_lower=lower[1],
+            consumption_upper=upper[1]
+        ))
+    return predictions
+
+def _model_forecast(predictor: PredictionAgent, latest: Dict, start: datetime,
+                    features: FeatureStore) -> List[Prediction]:
+    current = EnergyData(
+        timestamp=start,
+        production=latest['production'],
+        consumption=latest['consumption'],
+        battery_level=latest['battery_level'],
+        weather_data=latest['weather_data']
+    )
+    return [
+        Prediction(**{**asdict(result),
+                      'predicted_production': max(0, result.predicted_production),
+                      'predicted_consumption': max(0, result.predicted_consumption),
+                      'production_lower': max(0, result.production_lower),
+                      'consumption_lower': max(0, result.consumption_lower)})
+        for result in predictor.predict_next_24h(current, features)
+    ]
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not by the concrete path, to bound cardinality
+        route = request.scope.get("route")
+        REQUEST_LATENCY.observe(time.perf_counter() - started, method=request.method,
+                                route=getattr(route, "path", "unmatched"), status=str(status))
 
 # Routes
 @app.get("/")
@@ -68,14 +271,35 @@ async def root():
         "version": "1.0.0",
         "endpoints": [
             "/readings",
+            "/readings/batch",
+            "/readings/stream",
+            "/readings/export",
             "/predict",
             "/optimize",
-            "/status"
+            "/optimize/batch",
+            "/status",
+            "/homes",
+            "/homes/{home_id}/...",
+            "/pipeline",
+            "/metrics"
+        ]
+    }
+
+@app.get("/homes")
+async def list_homes():
+    """List the homes served by this worker"""
+    return {
+        "worker": worker.name,
+        "workers": worker.count,
+        "homes": [
+            {"home_id": shard.home_id, "total_readings": len(shard.readings)}
+            for shard in homes
         ]
     }
 
 @app.post("/readings", response_model=Dict)
-async def add_reading(reading: EnergyReading):
+@app.post("/homes/{home_id}/readings", response_model=Dict)
+async def add_reading(reading: EnergyReading, shard: DataStore = Depends(get_shard)):
     """Add a new energy reading"""
     try:
         # Validate reading
@@ -83,168 +307,441 @@ async def add_reading(reading: EnergyReading):
             raise HTTPException(status_code=400, detail="Invalid energy values")
         
         # Add to data store
-        data_store.readings.append(reading)
+        reading_id = shard.add_reading(reading)
+        forecast_cache.invalidate(shard.home_id)
+        if pipeline is not None:
+            weather = reading.weather_data
+            await pipeline.submit(shard.home_id, (
+                np.array([to_datetime64(reading.timestamp)]),
+                np.array([[reading.production, reading.consumption, reading.battery_level,
+                           weather.temperature, weather.cloud_cover]]),
+                [weather.condition]
+            ))
         
         # Calculate basic metrics
         net_energy = reading.production - reading.consumption
         
         return {
             "status": "success",
-            "reading_id": len(data_store.readings),
+            "reading_id": reading_id,
             "net_energy": net_energy,
             "message": "Reading successfully recorded"
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/readings", response_model=List[EnergyReading])
-async def get_readings(limit: int = 10):
-    """Get recent energy readings"""
-    return data_store.readings[-limit:]
+NDJSON_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+
+async def _json_batches(request: Request) -> AsyncIterator[ReadingBatch]:
+    try:
+        records = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array of readings")
+    if not isinstance(records, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array of readings")
+    yield parse_records(records)
+
+async def _store_batch(shard: DataStore, batch: ReadingBatch) -> int:
+    columns = batch.valid_columns()
+    accepted = shard.add_batch(*columns)
+    if accepted:
+        forecast_cache.invalidate(shard.home_id)
+        if pipeline is not None:
+            # Waits while the pipeline is full, slowing ingestion to its pace
+            await pipeline.submit(shard.home_id, columns)
+    return accepted
+
+@app.post("/readings/batch", response_model=Dict)
+@app.post("/homes/{home_id}/readings/batch", response_model=Dict)
+async def add_readings_batch(request: Request, shard: DataStore = Depends(get_shard)):
+    """Add many energy readings from a JSON array, NDJSON stream or CSV upload
+
+    Streamed bodies are parsed and stored in chunks as they arrive, so a
+    gateway can send a large chunked upload without buffering it here.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in NDJSON_TYPES:
+        batches = iter_ndjson(request.stream())
+    elif content_type == "text/csv":
+        batches = iter_csv(request.stream())
+    else:
+        batches = _json_batches(request)
+
+    try:
+        accepted = 0
+        errors = []
+        async for batch in batches:
+            accepted += await _store_batch(shard, batch)
+            errors.extend(batch.error_list())
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "status": "success" if not errors else "partial",
+        "accepted": accepted,
+        "rejected": len(errors),
+        "errors": errors
+    }
+
+@app.websocket("/readings/stream")
+@app.websocket("/homes/{home_id}/readings/stream")
+async def stream_readings(websocket: WebSocket, home_id: str = DEFAULT_HOME_ID):
+    """Ingest readings continuously over one WebSocket connection
+
+    Each message holds one reading, a JSON array of readings or NDJSON lines;
+    the server acknowledges every message with its accepted count and the
+    connection-wide indices of rejected rows.
+    """
+    if not worker.owns(home_id):
+        # Application-defined close code mirroring HTTP 421
+        await websocket.close(code=4421, reason=f"Home is served by {worker.owner(home_id)}")
+        return
+    shard = homes.get(home_id)
+    await websocket.accept()
+    offset = 0
+    try:
+        while True:
+            message = await websocket.receive_text()
+            batch = parse_records(decode_message(message), offset)
+            offset += len(batch)
+            await websocket.send_json({
+                "accepted": await _store_batch(shard, batch),
+                "errors": batch.error_list()
+            })
+    except WebSocketDisconnect:
+        pass
+
+MAX_PAGE_SIZE = 10000
+
+@app.get("/readings", response_model=Union[List[EnergyReading], Dict])
+@app.get("/homes/{home_id}/readings", response_model=Union[List[EnergyReading], Dict])
+async def get_readings(limit: int = 10, start: Optional[datetime] = None,
+                       end: Optional[datetime] = None, resolution: Optional[str] = None,
+                       max_points: int = 1000, cursor: Optional[str] = None,
+                       shard: DataStore = Depends(get_shard)):
+    """Get recent energy readings, pages of readings, or a chart series of a time range
+
+    Without start/end/resolution/cursor the last `limit` readings are
+    returned. With `cursor` (empty for the first page) readings in
+    [start, end) are paged oldest first, `limit` per page, as
+    {"items", "next_cursor"}, through the whole stored history. Otherwise
+    readings with start <= timestamp < end come back as columns,
+    either raw or from a rollup tier (1min, 15min, 1h, 1d; "auto" picks
+    the finest tier that fits `max_points`), downsampled with LTTB to at
+    most `max_points` points.
+    """
+    if cursor is not None:
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        try:
+            after = _decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        columns, position = await execution.run_thread(shard.page, start, end, limit, after)
+        return FastJSONResponse({
+            "items": list(records(columns)),
+            "next_cursor": _encode_cursor(position) if position is not None else None
+        })
+
+    if start is None and end is None and resolution is None:
+        if limit <= 0:
+            return []
+        with shard.lock:
+            return list(shard.readings.rows(-limit, None))
+
+    resolution = resolution or "auto"
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {', '.join(RESOLUTIONS)}")
+    if max_points < 10:
+        raise HTTPException(status_code=400, detail="max_points must be at least 10")
+    series = await execution.run_thread(_range_series, shard, start, end, resolution, max_points)
+    return FastJSONResponse(series)
+
+def _encode_cursor(position: Position) -> str:
+    timestamp, skip = position
+    return urlsafe_b64encode(f"{int(timestamp.astype(np.int64))}:{skip}".encode()).decode()
+
+def _decode_cursor(cursor: str) -> Optional[Position]:
+    if not cursor:
+        return None
+    try:
+        timestamp, skip = urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return np.datetime64(int(timestamp), 'us'), int(skip)
+    except (UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(str(e))
+
+@app.get("/readings/export")
+@app.get("/homes/{home_id}/readings/export")
+async def export_readings(request: Request, start: Optional[datetime] = None,
+                          end: Optional[datetime] = None, format: Optional[str] = None,
+                          shard: DataStore = Depends(get_shard)):
+    """Stream readings in [start, end) as NDJSON, CSV or Arrow IPC
+
+    The format comes from `format` (ndjson, csv, arrow) or the Accept
+    header. Chunks are read from the store (or log) and encoded one at a
+    time, so the export is never held in memory as a whole.
+    """
+    media_type = EXPORT_FORMATS.get(format) if format else negotiate(request.headers.get("accept"))
+    if media_type is None or (format and negotiate(media_type) != media_type):
+        raise HTTPException(status_code=406, detail={
+            "message": "Unsupported export format",
+            "formats": [name for name, media in EXPORT_FORMATS.items() if negotiate(media) == media]
+        })
+    extension = next(name for name, media in EXPORT_FORMATS.items() if media == media_type)
+    return StreamingResponse(
+        EXPORT_TYPES[media_type](shard.iter_history(start, end)),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{shard.home_id}-readings.{extension}"'}
+    )
+
+RESOLUTIONS = ("auto", "raw") + tuple(name for name, _, _ in ROLLUP_TIERS)
+CHART_FIELDS = [FIELDS.index(name) for name in PEAK_FIELDS]
+
+def _iso(timestamps: np.ndarray) -> List[str]:
+    return np.datetime_as_string(timestamps, unit='s').tolist()
+
+def _range_series(shard: DataStore, start: Optional[datetime], end: Optional[datetime],
+                  resolution: str, max_points: int) -> Dict:
+    with shard.lock:
+        lo, hi = shard.readings.index_range(start, end)
+        oldest = shard.readings.timestamps[:1]
+        # Raw readings come from memory unless the range reaches past its window
+        in_memory = shard.log is None or (start is not None and len(oldest) and to_datetime64(start) >= oldest[0])
+        if resolution == "auto":
+            resolution = "raw" if in_memory and hi - lo <= max_points else \
+                shard.rollups.choose(start, end, max_points).name
+        if resolution == "raw" and in_memory:
+            timestamps = shard.readings.timestamps[lo:hi].copy()
+            values = shard.readings.values(lo, hi).copy()
+        elif resolution != "raw":
+            columns = shard.rollups.by_name[resolution].query(start, end)
+
+    if resolution == "raw":
+        if not in_memory:
+            history = shard.history(start, end)
+            timestamps, values = history.timestamps, history.values()
+        keep = downsample(timestamps, [values[:, i] for i in CHART_FIELDS], max_points)
+        return {
+            "home_id": shard.home_id,
+            "resolution": "raw",
+            "timestamps": _iso(timestamps[keep]),
+            "fields": {name: {"value": values[keep, i]} for i, name in enumerate(FIELDS)}
+        }
+
+    keep = downsample(columns['timestamps'], [columns['avg'][:, i] for i in CHART_FIELDS], max_points)
+    return {
+        "home_id": shard.home_id,
+        "resolution": resolution,
+        "timestamps": _iso(columns['timestamps'][keep]),
+        "count": columns['count'][keep],
+        "fields": {
+            name: {stat: columns[stat][keep, i] for stat in ("avg", "min", "max", "sum")}
+            for i, name in enumerate(FIELDS)
+        }
+    }
 
 @app.get("/predict/next24h", response_model=List[Prediction])
-async def predict_next_24h():
+@app.get("/homes/{home_id}/predict/next24h", response_model=List[Prediction])
+async def predict_next_24h(shard: DataStore = Depends(get_shard)):
     """Predict energy production and consumption for next 24 hours"""
     try:
-        if not data_store.readings:
+        if not shard.readings:
             raise HTTPException(status_code=400, detail="No historical data available")
         
-        predictions = []
-        current_time = datetime.now()
+        # Forecasts start at the current hour so they can be shared within it
+        hour_bucket = datetime.now().replace(minute=0, second=0, microsecond=0)
+        # Any new reading invalidates the home's forecasts, so a cached one for
+        # the installed model is current: serve it without touching the pools
+        installed = shard.predictor
+        cached = forecast_cache.lookup((
+            shard.home_id,
+            installed.model_version if installed is not None and installed.is_trained else "baseline",
+            hour_bucket
+        ))
+        if cached is not None:
+            return cached
+
+        predictor = await _current_predictor(shard)
+        version = predictor.model_version if predictor is not None else "baseline"
         
-        # Get latest reading for reference
-        latest_reading = data_store.readings[-1]
+        async def compute():
+            with shard.lock:
+                latest = shard.readings.latest()
+                spread = shard.readings.values()[:, CHART_FIELDS].std(axis=0)
+            if predictor is None:
+                return _baseline_forecast(latest, hour_bucket, spread)
+            return await execution.run_thread(_model_forecast, predictor, latest, hour_bucket,
+                                             shard.recent_features())
         
-        for hour in range(24):
-            future_time = current_time + timedelta(hours=hour)
-            hour_of_day = future_time.hour
-            
-            # Simple prediction logic (replace with ML model in production)
-            if 6 <= hour_of_day <= 18:  # Daytime
-                pred_prod = latest_reading.production * np.random.normal(1.0, 0.1)
-                pred_cons = latest_reading.consumption * np.random.normal(1.0, 0.1)
-                confidence = 0.8
-            else:  # Nighttime
-                pred_prod = latest_reading.production * np.random.normal(0.2, 0.1)
-                pred_cons = latest_reading.consumption * np.random.normal(0.7, 0.1)
-                confidence = 0.7
-                
-            predictions.append(Prediction(
-                timestamp=future_time,
-                predicted_production=max(0, pred_prod),
-                predicted_consumption=max(0, pred_cons),
-                confidence=confidence
-            ))
-            
-        return predictions
+        return await forecast_cache.get_or_compute(
+            (shard.home_id, version, hour_bucket), compute
+        )
+    except (HTTPException, Overloaded, TaskTimeout):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/optimize", response_model=OptimizationResponse)
-async def optimize_energy(reading: EnergyReading):
+@app.post("/homes/{home_id}/optimize", response_model=OptimizationResponse)
+async def optimize_energy(reading: EnergyReading, shard: DataStore = Depends(get_shard)):
     """Get optimization recommendations based on current state"""
     try:
+        actions = {name: float(amount[0]) for name, amount in fleet_actions(
+            [reading.production], [reading.consumption], [reading.battery_level],
+            shard.battery_capacity
+        ).items()}
+
         recommendations = []
-        net_energy = reading.production - reading.consumption
-        battery_headroom = data_store.battery_capacity - reading.battery_level
-        
-        if net_energy > 0:  # Surplus energy
-            if reading.battery_level < data_store.battery_capacity * 0.9:
-                # Recommend storing energy
-                store_amount = min(net_energy, battery_headroom)
-                recommendations.append(OptimizationRecommendation(
-                    action_type="STORE",
-                    amount=store_amount,
-                    priority=1,
-                    description=f"Store {store_amount:.2f} kWh in battery"
-                ))
-            
-            # If there's still excess after battery storage
-            remaining_surplus = net_energy - battery_headroom
-            if remaining_surplus > 0:
-                recommendations.append(OptimizationRecommendation(
-                    action_type="SELL",
-                    amount=remaining_surplus,
-                    priority=2,
-                    description=f"Sell {remaining_surplus:.2f} kWh to grid"
-                ))
-                
-        else:  # Energy deficit
-            deficit = abs(net_energy)
-            if reading.battery_level > data_store.battery_capacity * 0.2:
-                # Use battery power
-                available_battery = reading.battery_level - (data_store.battery_capacity * 0.2)
-                use_amount = min(deficit, available_battery)
-                recommendations.append(OptimizationRecommendation(
-                    action_type="USE_BATTERY",
-                    amount=use_amount,
-                    priority=1,
-                    description=f"Use {use_amount:.2f} kWh from battery"
-                ))
-                
-                remaining_deficit = deficit - use_amount
-                if remaining_deficit > 0:
-                    recommendations.append(OptimizationRecommendation(
-                        action_type="BUY",
-                        amount=remaining_deficit,
-                        priority=2,
-                        description=f"Buy {remaining_deficit:.2f} kWh from grid"
-                    ))
-            else:
-                # Battery too low, buy all needed power
-                recommendations.append(OptimizationRecommendation(
-                    action_type="BUY",
-                    amount=deficit,
-                    priority=1,
-                    description=f"Buy {deficit:.2f} kWh from grid"
-                ))
-        
-        # Calculate potential savings (simplified)
-        total_savings = sum(
-            r.amount * 0.15 if r.action_type in ["STORE", "SELL"] else -r.amount * 0.20
-            for r in recommendations
-        )
+        if actions['store'] > 0:
+            recommendations.append(OptimizationRecommendation(
+                action_type="STORE",
+                amount=actions['store'],
+                priority=1,
+                description=f"Store {actions['store']:.2f} kWh in battery"
+            ))
+        if actions['sell'] > 0:
+            recommendations.append(OptimizationRecommendation(
+                action_type="SELL",
+                amount=actions['sell'],
+                priority=2,
+                description=f"Sell {actions['sell']:.2f} kWh to grid"
+            ))
+        if actions['use_battery'] > 0:
+            recommendations.append(OptimizationRecommendation(
+                action_type="USE_BATTERY",
+                amount=actions['use_battery'],
+                priority=1,
+                description=f"Use {actions['use_battery']:.2f} kWh from battery"
+            ))
+        if actions['buy'] > 0:
+            recommendations.append(OptimizationRecommendation(
+                action_type="BUY",
+                amount=actions['buy'],
+                priority=2 if actions['use_battery'] > 0 else 1,
+                description=f"Buy {actions['buy']:.2f} kWh from grid"
+            ))
         
         return OptimizationResponse(
             recommendations=recommendations,
-            total_savings_potential=total_savings
+            total_savings_potential=actions['savings']
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/optimize/batch")
+async def optimize_fleet(readings: FleetReadings):
+    """Optimize many homes in one call
+
+    Takes and returns columns (one list entry per home) instead of
+    per-home objects. Amounts of actions that do not apply are 0.
+    """
+    count = len(readings.home_ids)
+    columns = [readings.production, readings.consumption, readings.battery_level]
+    if isinstance(readings.battery_capacity, list):
+        columns.append(readings.battery_capacity)
+    if any(len(column) != count for column in columns):
+        raise HTTPException(status_code=400, detail="All columns must have one entry per home")
+
+    actions = await execution.run_thread(
+        fleet_actions, np.array(readings.production), np.array(readings.consumption),
+        np.array(readings.battery_level), np.array(readings.battery_capacity)
+    )
+    return FastJSONResponse({
+        "home_ids": readings.home_ids,
+        **actions,
+        "total_savings_potential": float(actions['savings'].sum())
+    })
+
+@app.get("/pipeline")
+async def pipeline_status():
+    """Queue depths and counters of the agent pipeline"""
+    if pipeline is None:
+        raise HTTPException(status_code=404, detail="The agent pipeline is disabled (set ENERGY_PIPELINE=1)")
+    return pipeline.stats()
+
+@app.get("/pipeline/latest")
+@app.get("/homes/{home_id}/pipeline/latest")
+async def pipeline_latest(shard: DataStore = Depends(get_shard)):
+    """The pipeline's newest anomalies, forecast summary and actions for a home"""
+    if pipeline is None:
+        raise HTTPException(status_code=404, detail="The agent pipeline is disabled (set ENERGY_PIPELINE=1)")
+    result = pipeline.latest.get(shard.home_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="No pipeline result for this home yet")
+    return result
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text-format metrics of this worker"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/profile", response_class=PlainTextResponse)
+async def profile(seconds: float = 10.0, interval: float = 0.005):
+    """Sample all threads of this worker for `seconds` and return collapsed stacks
+
+    The output can be fed to flamegraph.pl, speedscope or inferno. Only
+    available when ENERGY_PROFILING=1.
+    """
+    if not profiling_enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not 0 < seconds <= 300 or not 0.001 <= interval <= 1:
+        raise HTTPException(status_code=400, detail="seconds must be in (0, 300] and interval in [0.001, 1]")
+    try:
+        # Sample from another thread so the event loop keeps serving (and is profiled)
+        counts = await asyncio.to_thread(sample_stacks, seconds, interval)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(collapsed(counts))
+
 @app.get("/status")
-async def get_system_status():
+@app.get("/homes/{home_id}/status")
+async def get_system_status(shard: DataStore = Depends(get_shard)):
     """Get current system status and statistics"""
     try:
-        if not data_store.readings:
-            return {
-                "status": "inactive",
-                "message": "No readings recorded yet"
-            }
-        
-        latest = data_store.readings[-1]
-        readings_24h = [r for r in data_store.readings 
-                       if r.timestamp > datetime.now() - timedelta(hours=24)]
-        
-        return {
-            "status": "active",
-            "total_readings": len(data_store.readings),
-            "latest_reading": {
-                "timestamp": latest.timestamp,
-                "production": latest.production,
-                "consumption": latest.consumption,
-                "battery_level": latest.battery_level
-            },
-            "last_24h_stats": {
-                "total_readings": len(readings_24h),
-                "avg_production": sum(r.production for r in readings_24h) / len(readings_24h),
-                "avg_consumption": sum(r.consumption for r in readings_24h) / len(readings_24h),
-                "peak_production": max(r.production for r in readings_24h),
-                "peak_consumption": max(r.consumption for r in readings_24h)
-            }
-        }
+        with shard.lock:
+            return _status(shard)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _status(shard: DataStore) -> Dict:
+    if not shard.readings:
+        return {
+            "status": "inactive",
+            "message": "No readings recorded yet"
+        }
+    
+    latest = shard.readings.latest()
+    # Stored timestamps are UTC; window_stats normalizes the aware time to match
+    now = datetime.now(timezone.utc)
+    
+    return {
+        "status": "active",
+        "home_id": shard.home_id,
+        "total_readings": len(shard.readings),
+        "latest_reading": {
+            "timestamp": latest['timestamp'],
+            "production": latest['production'],
+            "consumption": latest['consumption'],
+            "battery_level": latest['battery_level']
+        },
+        "last_24h_stats": shard.readings.window_stats('24h', now),
+        "rolling_stats": {
+            name: shard.readings.window_stats(name, now)
+            for name in shard.readings.windows
+        }
+    }
+
+def main():
+    """Serve the API; started by `python -m app` (see app/__main__.py)"""
+    if worker.count > 1:
+        # One process per worker on consecutive ports, homes split by hash ring
+        run_cluster(worker.count, host="0.0.0.0", port_base=worker.port_base)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Spawned processes re-import the main module, so as the main module this
+    # file would rebuild the app (log, registry, pools) in every one of them
+    raise SystemExit("Start the server with `python -m app` from the backend directory")
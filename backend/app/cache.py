@@ -0,0 +1,119 @@
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+import asyncio
+import time
+
+
+class ForecastCache:
+    """TTL + LRU cache of computed forecasts with single-flight computation
+
+    Keys are tuples whose first element is the home_id. Entries are indexed
+    by home, so invalidating one home costs only its own entries, and every
+    invalidation bumps the home's generation: a computation that started
+    before it is not cached when it finishes, and is not shared with
+    callers that arrive after it. Concurrent `get_or_compute` calls for the
+    same missing key share one computation instead of each running it.
+    """
+
+    def __init__(self, ttl: float = 3600.0, max_entries: int = 4096):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Tuple, Tuple[float, Any]]' = OrderedDict()
+        self._by_home: Dict[Hashable, Set[Tuple]] = {}
+        self._generations: Dict[Hashable, int] = {}
+        self._inflight: Dict[Tuple, Tuple[int, asyncio.Future]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def lookup(self, key: Tuple) -> Optional[Any]:
+        """get() that counts a hit when the key is cached"""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+        return value
+
+    def generation(self, home_id: Hashable) -> int:
+        """Number of times a home's forecasts have been invalidated"""
+        return self._generations.get(home_id, 0)
+
+    def put(self, key: Tuple, value: Any, generation: Optional[int] = None):
+        """Cache a value, unless its home was invalidated since `generation`"""
+        if generation is not None and generation != self.generation(key[0]):
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        self._by_home.setdefault(key[0], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Tuple):
+        del self._entries[key]
+        keys = self._by_home[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._by_home[key[0]]
+
+    def invalidate(self, home_id: Hashable):
+        """Drop every cached forecast of a home"""
+        self._generations[home_id] = self.generation(home_id) + 1
+        for key in self._by_home.pop(home_id, ()):
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+        self._by_home.clear()
+
+    async def get_or_compute(self, key: Tuple, compute: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        generation = self.generation(key[0])
+        inflight = self._inflight.get(key)
+        if inflight is not None and inflight[0] == generation:
+            self.hits += 1
+            return await asyncio.shield(inflight[1])
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (generation, future)
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; mark the exception as retrieved
+            future.exception()
+            raise
+        else:
+            self.put(key, value, generation)
+            future.set_result(value)
+            return value
+        finally:
+            # A newer computation of the key may have replaced this one
+            if self._inflight.get(key, (None, None))[1] is future:
+                del self._inflight[key]
+
+    def stats(self) -> Dict:
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -0,0 +1,166 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Union
+import numpy as np
+
+Prices = Union[float, Sequence[float], np.ndarray]
+
+
+@dataclass
+class DispatchPlan:
+    """Step-by-step battery and grid plan over a forecast horizon
+
+    All amounts are kWh per step; `battery_level` is the level at the end
+    of each step.
+    """
+    timestamps: List[datetime]
+    charge: np.ndarray
+    discharge: np.ndarray
+    buy: np.ndarray
+    sell: np.ndarray
+    battery_level: np.ndarray
+    cost: float
+    baseline_cost: float  # Cost of the same horizon without using the battery
+
+    @property
+    def savings(self) -> float:
+        return self.baseline_cost - self.cost
+
+    def to_dict(self) -> Dict:
+        return {
+            'timestamps': list(self.timestamps),
+            'charge': self.charge.tolist(),
+            'discharge': self.discharge.tolist(),
+            'buy': self.buy.tolist(),
+            'sell': self.sell.tolist(),
+            'battery_level': self.battery_level.tolist(),
+            'cost': self.cost,
+            'baseline_cost': self.baseline_cost,
+            'savings': self.savings
+        }
+
+
+def _grid_cost(grid: np.ndarray, buy_price: float, sell_price: float) -> np.ndarray:
+    """Cost of a grid exchange: positive grid energy is bought, negative is sold"""
+    return grid * sell_price + np.maximum(grid, 0) * (buy_price - sell_price)
+
+
+def solve_dispatch(net_energy: Sequence[float], battery_level: float, battery_capacity: float,
+                   min_battery_level: float, max_battery_level: float,
+                   buy_prices: Prices, sell_prices: Prices,
+                   timestamps: Optional[List[datetime]] = None, step_hours: float = 1.0,
+                   max_charge_rate: float = 5.0, max_discharge_rate: float = 5.0,
+                   efficiency: float = 0.9, resolution: float = 0.1,
+                   terminal_price: Optional[float] = None) -> DispatchPlan:
+    """Minimum-cost charge/discharge/buy/sell plan by dynamic programming
+
+    The battery level between `min_battery_level` and `max_battery_level`
+    (fractions of `battery_capacity`) is discretized in `resolution` kWh
+    steps. The backward pass evaluates every (level, next level) transition
+    of a step as one K x K array operation, so a 168-step horizon with ~100
+    levels is solved in milliseconds. Charging and discharging are limited
+    to the given kW rates, and `efficiency` is the round-trip efficiency
+    split evenly between charging and discharging. Energy left in the
+    battery at the end is valued at `terminal_price` (default: the mean
+    sell price) so the plan does not simply drain it.
+    """
+    net = np.asarray(net_energy, dtype=np.float64)
+    steps = len(net)
+    buy = np.broadcast_to(np.asarray(buy_prices, dtype=np.float64), (steps,))
+    sell = np.broadcast_to(np.asarray(sell_prices, dtype=np.float64), (steps,))
+    if terminal_price is None:
+        terminal_price = float(sell.mean()) if steps else 0.0
+
+    low = battery_capacity * min_battery_level
+    high = battery_capacity * max_battery_level
+    count = max(2, int(round((high - low) / resolution)) + 1)
+    levels = np.linspace(low, high, count)
+    one_way = np.sqrt(efficiency)
+    max_up = max_charge_rate * step_hours + 1e-9
+    max_down = max_discharge_rate * step_hours + 1e-9
+
+    def bus_energy(delta: np.ndarray) -> np.ndarray:
+        """Energy drawn from the home bus to change the level by `delta`"""
+        return np.where(delta > 0, delta / one_way, delta * one_way)
+
+    # Transition tables shared by every step: row = current level, column = next
+    delta = levels[None, :] - levels[:, None]
+    bus = bus_energy(delta)
+    penalty = np.where((delta <= max_up) & (-delta <= max_down), 0.0, np.inf)
+
+    choice = np.zeros((steps, count), dtype=np.int64)
+    value = -(levels - battery_level) * terminal_price
+    rows = np.arange(count)
+    for step in range(steps - 1, 0, -1):
+        total = _grid_cost(bus - net[step], buy[step], sell[step]) + penalty + value[None, :]
+        choice[step] = np.argmin(total, axis=1)
+        value = total[rows, choice[step]]
+
+    path = np.empty(steps, dtype=np.int64)
+    if steps:
+        # The first step starts from the exact current level, not a grid point
+        delta0 = levels - battery_level
+        total0 = _grid_cost(bus_energy(delta0) - net[0], buy[0], sell[0]) + value
+        reachable = (delta0 <= max_up) & (-delta0 <= max_down)
+        if reachable.any():
+            total0 = np.where(reachable, total0, np.inf)
+        else:
+            # Outside the allowed band and too far to reach it in one step
+            total0 = np.abs(delta0)
+        path[0] = int(np.argmin(total0))
+        for step in range(1, steps):
+            path[step] = choice[step, path[step - 1]]
+
+    planned = levels[path]
+    change = np.diff(np.concatenate([[battery_level], planned]))
+    grid = bus_energy(change) - net
+    cost = float(_grid_cost(grid, buy, sell).sum())
+    baseline_cost = float(_grid_cost(-net, buy, sell).sum())
+    return DispatchPlan(
+        timestamps=list(timestamps) if timestamps is not None else [],
+        charge=np.maximum(change, 0),
+        discharge=np.maximum(-change, 0),
+        buy=np.maximum(grid, 0),
+        sell=np.maximum(-grid, 0),
+        battery_level=planned,
+        cost=cost,
+        baseline_cost=baseline_cost
+    )
+
+
+def fleet_actions(production: np.ndarray, consumption: np.ndarray, battery_level: np.ndarray,
+                  battery_capacity: Union[float, np.ndarray], min_battery_level: float = 0.2,
+                  max_battery_level: float = 0.9, buy_price: float = 0.20,
+                  sell_price: float = 0.15) -> Dict[str, np.ndarray]:
+    """Store/sell/use-battery/buy amounts for many homes at once
+
+    Applies the single-reading /optimize rule to whole arrays with masks:
+    a surplus is stored while the battery is below `max_battery_level` and
+    the rest sold; a deficit is covered from the battery down to
+    `min_battery_level` and the rest bought. Returns one array per action
+    plus the per-home savings.
+    """
+    production = np.asarray(production, dtype=np.float64)
+    consumption = np.asarray(consumption, dtype=np.float64)
+    battery_level = np.asarray(battery_level, dtype=np.float64)
+    capacity = np.broadcast_to(np.asarray(battery_capacity, dtype=np.float64), battery_level.shape)
+
+    net = production - consumption
+    headroom = capacity - battery_level
+    surplus = net > 0
+    deficit = np.where(surplus, 0.0, -net)
+    available = battery_level - capacity * min_battery_level
+
+    store = np.where(surplus & (battery_level < capacity * max_battery_level),
+                     np.minimum(net, headroom), 0.0)
+    sell = np.where(surplus, np.maximum(net - headroom, 0.0), 0.0)
+    use_battery = np.where(~surplus & (available > 0), np.minimum(deficit, available), 0.0)
+    buy = deficit - use_battery
+    savings = (store + sell) * sell_price - (use_battery + buy) * buy_price
+    return {
+        'store': store,
+        'sell': sell,
+        'use_battery': use_battery,
+        'buy': buy,
+        'savings': savings
+    }
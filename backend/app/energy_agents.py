@@ -1,10 +1,32 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timedelta
+import os
 import numpy as np
-import pandas as pd
-from typing import Dict, List, Optional
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.preprocessing import StandardScaler
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+if not __package__:
+    # Run as a file (`python energy_agents.py`): the app is a package with relative imports
+    raise SystemExit("Run the example with `python -m app.energy_agents` from the backend directory")
+
+from .anomaly import AnomalyDetector, hour_of_day
+from .dispatch import DispatchPlan, Prices, solve_dispatch
+from .features import FEATURES, HORIZON, FeatureStore
+from .metrics import timed
+from .store import FIELDS, ReadingStore, to_datetime64, weather_value
+from .uncertainty import (INTERVAL_METHODS, ConformalCalibration, interval_confidence,
+                          quantile_bounds, steps_ahead, tree_predictions)
+
+# sklearn is imported where it is first used, so importing this module
+# (and starting an API worker) stays cheap
+if TYPE_CHECKING:
+    from sklearn.ensemble import RandomForestRegressor
+
+# Features of models saved before lag features were added
+LEGACY_FEATURES = FEATURES[:6]
+
+# Readings needed before a model can be trained
+MIN_TRAINING_ROWS = 24
 
 @dataclass
 class EnergyData:
@@ -20,20 +42,51 @@ class PredictionResult:
     predicted_production: float
     predicted_consumption: float
     confidence: float
+    # Prediction interval bounds at the agent's coverage
+    production_lower: Optional[float] = None
+    production_upper: Optional[float] = None
+    consumption_lower: Optional[float] = None
+    consumption_upper: Optional[float] = None
+
+def _horizon_timestamps(start: datetime, horizon: int, step: timedelta) -> List[datetime]:
+    return [start + step * i for i in range(horizon)]
+
 
 class MonitoringAgent:
     """Agent responsible for monitoring and analyzing energy data"""
     
-    def __init__(self, home_id: str):
+    def __init__(self, home_id: str, store: Optional[ReadingStore] = None,
+                 max_history: Optional[int] = None):
         self.home_id = home_id
-        self.historical_data = []
-        self.model = RandomForestRegressor()
-        self.scaler = StandardScaler()
+        # Columnar history, optionally shared with the API's DataStore
+        self.historical_data = store if store is not None else ReadingStore(max_readings=max_history)
+        self._model = None
+        self._scaler = None
+        # Fixed limits, used for an hour of the day until the detector has
+        # seen enough readings at that hour
         self.anomaly_thresholds = {
             'production': {'low': 0, 'high': 15},
             'consumption': {'low': 0, 'high': 10}
         }
+        self.detector = AnomalyDetector()
+        if len(self.historical_data):
+            self.detector.backfill(self.historical_data)
+
+    @property
+    def model(self):
+        if self._model is None:
+            from sklearn.ensemble import RandomForestRegressor
+            self._model = RandomForestRegressor()
+        return self._model
+
+    @property
+    def scaler(self):
+        if self._scaler is None:
+            from sklearn.preprocessing import StandardScaler
+            self._scaler = StandardScaler()
+        return self._scaler
 
+    @timed('monitor.process_reading')
     def process_reading(self, reading: EnergyData) -> Dict:
         """Process new energy reading and detect anomalies"""
         # Validate reading
@@ -44,7 +97,7 @@ class MonitoringAgent:
             }
 
         # Store reading
-        self.historical_data.append(reading)
+        self.historical_data.append_reading(reading)
         
         # Check for anomalies
         anomalies = self._detect_anomalies(reading)
@@ -64,23 +117,55 @@ class MonitoringAgent:
         )
 
     def _detect_anomalies(self, reading: EnergyData) -> List[str]:
-        """Detect anomalies in energy readings"""
+        """Detect anomalies against this home's baseline for the reading's hour
+
+        The reading is scored before it is added to the baseline.
+        """
         anomalies = []
-        
-        # Production anomalies
-        if reading.production < self.anomaly_thresholds['production']['low']:
-            anomalies.append('Low production alert')
-        elif reading.production > self.anomaly_thresholds['production']['high']:
-            anomalies.append('High production alert')
-            
-        # Consumption anomalies
-        if reading.consumption < self.anomaly_thresholds['consumption']['low']:
-            anomalies.append('Low consumption alert')
-        elif reading.consumption > self.anomaly_thresholds['consumption']['high']:
-            anomalies.append('High consumption alert')
-            
+        values = [getattr(reading, name) for name in self.detector.fields]
+        flags, warm = self.detector.score(reading.timestamp, values)
+
+        for name, value, flag, ready in zip(self.detector.fields, values, flags, warm):
+            if not ready:
+                thresholds = self.anomaly_thresholds[name]
+                flag = -1 if value < thresholds['low'] else 1 if value > thresholds['high'] else 0
+            if flag < 0:
+                anomalies.append(f'Low {name} alert')
+            elif flag > 0:
+                anomalies.append(f'High {name} alert')
+
+        self.detector.update(reading.timestamp, values)
         return anomalies
 
+    def validate_batch(self, values: np.ndarray) -> np.ndarray:
+        """Mask of the rows of a (rows, len(FIELDS)) block that pass _validate_reading"""
+        checked = values[:, [FIELDS.index('production'), FIELDS.index('consumption'),
+                             FIELDS.index('battery_level')]]
+        return ((checked >= 0) & (checked <= 100)).all(axis=1)
+
+    def detect_batch(self, timestamps: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """Anomaly flags (rows, detector fields) of a column batch, then learn from it
+
+        The vectorized form of _detect_anomalies: the whole batch is scored
+        against the baseline before it is added, hours that are not warm
+        yet use the fixed thresholds.
+        """
+        values = np.asarray(values, dtype=np.float64)[:, self.detector.columns]
+        flags = self.detector.score_batch(timestamps, values)
+        warm = self.detector.count[hour_of_day(timestamps)] >= self.detector.min_samples
+        low = np.array([self.anomaly_thresholds[name]['low'] for name in self.detector.fields])
+        high = np.array([self.anomaly_thresholds[name]['high'] for name in self.detector.fields])
+        fixed = np.where(values < low, -1, np.where(values > high, 1, 0)).astype(np.int8)
+        self.detector.update_batch(timestamps, values)
+        return np.where(warm, flags, fixed)
+
+    def describe_flags(self, flags: np.ndarray) -> List[str]:
+        """Alert messages of one row of detect_batch flags"""
+        return [
+            f"{'Low' if flag < 0 else 'High'} {name} alert"
+            for name, flag in zip(self.detector.fields, flags) if flag
+        ]
+
     def _generate_summary(self, reading: EnergyData) -> Dict:
         """Generate summary of current energy status"""
         return {
@@ -94,151 +179,555 @@ class MonitoringAgent:
 class PredictionAgent:
     """Agent responsible for predicting future energy patterns"""
     
-    def __init__(self, home_id: str):
+    def __init__(self, home_id: str, n_estimators: int = 100, max_depth: Optional[int] = None,
+                 min_samples_leaf: int = 1, n_jobs: Optional[int] = None,
+                 multi_output: bool = False, parallel_fit: bool = True,
+                 estimator: str = 'forest', trees_per_update: int = 10,
+                 warm_window: int = 168, interval: str = 'conformal', coverage: float = 0.8):
+        if estimator not in ('forest', 'sgd'):
+            raise ValueError(f"Unknown estimator: {estimator}")
+        if interval not in INTERVAL_METHODS:
+            raise ValueError(f"Unknown interval method: {interval}")
+        if not 0 < coverage < 1:
+            raise ValueError("coverage must be between 0 and 1")
+        if estimator == 'sgd' and multi_output:
+            raise ValueError("The sgd estimator does not support multi_output")
         self.home_id = home_id
-        self.model_production = RandomForestRegressor()
-        self.model_consumption = RandomForestRegressor()
-        self.scaler = StandardScaler()
+        self.n_estimators = n_estimators
+        self.max_depth = max_depth
+        self.min_samples_leaf = min_samples_leaf
+        self.n_jobs = n_jobs
+        # One forest predicting [production, consumption] instead of two
+        self.multi_output = multi_output
+        # Fit the two single-output forests concurrently
+        self.parallel_fit = parallel_fit
+        # 'forest' grows the forests with warm_start, 'sgd' learns online
+        self.estimator = estimator
+        self.trees_per_update = trees_per_update
+        # Most recent rows the new trees see on an incremental update
+        self.warm_window = warm_window
+        # 'quantile' takes intervals from the spread of the trees, 'conformal'
+        # scales that spread by residuals on recent rows the models had not fit
+        self.interval = interval
+        self.coverage = coverage
+        self.calibration: Optional[ConformalCalibration] = None
+        self.target_scale: Optional[float] = None  # Mean total |production| + |consumption|
+        # Models are created on first training (or loaded from a registry)
+        self.model = self.model_production = self.model_consumption = None
+        self.scaler = None
         self.is_trained = False
+        self.watermark = None  # Timestamp of the newest reading trained on
+        # Columns of FEATURES the fitted models take
+        self.feature_names = FEATURES
+        # Newest feature rows seen in training, used when predict gets no store
+        self.recent: Optional[FeatureStore] = None
+
+    def _new_regressor(self):
+        if self.estimator == 'sgd':
+            from sklearn.linear_model import SGDRegressor
+            return SGDRegressor()
+        from sklearn.ensemble import RandomForestRegressor
+        return RandomForestRegressor(
+            n_estimators=self.n_estimators,
+            max_depth=self.max_depth,
+            min_samples_leaf=self.min_samples_leaf,
+            n_jobs=self.n_jobs
+        )
+
+    def _reset_models(self):
+        if self.multi_output:
+            self.model = self._new_regressor()
+            self.model_production = self.model_consumption = None
+        else:
+            self.model = None
+            self.model_production = self._new_regressor()
+            self.model_consumption = self._new_regressor()
+        from sklearn.preprocessing import StandardScaler
+        self.scaler = StandardScaler()
 
-    def train(self, historical_data: List[EnergyData]):
-        """Train prediction models using historical data"""
-        if len(historical_data) < 24:  # Need at least 24 hours of data
+    @timed('prediction.train')
+    def train(self, historical_data: Union[List[EnergyData], ReadingStore, FeatureStore],
+              incremental: bool = False):
+        """Train prediction models using historical data
+
+        Readings are featurized into a FeatureStore unless one (such as the
+        DataStore's, kept up to date on ingest) is passed in, and the models
+        are fitted on its float32 matrix directly.
+
+        With `incremental=True` on a trained agent only rows newer than the
+        training watermark are used, so the cost scales with the new data:
+        the sgd estimator updates the scaler and models with partial_fit,
+        forests grow `trees_per_update` new trees on the most recent rows
+        and retire the oldest ones to stay at `n_estimators`. The scaler
+        stays fixed for forests because the existing trees split on scaled
+        values.
+        """
+        features = self._feature_store(historical_data)
+        if incremental and self.is_trained:
+            return self._train_incremental(features)
+
+        if len(features) < MIN_TRAINING_ROWS:
             return False
-            
-        # Prepare training data
-        df = self._prepare_training_data(historical_data)
-        
-        # Train production model
-        X = self._extract_features(df)
-        y_prod = df['production']
-        y_cons = df['consumption']
-        
-        # Scale features
-        X_scaled = self.scaler.fit_transform(X)
-        
-        # Train models
-        self.model_production.fit(X_scaled, y_prod)
-        self.model_consumption.fit(X_scaled, y_cons)
+
+        X, y = features.matrix()
+        self._fit_calibrated(features, X, y)
         
+        self.feature_names = FEATURES
+        self._set_watermark(features)
         self.is_trained = True
         return True
 
-    def predict_next_24h(self, current_data: EnergyData) -> List[PredictionResult]:
+    def _train_incremental(self, features: FeatureStore) -> bool:
+        start = features.index_after(self.watermark)
+        if start == len(features):
+            return True
+
+        X_new, y_new = features.matrix(start)
+        X_new = self._select(X_new)
+
+        # No model has seen the new rows yet, so they are scored before fitting
+        if self.calibration is None:
+            self.calibration = ConformalCalibration(0.1 * y_new.std(axis=0) + 1e-6)
+        self._calibrate(features, start)
+        self._set_watermark(features)
+
+        if self.estimator == 'sgd':
+            self.scaler.partial_fit(X_new)
+            X_scaled = self.scaler.transform(X_new)
+            self.model_production.partial_fit(X_scaled, y_new[:, 0])
+            self.model_consumption.partial_fit(X_scaled, y_new[:, 1])
+            return True
+
+        X, y = features.matrix(max(0, len(features) - max(len(X_new), self.warm_window)))
+        self._grow_forests(self.scaler.transform(self._select(X)), y)
+        return True
+
+    def _set_watermark(self, features: FeatureStore):
+        self.watermark = features.last_timestamp.astype(datetime)
+        self.recent = features.tail()
+
+    def _select(self, X: np.ndarray) -> np.ndarray:
+        """The columns of a FEATURES matrix the fitted models take"""
+        if self.feature_names == FEATURES:
+            return X
+        return X[:, [FEATURES.index(name) for name in self.feature_names]]
+
+    def _grow_forests(self, X_scaled: np.ndarray, y: np.ndarray):
+        if self.multi_output:
+            self._grow_forest(self.model, X_scaled, y)
+        else:
+            self._grow_forest(self.model_production, X_scaled, y[:, 0])
+            self._grow_forest(self.model_consumption, X_scaled, y[:, 1])
+
+    def _grow_forest(self, forest: 'RandomForestRegressor', X_scaled: np.ndarray, y: np.ndarray):
+        """Add trees fitted on recent rows, then retire the oldest to keep the size bounded"""
+        forest.set_params(warm_start=True, n_estimators=len(forest.estimators_) + self.trees_per_update)
+        forest.fit(X_scaled, y)
+        excess = len(forest.estimators_) - self.n_estimators
+        if excess > 0:
+            del forest.estimators_[:excess]
+            forest.set_params(n_estimators=len(forest.estimators_))
+
+    def _fit_models(self, X_scaled: np.ndarray, y_prod: np.ndarray, y_cons: np.ndarray):
+        """Fit the models on one scaled feature matrix"""
+        if self.multi_output:
+            self.model.fit(X_scaled, np.column_stack([y_prod, y_cons]))
+        elif self.parallel_fit:
+            # Tree building releases the GIL, so two threads fit both targets at once
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [
+                    executor.submit(self.model_production.fit, X_scaled, y_prod),
+                    executor.submit(self.model_consumption.fit, X_scaled, y_cons)
+                ]
+                for future in futures:
+                    future.result()
+        else:
+            self.model_production.fit(X_scaled, y_prod)
+            self.model_consumption.fit(X_scaled, y_cons)
+
+    def _forests(self) -> List['RandomForestRegressor']:
+        return [self.model] if self.multi_output else [self.model_production, self.model_consumption]
+
+    def _fit_calibrated(self, features: FeatureStore, X: np.ndarray, y: np.ndarray):
+        """Fit on all but the newest rows, score forecasts of those for the conformal calibration, then learn them
+
+        Hourly rows are autocorrelated, so out-of-bag rows have near copies
+        in every bootstrap sample and their residuals understate the error
+        on future readings; recent rows held out of the fit do not, as long
+        as the scaler is fitted without them too. Forests start
+        `trees_per_update` trees short and grow those on the recent rows,
+        as `_train_incremental` does: only the grown trees see them, which
+        keeps a full training to one fit of the forest.
+        """
+        holdout = min(self.warm_window, len(y) // 4)
+        self.target_scale = float(np.abs(y).sum(axis=1).mean())
+        self.calibration = ConformalCalibration(0.1 * y.std(axis=0) + 1e-6)
+        self._reset_models()
+        if self.estimator == 'forest':
+            for forest in self._forests():
+                forest.set_params(n_estimators=max(1, self.n_estimators - self.trees_per_update))
+        fit = slice(0, len(y) - holdout)
+        X_scaled = self.scaler.fit(X[fit]).transform(X)
+        self._fit_models(X_scaled[fit], y[fit, 0], y[fit, 1])
+
+        self._calibrate(features, len(y) - holdout)
+        recent = slice(len(y) - holdout, len(y))
+        if self.estimator == 'sgd':
+            self.model_production.partial_fit(X_scaled[recent], y[recent, 0])
+            self.model_consumption.partial_fit(X_scaled[recent], y[recent, 1])
+        else:
+            self._grow_forests(X_scaled[-self.warm_window:], y[-self.warm_window:])
+
+    def _calibrate(self, features: FeatureStore, start: int):
+        """Score forecasts of the rows from `start` on, made from each earlier row, as predict_horizon would
+
+        Every row from `start` (at most `warm_window` of them) is taken in
+        turn as the start of a forecast of the rows up to HORIZON after it,
+        with the history features known then and the weather held at its
+        last reading, so the scores include the error of forecasting hours
+        ahead and not only that of the next reading.
+        """
+        timestamps = features.timestamps
+        X, y = features.matrix()
+        horizon = np.timedelta64(HORIZON, 'us')
+        blocks, targets, steps = [], [], []
+        for origin in range(max(start, 1, len(features) - self.warm_window), len(features)):
+            known = timestamps[origin - 1]
+            ahead = slice(origin, int(np.searchsorted(timestamps, known + horizon, side='right')))
+            blocks.append(features.horizon(timestamps[ahead], X[origin - 1, 4], X[origin - 1, 5], known=origin))
+            targets.append(y[ahead])
+            steps.append(steps_ahead(timestamps[ahead], known))
+        if not blocks:
+            return
+        predicted, spread = self._moments(self.scaler.transform(self._select(np.vstack(blocks))))
+        self.calibration.update(np.vstack(targets), predicted, spread, np.concatenate(steps))
+
+    def _tree_predictions(self, features_scaled: np.ndarray) -> np.ndarray:
+        """(rows, trees, 2) production and consumption predictions of every tree"""
+        if self.multi_output:
+            return tree_predictions(self.model, features_scaled)
+        return np.concatenate([tree_predictions(self.model_production, features_scaled),
+                               tree_predictions(self.model_consumption, features_scaled)], axis=2)
+
+    def _moments(self, features_scaled: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, 2) predictions and spread across trees (zero for sgd)"""
+        if self.estimator == 'sgd':
+            predicted = np.column_stack(self._predict_targets(features_scaled))
+            return predicted, np.zeros_like(predicted)
+        predictions = self._tree_predictions(features_scaled)
+        return predictions.mean(axis=1), predictions.std(axis=1)
+
+    def _predict_intervals(self, features_scaled: np.ndarray,
+                           steps: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(rows, 2) predictions with their lower and upper interval bounds, by step ahead
+
+        Forests are evaluated once into a (rows, trees, 2) stack, which
+        gives the point predictions (the tree mean), the spread and the
+        tree quantiles together. Without conformal scores (models loaded
+        from older registries) forests fall back to tree quantiles.
+        """
+        calibrated = self.calibration is not None and len(self.calibration) > 0
+        if self.estimator == 'sgd':
+            predicted, spread = self._moments(features_scaled)
+            if not calibrated:
+                return predicted, predicted, predicted
+            return (predicted,) + self.calibration.bounds(predicted, spread, self.coverage, steps)
+        predictions = self._tree_predictions(features_scaled)
+        predicted = predictions.mean(axis=1)
+        if self.interval == 'quantile' or not calibrated:
+            return (predicted,) + quantile_bounds(predictions, self.coverage)
+        return (predicted,) + self.calibration.bounds(predicted, predictions.std(axis=1), self.coverage, steps)
+
+    def _predict_targets(self, features_scaled: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Predict production and consumption for every row of a scaled matrix"""
+        if self.multi_output:
+            predictions = self.model.predict(features_scaled)
+            return predictions[:, 0], predictions[:, 1]
+        return (self.model_production.predict(features_scaled),
+                self.model_consumption.predict(features_scaled))
+
+    def _model_key(self) -> tuple:
+        """Identity of the fitted scaler and models, used to batch homes sharing them"""
+        return (id(self.scaler), id(self.model), id(self.model_production), id(self.model_consumption))
+
+    @property
+    def model_version(self) -> Optional[str]:
+        """Training-data watermark identifying the fitted models"""
+        if self.watermark is None:
+            return None
+        return self.watermark.strftime('%Y%m%dT%H%M%S%f')
+
+    def export_state(self) -> Dict:
+        """Fitted models and settings, without the cached training matrix"""
+        return {
+            'home_id': self.home_id,
+            'config': {
+                'n_estimators': self.n_estimators,
+                'max_depth': self.max_depth,
+                'min_samples_leaf': self.min_samples_leaf,
+                'n_jobs': self.n_jobs,
+                'multi_output': self.multi_output,
+                'parallel_fit': self.parallel_fit,
+                'estimator': self.estimator,
+                'trees_per_update': self.trees_per_update,
+                'warm_window': self.warm_window,
+                'interval': self.interval,
+                'coverage': self.coverage
+            },
+            'scaler': self.scaler,
+            'model': self.model,
+            'model_production': self.model_production,
+            'model_consumption': self.model_consumption,
+            'watermark': self.watermark,
+            'features': self.feature_names,
+            'recent': self.recent,
+            'calibration': self.calibration,
+            'target_scale': self.target_scale
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'PredictionAgent':
+        """Rebuild a trained agent from export_state() output"""
+        agent = cls(state['home_id'], **state['config'])
+        agent.scaler = state['scaler']
+        agent.model = state['model']
+        agent.model_production = state['model_production']
+        agent.model_consumption = state['model_consumption']
+        agent.watermark = state['watermark']
+        agent.feature_names = tuple(state.get('features', LEGACY_FEATURES))
+        agent.recent = state.get('recent')
+        agent.calibration = state.get('calibration')
+        agent.target_scale = state.get('target_scale')
+        # Models fitted on features that are no longer computed must be retrained
+        agent.is_trained = set(agent.feature_names) <= set(FEATURES)
+        return agent
+
+    def predict_next_24h(self, current_data: EnergyData,
+                         features: Optional[FeatureStore] = None) -> List[PredictionResult]:
         """Predict energy patterns for next 24 hours"""
+        return self.predict_horizon(current_data, horizon=24, features=features)
+
+    @timed('prediction.predict')
+    def predict_horizon(self, current_data: EnergyData, horizon: int = 24,
+                        step: timedelta = timedelta(hours=1),
+                        features: Optional[FeatureStore] = None) -> List[PredictionResult]:
+        """Predict energy patterns for `horizon` steps of length `step`
+
+        The whole horizon is built as one feature matrix, scaled once and
+        passed to each model in a single predict call. Lag features come
+        from `features` (the home's live FeatureStore or a tail of it),
+        else from the rows seen in the last training.
+        """
         if not self.is_trained:
             return []
-            
-        predictions = []
-        current_time = current_data.timestamp
-        
-        for hour in range(24):
-            future_time = current_time + timedelta(hours=hour)
-            features = self._create_prediction_features(future_time, current_data)
-            
-            # Scale features
-            features_scaled = self.scaler.transform([features])
-            
-            # Make predictions
-            pred_prod = self.model_production.predict(features_scaled)[0]
-            pred_cons = self.model_consumption.predict(features_scaled)[0]
-            
-            # Calculate confidence based on prediction variance
-            confidence = self._calculate_confidence(features_scaled)
-            
-            predictions.append(PredictionResult(
-                timestamp=future_time,
-                predicted_production=pred_prod,
-                predicted_consumption=pred_cons,
-                confidence=confidence
-            ))
-            
-        return predictions
-
-    def _prepare_training_data(self, historical_data: List[EnergyData]) -> pd.DataFrame:
-        """Prepare historical data for training"""
-        data = []
-        for reading in historical_data:
-            data.append({
-                'timestamp': reading.timestamp,
-                'production': reading.production,
-                'consumption': reading.consumption,
-                'temperature': reading.weather_data.get('temperature', 20),
-                'cloud_cover': reading.weather_data.get('cloud_cover', 0),
-                'hour': reading.timestamp.hour,
-                'day_of_week': reading.timestamp.weekday()
-            })
-        return pd.DataFrame(data)
-
-    def _extract_features(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Extract features for model training"""
-        # Time-based features
-        df['hour_sin'] = np.sin(2 * np.pi * df['hour']/24)
-        df['hour_cos'] = np.cos(2 * np.pi * df['hour']/24)
-        df['day_sin'] = np.sin(2 * np.pi * df['day_of_week']/7)
-        df['day_cos'] = np.cos(2 * np.pi * df['day_of_week']/7)
-        
-        feature_columns = [
-            'hour_sin', 'hour_cos', 'day_sin', 'day_cos',
-            'temperature', 'cloud_cover'
-        ]
-        
-        return df[feature_columns]
 
-    def _create_prediction_features(self, timestamp: datetime, current_data: EnergyData) -> List:
-        """Create feature vector for prediction"""
-        hour = timestamp.hour
-        day = timestamp.weekday()
-        
+        timestamps = _horizon_timestamps(current_data.timestamp, horizon, step)
+        matrix, steps = self._create_horizon_features(current_data, horizon, step, features)
+        return self._predict_matrix(matrix, timestamps, steps)
+
+    def _predict_matrix(self, features: np.ndarray, timestamps: List[datetime],
+                        steps: np.ndarray) -> List[PredictionResult]:
+        """Scale a prepared feature matrix and predict every row, with intervals, at once"""
+        features_scaled = self.scaler.transform(features)
+        predicted, lower, upper = self._predict_intervals(features_scaled, steps)
+        confidence = interval_confidence(predicted, lower, upper, self.target_scale)
+
         return [
-            np.sin(2 * np.pi * hour/24),
-            np.cos(2 * np.pi * hour/24),
-            np.sin(2 * np.pi * day/7),
-            np.cos(2 * np.pi * day/7),
-            current_data.weather_data.get('temperature', 20),
-            current_data.weather_data.get('cloud_cover', 0)
+            PredictionResult(
+                timestamp=timestamp,
+                predicted_production=prod,
+                predicted_consumption=cons,
+                confidence=conf,
+                production_lower=prod_lower,
+                production_upper=prod_upper,
+                consumption_lower=cons_lower,
+                consumption_upper=cons_upper
+            )
+            for timestamp, (prod, cons), conf, (prod_lower, cons_lower), (prod_upper, cons_upper)
+            in zip(timestamps, predicted.tolist(), confidence.tolist(), lower.tolist(), upper.tolist())
+        ]
+
+    def _feature_store(self, historical_data: Union[List[EnergyData], ReadingStore,
+                                                    FeatureStore]) -> FeatureStore:
+        """Featurize historical data, unless it already is a FeatureStore"""
+        if isinstance(historical_data, FeatureStore):
+            return historical_data
+        if isinstance(historical_data, ReadingStore):
+            return FeatureStore.from_store(historical_data)
+        readings = sorted(historical_data, key=lambda reading: reading.timestamp)
+        timestamps = np.array([to_datetime64(reading.timestamp) for reading in readings],
+                              dtype='datetime64[us]')
+        values = np.array([
+            (reading.production, reading.consumption, reading.battery_level,
+             weather_value(reading.weather_data, 'temperature'),
+             weather_value(reading.weather_data, 'cloud_cover'))
+            for reading in readings
+        ], dtype=np.float64).reshape(len(readings), len(FIELDS))
+        return FeatureStore.from_columns(timestamps, values)
+
+    def _create_horizon_features(self, current_data: EnergyData, horizon: int, step: timedelta,
+                                 features: Optional[FeatureStore] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """The (horizon, len(feature_names)) matrix of a forecast starting at current_data, and each row's step ahead"""
+        features = features if features is not None else self.recent
+        if features is None:
+            features = FeatureStore(capacity=0)
+        timestamps = to_datetime64(current_data.timestamp) + np.arange(horizon) * np.timedelta64(step)
+        matrix = features.horizon(timestamps,
+                                  current_data.weather_data.get('temperature', 20),
+                                  current_data.weather_data.get('cloud_cover', 0))
+        return self._select(matrix), steps_ahead(timestamps, features.last_timestamp)
+
+def predict_fleet(agents: Dict[str, 'PredictionAgent'], current_data: Dict[str, EnergyData],
+                  horizon: int = 24, step: timedelta = timedelta(hours=1),
+                  features: Optional[Dict[str, FeatureStore]] = None) -> Dict[str, List[PredictionResult]]:
+    """Predict horizons for many homes with one predict call per distinct model
+
+    Homes whose agents share a fitted scaler and models (for example a
+    fleet-wide model) are stacked into a single feature matrix, so the
+    number of sklearn dispatches is bounded by the number of models rather
+    than by homes x horizon steps.
+    """
+    groups: Dict[tuple, List[str]] = {}
+    for home_id, agent in agents.items():
+        if agent.is_trained and home_id in current_data:
+            groups.setdefault(agent._model_key(), []).append(home_id)
+
+    results = {home_id: [] for home_id in agents}
+    for home_ids in groups.values():
+        agent = agents[home_ids[0]]
+        timestamps = [
+            _horizon_timestamps(current_data[home_id].timestamp, horizon, step) for home_id in home_ids
         ]
+        matrices, steps = zip(*[
+            agents[home_id]._create_horizon_features(current_data[home_id], horizon, step,
+                                                     (features or {}).get(home_id))
+            for home_id in home_ids
+        ])
+        predictions = agent._predict_matrix(np.vstack(matrices), [t for home in timestamps for t in home],
+                                            np.concatenate(steps))
+        for index, home_id in enumerate(home_ids):
+            results[home_id] = predictions[index * horizon:(index + 1) * horizon]
+    return results
+
+def _train_home(home_id: str, historical_data: Union[List[EnergyData], ReadingStore],
+                agent_kwargs: Dict) -> 'PredictionAgent':
+    agent = PredictionAgent(home_id, **agent_kwargs)
+    agent.train(historical_data)
+    return agent
 
-    def _calculate_confidence(self, features_scaled) -> float:
-        """Calculate prediction confidence score"""
-        # Simple confidence calculation based on feature similarity to training data
-        # In production, use more sophisticated uncertainty estimation
-        return 0.8  # Placeholder confidence score
+def train_fleet(histories: Dict[str, Union[List[EnergyData], ReadingStore]],
+                max_workers: Optional[int] = None, cpu_budget: Optional[int] = None,
+                **agent_kwargs) -> Dict[str, 'PredictionAgent']:
+    """Train one PredictionAgent per home across a process pool
+
+    At most `cpu_budget` cores are used in total (default: all of them):
+    the pool gets `max_workers` processes and each forest gets the
+    remaining share of the budget as its n_jobs. Homes without enough
+    history come back untrained.
+    """
+    cpu_budget = cpu_budget or os.cpu_count() or 1
+    max_workers = max(1, min(max_workers or cpu_budget, cpu_budget, len(histories) or 1))
+    agent_kwargs.setdefault('n_jobs', max(1, cpu_budget // max_workers))
+    # The pool already spends the budget, so don't add fitting threads on top
+    agent_kwargs.setdefault('parallel_fit', False)
+    if max_workers == 1:
+        return {
+            home_id: _train_home(home_id, history, agent_kwargs)
+            for home_id, history in histories.items()
+        }
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            home_id: executor.submit(_train_home, home_id, history, agent_kwargs)
+            for home_id, history in histories.items()
+        }
+        return {home_id: future.result() for home_id, future in futures.items()}
 
 class OptimizationAgent:
     """Agent responsible for optimizing energy usage"""
     
-    def __init__(self, home_id: str):
+    def __init__(self, home_id: str, buy_price: Prices = 0.20, sell_price: Prices = 0.15,
+                 max_charge_rate: float = 5.0, max_discharge_rate: float = 5.0,
+                 round_trip_efficiency: float = 0.9, soc_resolution: float = 0.1,
+                 risk_aversion: float = 0.0):
         self.home_id = home_id
         self.battery_capacity = 13.5  # kWh (Tesla Powerwall capacity)
         self.min_battery_level = 0.2
         self.max_battery_level = 0.9
+        self.buy_price = buy_price  # $/kWh, a flat rate or one price per horizon step
+        self.sell_price = sell_price
+        self.max_charge_rate = max_charge_rate  # kW
+        self.max_discharge_rate = max_discharge_rate
+        self.round_trip_efficiency = round_trip_efficiency
+        self.soc_resolution = soc_resolution  # kWh between planned battery levels
+        # Share of the downside interval (production shortfall plus consumption
+        # excess) subtracted from each step's planned net energy
+        self.risk_aversion = risk_aversion
+
+    @timed('optimization.schedule')
+    def schedule(self, current_data: EnergyData, predictions: List[PredictionResult],
+                 buy_prices: Optional[Prices] = None,
+                 sell_prices: Optional[Prices] = None) -> DispatchPlan:
+        """Plan charging, discharging and grid trades over the prediction horizon
+
+        The first step uses the current reading instead of its prediction;
+        prices default to the agent's tariff. With `risk_aversion`, hours
+        with wide prediction intervals are planned closer to their
+        pessimistic bound.
+        """
+        net_energy = np.array([p.predicted_production - p.predicted_consumption for p in predictions])
+        if self.risk_aversion:
+            downside = np.array([
+                (p.predicted_production - p.production_lower) + (p.consumption_upper - p.predicted_consumption)
+                if p.production_lower is not None else 0.0
+                for p in predictions
+            ])
+            net_energy -= self.risk_aversion * np.maximum(downside, 0.0)
+        net_energy[0] = current_data.production - current_data.consumption
+        timestamps = [p.timestamp for p in predictions]
+        step_hours = ((timestamps[1] - timestamps[0]).total_seconds() / 3600
+                      if len(timestamps) > 1 else 1.0)
+        return solve_dispatch(
+            net_energy, current_data.battery_level, self.battery_capacity,
+            self.min_battery_level, self.max_battery_level,
+            self.buy_price if buy_prices is None else buy_prices,
+            self.sell_price if sell_prices is None else sell_prices,
+            timestamps=timestamps, step_hours=step_hours,
+            max_charge_rate=self.max_charge_rate, max_discharge_rate=self.max_discharge_rate,
+            efficiency=self.round_trip_efficiency, resolution=self.soc_resolution
+        )
 
+    @timed('optimization.optimize_usage')
     def optimize_usage(self, current_data: EnergyData, 
                       predictions: List[PredictionResult]) -> Dict:
-        """Generate optimization recommendations"""
-        # Calculate current energy balance
-        net_energy = current_data.production - current_data.consumption
-        battery_headroom = self.battery_capacity * self.max_battery_level - current_data.battery_level
-        
+        """Generate optimization recommendations
+
+        With predictions the actions are the first step of the horizon
+        schedule (see `schedule`); without them a rule on the current
+        balance is used.
+        """
         # Analyze predictions
         predicted_deficit = self._calculate_predicted_deficit(predictions)
+
+        if predictions:
+            plan = self.schedule(current_data, predictions)
+            recommendations, actions = self._plan_actions(plan)
+            return {
+                'recommendations': recommendations,
+                'actions': actions,
+                'predicted_deficit': predicted_deficit,
+                'schedule': plan.to_dict()
+            }
+
+        # Calculate current energy balance
+        net_energy = current_data.production - current_data.consumption
         
         # Generate recommendations
         recommendations = []
         actions = {}
         
         if net_energy > 0:  # Current surplus
-            if predicted_deficit > 0:  # Future deficit expected
-                if battery_headroom > 0:
-                    recommendations.append("Store surplus energy for predicted future deficit")
-                    actions['store_energy'] = min(net_energy, battery_headroom)
-                else:
-                    recommendations.append("Consider selling surplus energy")
-                    actions['sell_energy'] = net_energy
-            else:
-                recommendations.append("Optimal conditions for selling energy")
-                actions['sell_energy'] = net_energy
+            recommendations.append("Optimal conditions for selling energy")
+            actions['sell_energy'] = net_energy
                 
         else:  # Current deficit
             if current_data.battery_level > self.battery_capacity * self.min_battery_level:
@@ -254,6 +743,24 @@ class OptimizationAgent:
             'predicted_deficit': predicted_deficit
         }
 
+    def _plan_actions(self, plan: DispatchPlan) -> Tuple[List[str], Dict[str, float]]:
+        """Recommendations and actions for the first step of a plan"""
+        recommendations = []
+        actions = {}
+        if plan.charge[0] > 0:
+            recommendations.append("Store energy in the battery for later use")
+            actions['store_energy'] = float(plan.charge[0])
+        if plan.discharge[0] > 0:
+            recommendations.append("Use stored battery energy")
+            actions['use_battery'] = float(plan.discharge[0])
+        if plan.sell[0] > 0:
+            recommendations.append("Optimal conditions for selling energy")
+            actions['sell_energy'] = float(plan.sell[0])
+        if plan.buy[0] > 0:
+            recommendations.append("Consider purchasing energy")
+            actions['buy_energy'] = float(plan.buy[0])
+        return recommendations, actions
+
     def _calculate_predicted_deficit(self, predictions: List[PredictionResult]) -> float:
         """Calculate predicted energy deficit over prediction period"""
         total_deficit = 0
@@ -263,7 +770,7 @@ class OptimizationAgent:
                 total_deficit += abs(net_energy)
         return total_deficit
 
-# Example usage
+# Example usage: `python -m app.energy_agents` from the backend directory
 if __name__ == "__main__":
     # Initialize agents
     monitor = MonitoringAgent("home1")
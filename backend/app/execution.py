@@ -0,0 +1,141 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, Optional
+import asyncio
+import multiprocessing
+import os
+
+
+class Overloaded(Exception):
+    """The pool's queue is full; the caller should retry later"""
+
+
+class TaskTimeout(Exception):
+    pass
+
+
+class _Pool:
+    """An executor with a bound on queued plus running tasks"""
+
+    def __init__(self, name: str, factory: Callable[[], Executor], workers: int, max_queue: int,
+                 timeout: Optional[float]):
+        self.name = name
+        self.workers = workers
+        self.limit = workers + max_queue
+        self.timeout = timeout
+        self._factory = factory
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+        self._lock = Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, fn: Callable, *args) -> asyncio.Future:
+        with self._lock:
+            if self._pending >= self.limit:
+                raise Overloaded(f"{self.name} queue is full ({self._pending} tasks)")
+            if self._executor is None:
+                self._executor = self._factory()
+            try:
+                future = self._executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # A worker died; start a fresh pool for this and later tasks
+                self._executor = self._factory()
+                future = self._executor.submit(fn, *args)
+            self._pending += 1
+        # The slot is only freed when the task really ends, even after a timeout
+        future.add_done_callback(self._release)
+        return asyncio.wrap_future(future)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+class ExecutionLayer:
+    """Runs blocking agent work off the event loop
+
+    CPU-bound work (model training) goes to a process pool so it neither
+    holds the GIL nor the loop; lighter NumPy work (inference, fleet
+    optimization) goes to a thread pool. Each pool accepts at most its
+    worker count plus `max_queue` tasks and raises Overloaded beyond that,
+    awaiting a task raises TaskTimeout after its timeout, and calls that
+    pass the same `key` while a task is running share its result instead
+    of submitting another.
+    """
+
+    def __init__(self, cpu_workers: Optional[int] = None, threads: Optional[int] = None,
+                 max_queue: int = 32, cpu_timeout: Optional[float] = 300.0,
+                 thread_timeout: Optional[float] = 30.0):
+        cpu_workers = cpu_workers or max(1, (os.cpu_count() or 2) - 1)
+        threads = threads or min(32, (os.cpu_count() or 1) + 4)
+        # Spawned rather than forked: the API process runs threads (log writer, thread pool).
+        # Workers re-import the main module, so it must not build the app (see app/__main__.py)
+        context = multiprocessing.get_context("spawn")
+        self.cpu = _Pool("process pool",
+                         lambda: ProcessPoolExecutor(cpu_workers, mp_context=context),
+                         cpu_workers, max_queue, cpu_timeout)
+        self.threads = _Pool("thread pool",
+                             lambda: ThreadPoolExecutor(threads, thread_name_prefix="agent-work"),
+                             threads, max_queue, thread_timeout)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    @classmethod
+    def from_env(cls) -> 'ExecutionLayer':
+        """Configure from ENERGY_CPU_WORKERS, ENERGY_THREADS, ENERGY_MAX_QUEUE,
+        ENERGY_CPU_TIMEOUT and ENERGY_THREAD_TIMEOUT"""
+        def number(name: str, default, kind=int):
+            value = os.environ.get(name)
+            return kind(value) if value else default
+        return cls(
+            cpu_workers=number("ENERGY_CPU_WORKERS", None),
+            threads=number("ENERGY_THREADS", None),
+            max_queue=number("ENERGY_MAX_QUEUE", 32),
+            cpu_timeout=number("ENERGY_CPU_TIMEOUT", 300.0, float),
+            thread_timeout=number("ENERGY_THREAD_TIMEOUT", 30.0, float)
+        )
+
+    async def _run(self, pool: _Pool, fn: Callable, args: tuple, key: Optional[Hashable],
+                   timeout: Optional[float]) -> Any:
+        if key is not None and key in self._inflight:
+            future = self._inflight[key]
+        else:
+            future = pool.submit(fn, *args)
+            if key is not None:
+                self._inflight[key] = future
+                future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        try:
+            # Shielded so one caller timing out does not cancel the shared task
+            return await asyncio.wait_for(asyncio.shield(future), timeout or pool.timeout)
+        except asyncio.TimeoutError:
+            raise TaskTimeout(f"Task did not finish within {timeout or pool.timeout} s")
+
+    async def run_cpu(self, fn: Callable, *args, key: Optional[Hashable] = None,
+                      timeout: Optional[float] = None) -> Any:
+        """Run a picklable function in the process pool"""
+        return await self._run(self.cpu, fn, args, key, timeout)
+
+    async def run_thread(self, fn: Callable, *args, key: Optional[Hashable] = None,
+                         timeout: Optional[float] = None) -> Any:
+        """Run a function in the thread pool"""
+        return await self._run(self.threads, fn, args, key, timeout)
+
+    def stats(self) -> Dict:
+        return {
+            'process_pool_pending': self.cpu.pending,
+            'thread_pool_pending': self.threads.pending,
+            'coalesced_keys': len(self._inflight)
+        }
+
+    def shutdown(self):
+        self.cpu.shutdown()
+        self.threads.shutdown()
@@ -0,0 +1,279 @@
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+import numpy as np
+
+from .store import FIELDS, ReadingStore, to_datetime64
+
+# Values the models predict, and whose history becomes lag features
+TARGETS = ('production', 'consumption')
+
+# History features only use readings at least HORIZON older than their row,
+# so a forecast has the same inputs as training up to HORIZON ahead
+HORIZON = timedelta(hours=24)
+# Lags by time: the same hour yesterday and a week ago
+LAGS = (HORIZON, 7 * HORIZON)
+# The rolling mean covers the WINDOW before the HORIZON lag; the EWMA (as of
+# that lag) halves a reading's weight every HALF_LIFE
+WINDOW = timedelta(hours=24)
+HALF_LIFE = timedelta(hours=8)
+
+FEATURES = (
+    ('hour_sin', 'hour_cos', 'day_sin', 'day_cos', 'temperature', 'cloud_cover')
+    + tuple(f'{name}_lag_{lag // timedelta(hours=1)}h' for lag in LAGS for name in TARGETS)
+    + tuple(f'{name}_mean_{WINDOW // timedelta(hours=1)}h' for name in TARGETS)
+    + tuple(f'{name}_ewma' for name in TARGETS)
+)
+
+# Span of readings a forecast needs to compute its features
+CONTEXT = max(max(LAGS), HORIZON + WINDOW) + HORIZON
+
+_TARGET_COLUMNS = [FIELDS.index(name) for name in TARGETS]
+_WEATHER_COLUMNS = [FIELDS.index('temperature'), FIELDS.index('cloud_cover')]
+_US_PER_HOUR = 3600 * 10**6
+_US_PER_DAY = 24 * _US_PER_HOUR
+
+
+def _cyclic_table(period: int) -> np.ndarray:
+    angles = 2 * np.pi * np.arange(period) / period
+    return np.column_stack([np.sin(angles), np.cos(angles)]).astype(np.float32)
+
+
+# Sin/cos encodings looked up by hour of day and by weekday (Monday = 0)
+HOUR_TABLE = _cyclic_table(24)
+WEEKDAY_TABLE = _cyclic_table(7)
+
+
+def calendar_features(timestamps: np.ndarray) -> np.ndarray:
+    """(rows, 4) hour and weekday encodings of datetime64 timestamps"""
+    us = np.asarray(timestamps, dtype='datetime64[us]').astype(np.int64)
+    hours = us // _US_PER_HOUR % 24
+    weekdays = (us // _US_PER_DAY + 3) % 7  # 1970-01-01 was a Thursday
+    return np.hstack([HOUR_TABLE[hours], WEEKDAY_TABLE[weekdays]])
+
+
+def _ewma_states(values: np.ndarray, decay: np.ndarray, state: np.ndarray,
+                 chunk: int = 32) -> np.ndarray:
+    """EWMA after each row, where row i keeps `decay[i]` of the previous state
+
+    Solved in closed form a chunk at a time; chunks stay short and decays
+    are kept above 1e-3 so the inverse decay products cannot overflow or
+    lose precision.
+    """
+    decay = np.maximum(decay, 1e-3)[:, None]
+    after = np.empty_like(values)
+    for lo in range(0, len(values), chunk):
+        part = values[lo:lo + chunk]
+        products = np.cumprod(decay[lo:lo + chunk], axis=0)
+        after[lo:lo + len(part)] = products * (
+            state + np.cumsum((1 - decay[lo:lo + chunk]) * part / products, axis=0))
+        state = after[lo + len(part) - 1]
+    return after
+
+
+def _known(times: np.ndarray, lag: timedelta, last: np.datetime64) -> np.ndarray:
+    """`times` - `lag`, moved back by further whole lags while after `last`
+
+    Within the readings this is the plain lag; beyond them it repeats the
+    last known cycle of the lag.
+    """
+    step = np.timedelta64(lag, 'us')
+    moments = times - step
+    beyond = (moments - last).astype(np.int64)
+    cycles = np.maximum(-(-beyond // step.astype(np.int64)), 0)
+    return moments - cycles * step
+
+
+class FeatureStore:
+    """Model features of one home's readings, appended as the readings arrive
+
+    Each row holds the calendar encodings (from lookup tables), the
+    weather and the lag, rolling-mean and EWMA features of the targets.
+    History features are looked up by time, not by row count, and only
+    from readings at least HORIZON older than the row, so they mean the
+    same with hourly or minute readings and a forecast up to HORIZON ahead
+    gets exactly the inputs the models were trained on. Rows live in one
+    contiguous float32 matrix next to a float64 target matrix, so training
+    reads both without per-row work; per-row running sums and EWMA states
+    make each lookup a binary search. Readings must arrive in timestamp
+    order; callers rebuild the store with `from_store` after late data.
+
+    Rows without enough earlier readings use what is there: lookups before
+    the first reading fall back to it, and the very first row gets zeros.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        capacity = max(int(capacity), 16)
+        self._start = 0
+        self._size = 0
+        self._timestamps = np.empty(capacity, dtype='datetime64[us]')
+        self._X = np.empty((capacity, len(FEATURES)), dtype=np.float32)
+        self._y = np.empty((capacity, len(TARGETS)), dtype=np.float64)
+        # Running sums of the targets and the EWMA including each row
+        self._sums = np.empty((capacity, len(TARGETS)), dtype=np.float64)
+        self._ewmas = np.empty((capacity, len(TARGETS)), dtype=np.float64)
+        self.dropped = 0  # Rows dropped by keep_last
+
+    def __len__(self) -> int:
+        return self._size
+
+    @classmethod
+    def from_columns(cls, timestamps: np.ndarray, values: np.ndarray) -> 'FeatureStore':
+        features = cls(capacity=len(timestamps))
+        features.extend(timestamps, values)
+        return features
+
+    @classmethod
+    def from_store(cls, store: ReadingStore) -> 'FeatureStore':
+        return cls.from_columns(store.timestamps, store.values())
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self._timestamps[self._start:self._start + self._size]
+
+    @property
+    def last_timestamp(self) -> Optional[np.datetime64]:
+        return self._timestamps[self._start + self._size - 1] if self._size else None
+
+    def matrix(self, start: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """Feature (float32) and target (float64) rows from local index `start` on"""
+        rows = slice(self._start + start, self._start + self._size)
+        return self._X[rows], self._y[rows]
+
+    def index_after(self, timestamp: Optional[datetime]) -> int:
+        """Local index of the first row newer than `timestamp`"""
+        if timestamp is None:
+            return 0
+        return int(np.searchsorted(self.timestamps, to_datetime64(timestamp), side='right'))
+
+    def extend(self, timestamps: np.ndarray, values: np.ndarray):
+        """Append readings (a (rows, len(FIELDS)) block) newer than every stored one"""
+        timestamps = np.asarray(timestamps, dtype='datetime64[us]')
+        count = len(timestamps)
+        if count == 0:
+            return
+        values = np.asarray(values, dtype=np.float64).reshape(count, len(FIELDS))
+        if count > 1 and (np.diff(timestamps) < np.timedelta64(0)).any():
+            order = np.argsort(timestamps, kind='stable')
+            timestamps, values = timestamps[order], values[order]
+        targets = values[:, _TARGET_COLUMNS]
+
+        self._reserve(count)
+        end = self._start + self._size
+        rows = slice(end, end + count)
+        if self._size:
+            previous = self._timestamps[end - 1]
+            sums, state = self._sums[end - 1], self._ewmas[end - 1]
+        else:
+            # The EWMA starts at the first reading
+            previous, sums, state = timestamps[0], 0.0, targets[0]
+        gaps = np.diff(np.concatenate([[previous], timestamps]))
+        self._timestamps[rows] = timestamps
+        self._y[rows] = targets
+        self._sums[rows] = sums + np.cumsum(targets, axis=0)
+        self._ewmas[rows] = _ewma_states(targets, 0.5 ** (gaps / np.timedelta64(HALF_LIFE, 'us')), state)
+        self._size += count
+
+        X = self._X[rows]
+        X[:, :4] = calendar_features(timestamps)
+        X[:, 4:6] = values[:, _WEATHER_COLUMNS]
+        X[:, 6:] = self._history_features(timestamps)
+
+    def _history_features(self, times: np.ndarray, known: Optional[int] = None) -> np.ndarray:
+        """Lag, rolling-mean and EWMA columns of rows at `times`, from the first `known` readings"""
+        live = slice(self._start, self._start + (self._size if known is None else known))
+        timestamps, y = self._timestamps[live], self._y[live]
+        sums, ewmas = self._sums[live], self._ewmas[live]
+
+        def at_or_before(moments: np.ndarray) -> np.ndarray:
+            return np.searchsorted(timestamps, moments, side='right') - 1
+
+        def lookup(column: np.ndarray, index: np.ndarray) -> np.ndarray:
+            # Before the first reading use it, unless it is not older than the row
+            index = np.maximum(index, 0)
+            return np.where((timestamps[index] < times)[:, None], column[index], 0.0)
+
+        last = timestamps[-1]
+        columns = [lookup(y, at_or_before(_known(times, lag, last))) for lag in LAGS]
+
+        anchor = _known(times, HORIZON, last)
+        hi, lo = at_or_before(anchor), at_or_before(anchor - np.timedelta64(WINDOW, 'us'))
+        total = np.where((hi >= 0)[:, None], sums[np.maximum(hi, 0)], 0.0) \
+            - np.where((lo >= 0)[:, None], sums[np.maximum(lo, 0)], 0.0)
+        counts = (hi - lo)[:, None]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(counts > 0, total / counts, columns[0])
+        columns.append(np.where((timestamps[np.maximum(hi, 0)] < times)[:, None], mean, 0.0))
+        columns.append(lookup(ewmas, hi))
+        return np.hstack(columns)
+
+    def horizon(self, timestamps: np.ndarray, temperature: float, cloud_cover: float,
+                known: Optional[int] = None) -> np.ndarray:
+        """Feature rows for future timestamps following the newest reading
+
+        Up to HORIZON past the newest reading the history features are
+        computed exactly as in training; further ahead each lookup repeats
+        the last known cycle of its lag (yesterday's profile, last week's).
+        The weather is held at the given values. With `known` only the
+        first `known` rows count as read, so stored rows can be replayed
+        as forecasts made before them.
+        """
+        timestamps = np.asarray(timestamps, dtype='datetime64[us]')
+        X = np.zeros((len(timestamps), len(FEATURES)), dtype=np.float32)
+        X[:, :4] = calendar_features(timestamps)
+        X[:, 4] = temperature
+        X[:, 5] = cloud_cover
+        if (self._size if known is None else known) > 0:
+            X[:, 6:] = self._history_features(timestamps, known)
+        return X
+
+    def _reserve(self, count: int):
+        end = self._start + self._size
+        if end + count <= len(self._y):
+            return
+        needed = self._size + count
+        capacity = len(self._y)
+        while capacity < 2 * needed:
+            capacity *= 2
+        self._compact(capacity)
+
+    def _columns(self) -> Tuple[np.ndarray, ...]:
+        return self._timestamps, self._X, self._y, self._sums, self._ewmas
+
+    def _compact(self, capacity: int):
+        """Move the live rows to the front of buffers of the given capacity"""
+        live = slice(self._start, self._start + self._size)
+        resized = []
+        for column in self._columns():
+            target = column if capacity == len(column) else np.empty((capacity,) + column.shape[1:], dtype=column.dtype)
+            target[:self._size] = column[live]
+            resized.append(target)
+        self._timestamps, self._X, self._y, self._sums, self._ewmas = resized
+        self._start = 0
+
+    def keep_last(self, count: int):
+        """Drop the oldest rows beyond `count`; their buffer space is reused on the next growth"""
+        if self._size > count:
+            drop = self._size - count
+            self._start += drop
+            self._size -= drop
+            self.dropped += drop
+
+    def tail(self, span: timedelta = CONTEXT) -> 'FeatureStore':
+        """Copy of the rows within `span` of the newest one (and one before), enough for `horizon`"""
+        if not self._size:
+            return FeatureStore(capacity=0)
+        start = max(0, int(np.searchsorted(self.timestamps, self.last_timestamp - span, side='left')) - 1)
+        return self._copy_from(start)
+
+    def copy(self) -> 'FeatureStore':
+        return self._copy_from(0)
+
+    def _copy_from(self, start: int) -> 'FeatureStore':
+        size = self._size - start
+        copy = FeatureStore(capacity=size)
+        rows = slice(self._start + start, self._start + self._size)
+        for target, column in zip(copy._columns(), self._columns()):
+            target[:size] = column[rows]
+        copy._size = size
+        copy.dropped = self.dropped + start
+        return copy
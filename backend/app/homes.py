@@ -0,0 +1,333 @@
+from datetime import datetime, timedelta, timezone
+from threading import Lock, RLock
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import weakref
+import numpy as np
+
+from .energy_agents import MIN_TRAINING_ROWS, PredictionAgent
+from .features import FeatureStore
+from .metrics import READINGS_INGESTED, timed
+from .persistence import Columns, ReadingLog, concat_columns, empty_columns
+from .registry import ModelRegistry
+from .rollups import Rollups
+from .store import ReadingStore, to_datetime64, weather_value
+
+DEFAULT_HOME_ID = "default"
+
+# Resume point of a paged read: (timestamp, rows at that timestamp already read)
+Position = Tuple[np.datetime64, int]
+
+
+class DataStore:
+    """Readings, models and settings of one home
+
+    Every home is an independent shard with its own lock, so ingestion or
+    training for one home never waits on another. Without a ReadingLog the
+    readings live only in memory; with one every write is also appended to
+    durable storage, `readings` only keeps the recent `memory_window` and is
+    reloaded from the log when the shard is created after a restart.
+
+    With a ModelRegistry the shard only holds a weak reference to its
+    predictor, so the registry's memory budget decides which homes keep
+    their model loaded; an evicted one is loaded again on next use.
+    """
+
+    def __init__(self, home_id: str = DEFAULT_HOME_ID, max_readings: Optional[int] = None,
+                 registry: Optional[ModelRegistry] = None, log: Optional[ReadingLog] = None,
+                 memory_window: Optional[timedelta] = None):
+        self.home_id = home_id
+        self.readings = ReadingStore(max_readings=max_readings, retention=memory_window)
+        # Aggregates for history charts; they outlive the in-memory readings
+        self.rollups = Rollups()
+        # Model features, one row per in-memory reading
+        self.features = FeatureStore()
+        self.battery_capacity = 13.5  # kWh (Tesla Powerwall capacity)
+        self.registry = registry
+        self.log = log
+        self.memory_window = memory_window
+        self._predictor: Optional[PredictionAgent] = None
+        self._predictor_ref: Optional[weakref.ref] = None
+        self.retrain_every = 60  # New readings before the model is refreshed
+        self.lock = RLock()
+        # Serializes installing trained models, whose registry writes run without `lock`
+        self._publish_lock = Lock()
+        if log is not None:
+            self.restore()
+
+    def restore(self):
+        """Reload the in-memory window, and rebuild the rollups, from durable storage
+
+        The rollups outlive the memory window, so the older history is
+        aggregated into them chunk by chunk as well.
+        """
+        start = datetime.now(timezone.utc) - self.memory_window if self.memory_window is not None else None
+        with self.lock:
+            if start is not None:
+                for timestamps, values, _ in self.log.iter_range(self.home_id, end=start):
+                    self.rollups.add(timestamps, values)
+            timestamps, values, conditions = self.log.read_range(self.home_id, start=start)
+            self.readings.extend(timestamps, values, conditions)
+            self.rollups.add(timestamps, values)
+            self._add_features(timestamps, values)
+
+    def add_reading(self, reading) -> int:
+        """Store one EnergyReading-like object and return its reading id"""
+        weather = reading.weather_data
+        timestamps = np.array([to_datetime64(reading.timestamp)])
+        values = np.array([[reading.production, reading.consumption, reading.battery_level,
+                            weather_value(weather, 'temperature'), weather_value(weather, 'cloud_cover')]],
+                          dtype=np.float64)
+        with self.lock:
+            self.readings.append_reading(reading)
+            self.rollups.add(timestamps, values)
+            self._add_features(timestamps, values)
+            if self.log is not None:
+                self.log.append(self.home_id, timestamps, values, [str(weather_value(weather, 'condition'))])
+            READINGS_INGESTED.inc(path='single')
+            return self.readings.total_appended
+
+    def add_batch(self, timestamps: np.ndarray, values: np.ndarray, conditions: Sequence[str]) -> int:
+        """Store a column batch (see ReadingStore.extend) and return its size"""
+        with self.lock:
+            count = self.readings.extend(timestamps, values, conditions)
+            self.rollups.add(timestamps, values)
+            self._add_features(timestamps, values)
+            if self.log is not None and count:
+                self.log.append(self.home_id, timestamps, values, conditions)
+            READINGS_INGESTED.inc(count, path='batch')
+            return count
+
+    def _add_features(self, timestamps: np.ndarray, values: np.ndarray):
+        last = self.features.last_timestamp
+        if last is not None and len(timestamps) and np.min(timestamps) < last:
+            # Late readings change the lags of every later row
+            self.features = FeatureStore.from_store(self.readings)
+        else:
+            self.features.extend(timestamps, values)
+            self.features.keep_last(len(self.readings))
+
+    def recent_features(self) -> FeatureStore:
+        """Copy of the newest feature rows, enough to build a forecast's lag features"""
+        with self.lock:
+            return self.features.tail()
+
+    def history(self, start: Optional[datetime] = None,
+                end: Optional[datetime] = None) -> ReadingStore:
+        """Readings in [start, end), read from durable storage when available
+
+        Use this instead of `readings` for training or queries that reach
+        past the in-memory window.
+        """
+        if self.log is None:
+            return self.snapshot(start, end)
+        columns = self.log.read_range(self.home_id, start, end)
+        store = ReadingStore(capacity=len(columns[0]))
+        store.extend(*columns)
+        return store
+
+    def iter_history(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                     chunk_rows: int = 10000) -> Iterator[Columns]:
+        """Readings in [start, end) as column chunks of at most `chunk_rows`
+
+        Each chunk is copied under the lock (or read from the log) on demand,
+        so an export never materializes the whole range.
+        """
+        if self.log is not None:
+            for timestamps, values, conditions in self.log.iter_range(self.home_id, start, end):
+                for lo in range(0, len(timestamps), chunk_rows):
+                    yield (timestamps[lo:lo + chunk_rows], values[lo:lo + chunk_rows],
+                           conditions[lo:lo + chunk_rows])
+            return
+        after = None
+        while True:
+            columns, after = self.page(start, end, chunk_rows, after)
+            if len(columns[0]):
+                yield columns
+            if after is None:
+                return
+
+    def page(self, start: Optional[datetime], end: Optional[datetime], limit: int,
+             after: Optional[Position] = None) -> Tuple[Columns, Optional[Position]]:
+        """Up to `limit` readings in [start, end) and the position after them
+
+        A position is (timestamp, rows with that timestamp already returned),
+        so it stays valid while newer readings are appended. Readings older
+        than the in-memory window are paged from the log and the rest from
+        memory, so one cursor walks the whole stored history.
+        """
+        with self.lock:
+            first = self.readings.timestamps[0] if len(self.readings) else None
+        end64 = to_datetime64(end) if end is not None else None
+        lower = after[0] if after is not None else (to_datetime64(start) if start is not None else None)
+        if self.log is None or (first is not None and lower is not None and lower >= first):
+            return self._page_memory(start, end, limit, after)
+
+        log_end = first if end64 is None or (first is not None and first < end64) else end64
+        columns, position = self._page_log(start, log_end, limit, after)
+        if position is not None or first is None or (end64 is not None and end64 <= first):
+            return columns, position
+        # The log ran out before the in-memory window; fill the page from memory
+        rest, position = self._page_memory(None, end, limit - len(columns[0]), None)
+        return concat_columns([columns, rest]), position
+
+    def _page_log(self, start: Optional[datetime], end: Optional[np.datetime64], limit: int,
+                  after: Optional[Position]) -> Tuple[Columns, Optional[Position]]:
+        """Like `page`, over the logged readings in [start, end)
+
+        Chunks can arrive out of time order (late readings), so each is
+        merged into a sorted buffer cut to the rows the page needs.
+        """
+        skip = after[1] if after is not None else 0
+        keep = skip + limit + 1
+        buffer = empty_columns()
+        chunks = self.log.iter_range(self.home_id, after[0].item() if after is not None else start,
+                                     end.item() if end is not None else None)
+        for chunk in chunks:
+            buffer = tuple(column[:keep] for column in concat_columns([buffer, chunk]))
+        timestamps, values, conditions = (column[skip:] for column in buffer)
+        columns = (timestamps[:limit], values[:limit], conditions[:limit])
+        if len(timestamps) <= limit:
+            return columns, None
+        resume = timestamps[limit]
+        done = int(np.count_nonzero(columns[0] == resume))
+        if after is not None and resume == after[0]:
+            done += skip
+        return columns, (resume, done)
+
+    def _page_memory(self, start: Optional[datetime], end: Optional[datetime], limit: int,
+                     after: Optional[Position]) -> Tuple[Columns, Optional[Position]]:
+        with self.lock:
+            timestamps = self.readings.timestamps
+            lo, hi = self.readings.index_range(start, end)
+            if after is not None:
+                lo = max(lo, int(np.searchsorted(timestamps, after[0], side='left')) + after[1])
+            stop = max(lo, min(hi, lo + limit))
+            names = np.array(self.readings.condition_names, dtype=object)
+            columns = (timestamps[lo:stop].copy(), self.readings.values(lo, stop).copy(),
+                       names[self.readings.condition_codes[lo:stop]])
+            if stop >= hi:
+                return columns, None
+            resume = timestamps[stop]
+            return columns, (resume, stop - int(np.searchsorted(timestamps, resume, side='left')))
+
+    def snapshot(self, start: Optional[datetime] = None,
+                 end: Optional[datetime] = None) -> ReadingStore:
+        """Copy of the in-memory readings in [start, end)"""
+        with self.lock:
+            lo, hi = self.readings.index_range(start, end)
+            columns = (self.readings.timestamps[lo:hi], self.readings.values(lo, hi),
+                       np.array(self.readings.condition_names, dtype=object)[self.readings.condition_codes[lo:hi]])
+            # Copied while locked: the columns are views of the live buffers
+            store = ReadingStore(capacity=len(columns[0]))
+            store.extend(*columns)
+        return store
+
+    @property
+    def predictor(self) -> Optional[PredictionAgent]:
+        """The installed agent, or None once the registry has evicted it"""
+        if self._predictor_ref is not None:
+            return self._predictor_ref()
+        return self._predictor
+
+    @predictor.setter
+    def predictor(self, agent: Optional[PredictionAgent]):
+        if self.registry is not None and agent is not None:
+            self._predictor, self._predictor_ref = None, weakref.ref(agent)
+        else:
+            self._predictor, self._predictor_ref = agent, None
+
+    @timed('store.get_predictor')
+    def get_predictor(self) -> Optional[PredictionAgent]:
+        """Return a trained PredictionAgent, training or refreshing it when needed
+
+        Trains in the calling thread; the API runs `training_job` in a
+        process pool instead (see fit_predictor).
+        """
+        job = self.training_job()
+        if job is not None:
+            self.finish_training(fit_predictor(*job))
+        return self.predictor
+
+    def training_job(self) -> Optional[Tuple[PredictionAgent, FeatureStore, bool]]:
+        """Arguments for fit_predictor when the model is missing or stale, else None
+
+        The feature matrix is copied, so the job can run without the lock
+        while new readings keep arriving. A saved model is loaded from the
+        registry first, without the lock, so call this off the event loop.
+        """
+        predictor = self.predictor
+        if predictor is None and self.registry is not None:
+            agent = self.registry.get(self.home_id)
+            with self.lock:
+                predictor = self.predictor
+                if predictor is None:
+                    self.predictor = predictor = agent
+
+        with self.lock:
+            if predictor is None or not predictor.is_trained:
+                if len(self.features) < MIN_TRAINING_ROWS:
+                    return None  # Training would fail; use the baseline until there is more data
+                return PredictionAgent(self.home_id), self.features.copy(), False
+            if self._readings_since(predictor.watermark) >= self.retrain_every:
+                return predictor, self.features.copy(), True
+            return None
+
+    def finish_training(self, agent: Optional[PredictionAgent]) -> Optional[PredictionAgent]:
+        """Install the result of a training job and return the current predictor
+
+        The model is saved to the registry before it is installed, without
+        holding the lock, so call this off the event loop too.
+        """
+        if agent is not None:
+            with self._publish_lock:
+                if agent is not self.predictor:
+                    if self.registry is not None:
+                        self.registry.save(agent)
+                    with self.lock:
+                        self.predictor = agent
+        return self.predictor
+
+    def _readings_since(self, watermark: datetime) -> int:
+        lo, hi = self.readings.index_range(start=watermark + timedelta(microseconds=1))
+        return hi - lo
+
+
+def fit_predictor(agent: PredictionAgent, history: FeatureStore,
+                  incremental: bool) -> Optional[PredictionAgent]:
+    """Train an agent on a home's history; None when there is too little data
+
+    Runs in a worker process, so `agent` is a copy and the caller installs
+    the returned one with DataStore.finish_training.
+    """
+    return agent if agent.train(history, incremental=incremental) else None
+
+
+class HomeShards:
+    """Per-home DataStores, created on first use"""
+
+    def __init__(self, factory: Callable[[str], DataStore]):
+        self._factory = factory
+        self._shards: Dict[str, DataStore] = {}
+        self._lock = Lock()  # Only guards shard creation
+
+    def get(self, home_id: str) -> DataStore:
+        shard = self._shards.get(home_id)
+        if shard is None:
+            with self._lock:
+                shard = self._shards.get(home_id)
+                if shard is None:
+                    shard = self._factory(home_id)
+                    self._shards[home_id] = shard
+        return shard
+
+    def __contains__(self, home_id: str) -> bool:
+        return home_id in self._shards
+
+    def __iter__(self) -> Iterator[DataStore]:
+        return iter(list(self._shards.values()))
+
+    def __len__(self) -> int:
+        return len(self._shards)
+
+    def home_ids(self) -> List[str]:
+        return list(self._shards)
@@ -0,0 +1,183 @@
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Sequence, Tuple
+import csv
+import io
+import json
+import numpy as np
+
+from .metrics import timed
+from .store import FIELDS, ReadingStore
+
+# Fields read from the top level of a reading; the rest of FIELDS come
+# from its weather_data
+READING_FIELDS = ('production', 'consumption', 'battery_level')
+
+# Rows parsed from a stream before they are validated and stored together
+STREAM_BATCH_SIZE = 10000
+
+
+@dataclass
+class ReadingBatch:
+    """Columnar batch of parsed readings plus per-row validation errors"""
+    timestamps: np.ndarray
+    values: np.ndarray
+    conditions: np.ndarray
+    valid: np.ndarray
+    errors: Dict[int, str] = field(default_factory=dict)
+    offset: int = 0  # Index of the first row within the whole upload
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def valid_columns(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Timestamps, values and conditions of the valid rows"""
+        return self.timestamps[self.valid], self.values[self.valid], self.conditions[self.valid]
+
+    def store_into(self, store: ReadingStore) -> int:
+        """Append the valid rows to a store in one operation"""
+        return store.extend(*self.valid_columns())
+
+    def error_list(self) -> List[Dict]:
+        return [{"index": self.offset + index, "error": error} for index, error in sorted(self.errors.items())]
+
+
+def _weather_field(record: Dict, key: str):
+    weather = record.get('weather_data')
+    if isinstance(weather, dict) and key in weather:
+        return weather[key]
+    # CSV uploads carry the weather fields as flat columns
+    return record.get(key)
+
+
+@timed('ingest.parse')
+def parse_records(records: Sequence, offset: int = 0) -> ReadingBatch:
+    """Convert reading dicts to columns and validate them with array masks
+
+    A row is rejected when its timestamp does not parse, a numeric field is
+    missing or not finite, the weather condition is missing, or production or
+    consumption is negative (the same rule as POST /readings).
+    """
+    import pandas as pd
+
+    count = len(records)
+    not_object = np.fromiter((not isinstance(r, dict) for r in records), dtype=bool, count=count)
+    records = [r if isinstance(r, dict) else {} for r in records]
+
+    timestamps = pd.to_datetime(
+        pd.Series([r.get('timestamp') for r in records], dtype=object),
+        errors='coerce', utc=True, format='ISO8601'
+    ).dt.tz_convert(None).to_numpy(dtype='datetime64[us]')
+
+    values = np.empty((count, len(FIELDS)), dtype=np.float64)
+    for name in FIELDS:
+        if name in READING_FIELDS:
+            column = [r.get(name) for r in records]
+        else:
+            column = [_weather_field(r, name) for r in records]
+        values[:, FIELDS.index(name)] = pd.to_numeric(
+            pd.Series(column, dtype=object), errors='coerce'
+        ).to_numpy(dtype=np.float64, na_value=np.nan)
+
+    conditions = np.array([_weather_field(r, 'condition') for r in records], dtype=object)
+
+    checks = [
+        (not_object, "reading must be an object"),
+        (np.isnat(timestamps), "missing or invalid timestamp"),
+    ]
+    for name in FIELDS:
+        checks.append((~np.isfinite(values[:, FIELDS.index(name)]), f"missing or invalid {name}"))
+    checks.append((np.equal(conditions, None), "missing condition"))
+    production = values[:, FIELDS.index('production')]
+    consumption = values[:, FIELDS.index('consumption')]
+    with np.errstate(invalid='ignore'):
+        checks.append(((production < 0) | (consumption < 0), "Invalid energy values"))
+
+    valid = np.ones(count, dtype=bool)
+    errors: Dict[int, str] = {}
+    for mask, message in checks:
+        # Report only the first failing check of each row
+        for index in np.flatnonzero(mask & valid):
+            errors[int(index)] = message
+        valid &= ~mask
+
+    return ReadingBatch(timestamps, values, conditions, valid, errors, offset)
+
+
+def _decode(line: str):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def decode_message(message: str) -> List:
+    """Decode a JSON object, a JSON array or NDJSON text into reading records
+
+    Lines that are not valid JSON become None and are rejected on parsing.
+    """
+    try:
+        payload = json.loads(message)
+    except ValueError:
+        return [_decode(line) for line in message.splitlines() if line.strip()]
+    return payload if isinstance(payload, list) else [payload]
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line.decode('utf-8')
+    if buffer:
+        yield buffer.decode('utf-8')
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes],
+                      batch_size: int = STREAM_BATCH_SIZE) -> AsyncIterator[ReadingBatch]:
+    """Parse an NDJSON byte stream into validated batches"""
+    records: List = []
+    bad_json: Dict[int, str] = {}
+    offset = 0
+    async for line in _lines(chunks):
+        if not line.strip():
+            continue
+        record = _decode(line)
+        if record is None:
+            bad_json[len(records)] = "invalid JSON"
+        records.append(record)
+        if len(records) >= batch_size:
+            yield _with_errors(parse_records(records, offset), bad_json)
+            offset += len(records)
+            records, bad_json = [], {}
+    if records:
+        yield _with_errors(parse_records(records, offset), bad_json)
+
+
+async def iter_csv(chunks: AsyncIterator[bytes],
+                   batch_size: int = STREAM_BATCH_SIZE) -> AsyncIterator[ReadingBatch]:
+    """Parse a CSV byte stream (with a header row) into validated batches"""
+    header = None
+    records: List[Dict] = []
+    offset = 0
+    async for line in _lines(chunks):
+        if not line.strip():
+            continue
+        row = next(csv.reader(io.StringIO(line)))
+        if header is None:
+            header = [name.strip() for name in row]
+            continue
+        records.append(dict(zip(header, row)))
+        if len(records) >= batch_size:
+            yield parse_records(records, offset)
+            offset += len(records)
+            records = []
+    if records:
+        yield parse_records(records, offset)
+
+
+def _with_errors(batch: ReadingBatch, errors: Dict[int, str]) -> ReadingBatch:
+    for index, error in errors.items():
+        batch.errors[index] = error
+        batch.valid[index] = False
+    return batch
@@ -0,0 +1,415 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from pathlib import Path
+from threading import Condition, Lock, RLock, Thread
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote, unquote
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+import numpy as np
+
+from .store import FIELDS, to_datetime64
+
+try:
+    import fcntl
+except ImportError:  # No cross-process locking (Windows): one process per data directory
+    fcntl = None
+
+# (timestamps as datetime64[us], values as (rows, len(FIELDS)), conditions as str array)
+Columns = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+logger = logging.getLogger(__name__)
+
+_US_PER_DAY = 86_400_000_000
+_EPOCH = date(1970, 1, 1)
+
+
+def empty_columns() -> Columns:
+    return (np.empty(0, dtype='datetime64[us]'),
+            np.empty((0, len(FIELDS)), dtype=np.float64),
+            np.empty(0, dtype=object))
+
+
+def concat_columns(parts: List[Columns]) -> Columns:
+    """Concatenate column chunks and sort them by timestamp"""
+    parts = [part for part in parts if len(part[0])]
+    if not parts:
+        return empty_columns()
+    if len(parts) == 1:
+        return parts[0]
+    timestamps = np.concatenate([part[0] for part in parts])
+    values = np.concatenate([part[1] for part in parts])
+    conditions = np.concatenate([part[2] for part in parts])
+    order = np.argsort(timestamps, kind='stable')
+    return timestamps[order], values[order], conditions[order]
+
+
+def _without(columns: Columns, existing: Columns) -> Columns:
+    """Rows of `columns` whose timestamp and values are not already in sorted `existing`"""
+    timestamps, values, conditions = columns
+    lo = np.searchsorted(existing[0], timestamps, side='left')
+    hi = np.searchsorted(existing[0], timestamps, side='right')
+    keep = np.ones(len(timestamps), dtype=bool)
+    for i in np.flatnonzero(hi > lo):
+        keep[i] = not (existing[1][lo[i]:hi[i]] == values[i]).all(axis=1).any()
+    if keep.all():
+        return columns
+    return timestamps[keep], values[keep], conditions[keep]
+
+
+class ReadingLog(ABC):
+    """Durable, append-only storage of readings behind a DataStore
+
+    Backends receive column batches (see ReadingStore.extend) and return
+    the same layout from range reads.
+    """
+
+    @abstractmethod
+    def append(self, home_id: str, timestamps: np.ndarray, values: np.ndarray,
+               conditions: Sequence[str]):
+        """Store a column batch of readings of one home"""
+
+    def read_range(self, home_id: str, start: Optional[datetime] = None,
+                   end: Optional[datetime] = None) -> Columns:
+        """Readings of a home with start <= timestamp < end, sorted by time"""
+        return concat_columns(list(self.iter_range(home_id, start, end)))
+
+    @abstractmethod
+    def iter_range(self, home_id: str, start: Optional[datetime] = None,
+                   end: Optional[datetime] = None) -> Iterator[Columns]:
+        """The same readings as read_range, as column chunks each sorted by time"""
+
+    @abstractmethod
+    def home_ids(self) -> List[str]:
+        """Every home with stored readings"""
+
+    def flush(self):
+        pass
+
+    def compact(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class SQLiteReadingLog(ReadingLog):
+    """SQLite (WAL mode) write log plus per-day columnar segment files
+
+    Appends are buffered and written by a background thread in one
+    transaction per `commit_rows` rows or `commit_interval` seconds (group
+    commit). Every `compact_interval` seconds, rows from days before today
+    (UTC, like the stored timestamps) are moved out of SQLite into `segments/<home>/<YYYY-MM-DD>/` as .npy
+    column files, which range reads open memory-mapped, so long histories
+    are read without being loaded into RAM or scanned row by row.
+
+    A failed commit (e.g. "database is locked") puts its rows back in the
+    buffer and the writer retries with backoff; `write_errors` and
+    `last_error` report it.
+
+    Several processes (cluster workers) may share one data directory.
+    Range reads hold a shared file lock while they list the segments and
+    query SQLite, and compaction moves each day (segment swap plus SQLite
+    delete) under the exclusive one, so a read never misses rows that are
+    being moved; whole compactions are serialized by a second lock. A
+    segment is written before its rows are deleted from SQLite, so a crash
+    in between leaves both copies: reads and compaction skip SQLite rows
+    the day's segment already holds. A crash while a segment is replaced
+    leaves it as `<day>.old`, which reads use until it is moved back when
+    the next log is opened.
+    """
+
+    def __init__(self, root: str, commit_rows: int = 5000, commit_interval: float = 1.0,
+                 compact_interval: Optional[float] = 3600.0):
+        self.root = Path(root)
+        self.segments_dir = self.root / "segments"
+        self.segments_dir.mkdir(parents=True, exist_ok=True)
+        self.commit_rows = commit_rows
+        self.commit_interval = commit_interval
+        self.compact_interval = compact_interval
+
+        self._db = sqlite3.connect(self.root / "readings.db", check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS readings ("
+            "home_id TEXT NOT NULL, ts INTEGER NOT NULL, "
+            + ", ".join(f"{name} REAL NOT NULL" for name in FIELDS)
+            + ", condition TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS readings_home_ts ON readings (home_id, ts)")
+        self._db_lock = Lock()
+        # Stand-ins for the file locks where fcntl is missing
+        self._local_locks: Dict[str, RLock] = {"segments": RLock(), "compact": RLock()}
+        self._recover_segments()
+
+        self._pending: List[tuple] = []
+        self._pending_ready = Condition()
+        self._closed = False
+        self.write_errors = 0
+        self.last_error: Optional[str] = None
+        # Compact on start, to clear rows left behind by a crash mid-compaction
+        self._last_compaction = -float("inf")
+        self._writer = Thread(target=self._run_writer, name="reading-log-writer", daemon=True)
+        self._writer.start()
+
+    # Writes -------------------------------------------------------------------
+
+    def append(self, home_id: str, timestamps: np.ndarray, values: np.ndarray,
+               conditions: Sequence[str]):
+        ts = np.asarray(timestamps, dtype='datetime64[us]').astype(np.int64).tolist()
+        columns = np.asarray(values, dtype=np.float64).reshape(len(ts), len(FIELDS)).T.tolist()
+        rows = list(zip([home_id] * len(ts), ts, *columns, [str(c) for c in conditions]))
+        with self._pending_ready:
+            self._pending.extend(rows)
+            if len(self._pending) >= self.commit_rows:
+                self._pending_ready.notify()
+
+    def _run_writer(self):
+        failures = 0
+        while True:
+            with self._pending_ready:
+                if not self._closed and len(self._pending) < self.commit_rows:
+                    self._pending_ready.wait(self.commit_interval)
+                closed = self._closed
+            try:
+                self.flush()
+                if (not closed and self.compact_interval is not None
+                        and time.monotonic() - self._last_compaction >= self.compact_interval):
+                    self.compact()
+            except Exception as e:
+                failures += 1
+                self.write_errors += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.exception("Reading log write failed (attempt %d), retrying", failures)
+                if closed and failures >= 5:
+                    return
+                time.sleep(min(self.commit_interval * 2 ** failures, 30.0))
+                continue
+            failures = 0
+            self.last_error = None
+            if closed:
+                return
+
+    def flush(self):
+        """Commit all buffered rows in one transaction"""
+        with self._pending_ready:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+        placeholders = ", ".join("?" * (len(FIELDS) + 3))
+        try:
+            with self._db_lock:
+                self._db.execute("BEGIN")
+                try:
+                    self._db.executemany(f"INSERT INTO readings VALUES ({placeholders})", rows)
+                    self._db.execute("COMMIT")
+                except BaseException:
+                    if self._db.in_transaction:
+                        self._db.execute("ROLLBACK")
+                    raise
+        except BaseException:
+            # Keep the rows, ahead of any appended since, for the next attempt
+            with self._pending_ready:
+                self._pending[:0] = rows
+            raise
+
+    # Segments -----------------------------------------------------------------
+
+    @contextmanager
+    def _file_lock(self, name: str, shared: bool = False):
+        """Advisory lock `<root>/<name>.lock`, held across processes and threads"""
+        if fcntl is None:
+            with self._local_locks[name]:
+                yield
+            return
+        # One open file per acquisition: flock excludes threads of one process too
+        with open(self.root / f"{name}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield  # Closing the file releases the lock
+
+    def _recover_segments(self):
+        """Undo segment replacements that a crash interrupted"""
+        with self._file_lock("segments"):
+            for home_dir in self.segments_dir.iterdir():
+                if not home_dir.is_dir():
+                    continue
+                for path in home_dir.iterdir():
+                    current = path.with_suffix("")
+                    if path.suffix == ".tmp":
+                        shutil.rmtree(path, ignore_errors=True)
+                    elif path.suffix == ".old":
+                        if current.exists():
+                            shutil.rmtree(path, ignore_errors=True)
+                        else:
+                            os.replace(path, current)
+
+    def _segment_dir(self, home_id: str, day: date) -> Path:
+        return self.segments_dir / quote(home_id, safe='') / day.isoformat()
+
+    def _read_segment(self, path: Path) -> Columns:
+        timestamps = np.load(path / "timestamps.npy", mmap_mode='r')
+        values = np.load(path / "values.npy", mmap_mode='r')
+        codes = np.load(path / "conditions.npy", mmap_mode='r')
+        names = np.array(json.loads((path / "conditions.json").read_text()), dtype=object)
+        return timestamps, values, names[codes]
+
+    def _write_segment(self, path: Path, columns: Columns):
+        timestamps, values, conditions = columns
+        names, codes = np.unique(conditions.astype(str), return_inverse=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir(parents=True)
+        np.save(tmp_path / "timestamps.npy", np.ascontiguousarray(timestamps, dtype='datetime64[us]'))
+        np.save(tmp_path / "values.npy", np.ascontiguousarray(values, dtype=np.float64))
+        np.save(tmp_path / "conditions.npy", codes.reshape(-1).astype(np.int32))
+        (tmp_path / "conditions.json").write_text(json.dumps(names.tolist()))
+        if path.exists():
+            old_path = path.with_name(path.name + ".old")
+            shutil.rmtree(old_path, ignore_errors=True)
+            os.replace(path, old_path)
+            os.replace(tmp_path, path)
+            shutil.rmtree(old_path, ignore_errors=True)
+        else:
+            os.replace(tmp_path, path)
+
+    def compact(self, before: Optional[date] = None):
+        """Move rows of days before `before` (default: today in UTC) into day segments"""
+        before = before or datetime.now(timezone.utc).date()
+        cutoff = int(to_datetime64(datetime.combine(before, datetime.min.time())).astype(np.int64))
+        self.flush()
+        with self._file_lock("compact"):
+            with self._db_lock:
+                days = self._db.execute(
+                    "SELECT DISTINCT home_id, ts / ? FROM readings WHERE ts < ?",
+                    (_US_PER_DAY, cutoff)
+                ).fetchall()
+            for home_id, day_number in days:
+                # Day by day, so reads only wait for one segment at a time
+                with self._file_lock("segments"):
+                    self._compact_day(home_id, day_number)
+        self._last_compaction = time.monotonic()
+
+    def _compact_day(self, home_id: str, day_number: int):
+        day_start = day_number * _US_PER_DAY
+        day = date.fromordinal(_EPOCH.toordinal() + day_number)
+        with self._db_lock:
+            fresh = self._select(home_id, day_start, day_start + _US_PER_DAY)
+            if not len(fresh[0]):
+                return  # Another process compacted the day first
+            path = self._segment_dir(home_id, day)
+            existing = self._read_segment(path) if path.exists() else empty_columns()
+            existing = tuple(np.array(column) for column in existing)
+            # Rows already in the segment were left by an interrupted compaction
+            merged = concat_columns([existing, _without(fresh, existing)])
+            self._write_segment(path, merged)
+            self._db.execute(
+                "DELETE FROM readings WHERE home_id = ? AND ts >= ? AND ts < ?",
+                (home_id, day_start, day_start + _US_PER_DAY)
+            )
+
+    # Reads --------------------------------------------------------------------
+
+    def _select(self, home_id: str, start: Optional[int], end: Optional[int]) -> Columns:
+        query = f"SELECT ts, {', '.join(FIELDS)}, condition FROM readings WHERE home_id = ?"
+        params: list = [home_id]
+        if start is not None:
+            query += " AND ts >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND ts < ?"
+            params.append(end)
+        rows = self._db.execute(query + " ORDER BY ts", params).fetchall()
+        if not rows:
+            return empty_columns()
+        columns = list(zip(*rows))
+        return (np.array(columns[0], dtype=np.int64).astype('datetime64[us]'),
+                np.array(columns[1:-1], dtype=np.float64).T.copy(),
+                np.array(columns[-1], dtype=object))
+
+    def iter_range(self, home_id: str, start: Optional[datetime] = None,
+                   end: Optional[datetime] = None) -> Iterator[Columns]:
+        """Yield one memory-mapped chunk per day segment, then the SQLite rows
+
+        Segments hold days before the last compaction and SQLite the rows
+        after it, so chunks come out in time order except for late readings
+        of already compacted days, which arrive with the SQLite chunk until
+        the next compaction. Segments are opened and SQLite is queried under
+        the shared segment lock; the chunks are yielded after it is released
+        (memory maps stay valid when a segment is replaced).
+        """
+        self.flush()
+        start64 = to_datetime64(start) if start is not None else None
+        end64 = to_datetime64(end) if end is not None else None
+        home_dir = self.segments_dir / quote(home_id, safe='')
+        segments: Dict[np.datetime64, Columns] = {}
+        with self._file_lock("segments", shared=True):
+            if home_dir.is_dir():
+                for path in self._day_paths(home_dir):
+                    day = np.datetime64(path.name.split(".")[0], 'us')
+                    if start64 is not None and day + np.timedelta64(1, 'D') <= start64:
+                        continue
+                    if end64 is not None and day >= end64:
+                        continue
+                    timestamps, values, conditions = self._read_segment(path)
+                    lo = 0 if start64 is None else int(np.searchsorted(timestamps, start64, side='left'))
+                    hi = len(timestamps) if end64 is None else int(np.searchsorted(timestamps, end64, side='left'))
+                    if hi > lo:
+                        segments[day] = timestamps[lo:hi], values[lo:hi], conditions[lo:hi]
+            with self._db_lock:
+                recent = self._select(
+                    home_id,
+                    None if start64 is None else int(start64.astype(np.int64)),
+                    None if end64 is None else int(end64.astype(np.int64))
+                )
+        yield from segments.values()
+        if len(recent[0]) and segments:
+            recent = self._unsegmented(recent, segments)
+        if len(recent[0]):
+            yield recent
+
+    @staticmethod
+    def _day_paths(home_dir: Path) -> List[Path]:
+        """Segment directory of each day, in day order
+
+        `<day>.old` stands in for a day whose replacement was interrupted.
+        """
+        paths = {}
+        for path in sorted(home_dir.iterdir()):
+            if path.suffix == "":
+                paths[path.name] = path
+            elif path.suffix == ".old":
+                paths.setdefault(path.stem, path)
+        return [paths[day] for day in sorted(paths)]
+
+    @staticmethod
+    def _unsegmented(recent: Columns, segments: Dict[np.datetime64, Columns]) -> Columns:
+        """SQLite rows minus those already in their day's segment (left by a crash)"""
+        days = recent[0].astype('datetime64[D]').astype('datetime64[us]')
+        parts = []
+        for day in np.unique(days):
+            rows = days == day
+            part = tuple(column[rows] for column in recent)
+            parts.append(_without(part, segments[day]) if day in segments else part)
+        return concat_columns(parts)
+
+    def home_ids(self) -> List[str]:
+        self.flush()
+        with self._db_lock:
+            homes = {row[0] for row in self._db.execute("SELECT DISTINCT home_id FROM readings")}
+        homes.update(unquote(path.name) for path in self.segments_dir.iterdir() if path.is_dir())
+        return sorted(homes)
+
+    def close(self):
+        with self._pending_ready:
+            self._closed = True
+            self._pending_ready.notify()
+        self._writer.join()
+        with self._db_lock:
+            self._db.close()
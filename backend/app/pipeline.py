@@ -0,0 +1,460 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import asyncio
+import time
+import numpy as np
+
+from .dispatch import fleet_actions
+from .energy_agents import (EnergyData, MonitoringAgent, OptimizationAgent, PredictionAgent,
+                            PredictionResult, predict_fleet)
+from .execution import ExecutionLayer, Overloaded
+from .homes import DataStore, HomeShards, fit_predictor
+from .metrics import REGISTRY, STAGE_LATENCY
+from .persistence import Columns
+from .store import FIELDS
+
+PIPELINE_BATCH = REGISTRY.histogram(
+    "energy_pipeline_batch_size", "Items per pipeline micro-batch", ("stage",),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+PIPELINE_LATENCY = REGISTRY.histogram(
+    "energy_pipeline_latency_seconds", "Time from a reading entering the pipeline to its actions")
+
+STAGES = ('monitor', 'predict', 'optimize')
+
+# fleet_actions outputs under the action names OptimizationAgent uses
+RULE_ACTIONS = {'store': 'store_energy', 'sell': 'sell_energy', 'use_battery': 'use_battery',
+                'buy': 'buy_energy'}
+
+
+@dataclass
+class _Readings:
+    home_id: str
+    columns: Columns
+    entered: float  # perf_counter when the readings were submitted
+
+
+@dataclass
+class _Refresh:
+    home_id: str
+    current: EnergyData
+    anomalies: List[str]
+    entered: float
+
+
+@dataclass
+class _Plan:
+    home_id: str
+    current: EnergyData
+    anomalies: List[str]
+    predictions: List[PredictionResult]
+    model_version: Optional[str]
+    entered: float
+
+
+@dataclass
+class _Forecast:
+    model_version: Optional[str]
+    hour: datetime
+    predictions: List[PredictionResult] = field(default_factory=list)
+
+
+async def collect(queue: asyncio.Queue, max_items: int, max_delay: float) -> List:
+    """Wait for one item, then take more until `max_items` or `max_delay` seconds"""
+    batch = [await queue.get()]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_delay
+    while len(batch) < max_items:
+        try:
+            batch.append(queue.get_nowait())
+            continue
+        except asyncio.QueueEmpty:
+            pass
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+
+class Pipeline:
+    """Monitor -> predict -> optimize agents connected by bounded asyncio queues
+
+    Readings submitted for a home pass through three stages, each a task
+    that collects a micro-batch (at most `batch_size` items, waiting at
+    most `max_delay` seconds after the first) and handles it at once:
+
+    - monitor: stores the readings (unless `store` is False because the
+      producer already did) and scores them with the home's
+      MonitoringAgent in one vectorized pass;
+    - predict: keeps the newest reading per home, starts background
+      training of models that are missing or stale (one task per home; the
+      stage keeps forecasting with the current model, or leaves the home
+      to the fleet rule, until it finishes) and refreshes forecasts whose
+      model or hour changed with one predict_fleet call for the batch;
+    - optimize: schedules homes that have a forecast with their
+      OptimizationAgent and applies the fleet rule to the rest in one
+      vectorized call.
+
+    Queues hold at most `queue_size` items, so a slow stage makes `submit`
+    wait instead of buffering without bound. As a stage falls behind its
+    batches grow and per-home work is merged, which is what lets the
+    pipeline keep up with bursts.
+    """
+
+    def __init__(self, homes: HomeShards, execution: Optional[ExecutionLayer] = None,
+                 batch_size: int = 256, max_delay: float = 0.05, queue_size: int = 1024,
+                 store: bool = True, forecast_every: timedelta = timedelta(hours=1),
+                 on_result: Optional[Callable[[Dict], Any]] = None):
+        self.homes = homes
+        self.execution = execution
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.queue_size = queue_size
+        self.store = store
+        self.forecast_every = forecast_every
+        self.on_result = on_result
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.latest: Dict[str, Dict] = {}  # Newest result per home
+        self._monitors: Dict[str, MonitoringAgent] = {}
+        # Readings a monitor's baseline already holds from its backfill
+        self._backfilled: Dict[str, np.datetime64] = {}
+        self._optimizers: Dict[str, OptimizationAgent] = {}
+        self._forecasts: Dict[str, _Forecast] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._training: Dict[str, asyncio.Task] = {}  # Background training per home
+        self.counts = {name: 0 for name in ('readings', 'rejected', 'anomalies', 'trainings',
+                                            'training_skipped', 'forecasts', 'plans', 'results',
+                                            'errors')}
+        self.last_error: Optional[str] = None
+        self.peak_depth = {name: 0 for name in STAGES}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """Create the queues and stage tasks on the running event loop"""
+        if self.running:
+            return
+        self.queues = {name: asyncio.Queue(self.queue_size) for name in STAGES}
+        self._tasks = [
+            asyncio.create_task(self._run(name, handler), name=f"pipeline-{name}")
+            for name, handler in zip(STAGES, (self._monitor, self._predict, self._optimize))
+        ]
+
+    async def drain(self):
+        """Wait until everything submitted so far has left the last stage"""
+        for name in STAGES:
+            await self.queues[name].join()
+
+    async def wait_for_training(self):
+        """Wait until the background training started so far has finished"""
+        while self._training:
+            await asyncio.gather(*self._training.values(), return_exceptions=True)
+
+    async def stop(self, drain: bool = True):
+        if drain and self.running:
+            await self.drain()
+            await self.wait_for_training()
+        for task in self._tasks + list(self._training.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._training.values(), return_exceptions=True)
+        self._tasks = []
+        self._training = {}
+
+    async def submit(self, home_id: str, columns: Columns):
+        """Queue a column batch of a home's readings, waiting while the pipeline is full"""
+        await self._put('monitor', _Readings(home_id, columns, time.perf_counter()))
+
+    async def _put(self, stage: str, item):
+        await self.queues[stage].put(item)
+        self._track(stage)
+
+    def _track(self, stage: str):
+        self.peak_depth[stage] = max(self.peak_depth[stage], self.queues[stage].qsize())
+
+    async def _run(self, name: str, handler: Callable):
+        queue = self.queues[name]
+        while True:
+            batch = await collect(queue, self.batch_size, self.max_delay)
+            PIPELINE_BATCH.observe(len(batch), stage=name)
+            try:
+                with STAGE_LATENCY.time(stage=f'pipeline.{name}'):
+                    await handler(batch)
+            except Exception as e:
+                # A failing batch is dropped; the stage keeps serving later ones
+                self.counts['errors'] += len(batch)
+                self.last_error = f"{name}: {e!r}"
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _in_thread(self, fn: Callable, *args):
+        if self.execution is not None:
+            return await self.execution.run_thread(fn, *args)
+        return await asyncio.to_thread(fn, *args)
+
+    # Stages -------------------------------------------------------------------
+
+    async def _monitor(self, batch: List[_Readings]):
+        by_home: Dict[str, List[_Readings]] = {}
+        for item in batch:
+            by_home.setdefault(item.home_id, []).append(item)
+        refreshes = await self._in_thread(self._monitor_homes, by_home)
+        for refresh in refreshes:
+            await self._put('predict', refresh)
+
+    def _monitor_homes(self, by_home: Dict[str, List[_Readings]]) -> List[_Refresh]:
+        refreshes = []
+        for home_id, items in by_home.items():
+            timestamps = np.concatenate([np.asarray(item.columns[0], dtype='datetime64[us]') for item in items])
+            values = np.concatenate([np.asarray(item.columns[1], dtype=np.float64).reshape(-1, len(FIELDS))
+                                     for item in items])
+            conditions = np.concatenate([np.asarray(item.columns[2], dtype=object) for item in items])
+            order = np.argsort(timestamps, kind='stable')
+            timestamps, values, conditions = timestamps[order], values[order], conditions[order]
+
+            shard = self.homes.get(home_id)
+            monitor = self._monitor_for(shard)
+            valid = monitor.validate_batch(values)
+            self.counts['rejected'] += int((~valid).sum())
+            timestamps, values, conditions = timestamps[valid], values[valid], conditions[valid]
+            if not len(timestamps):
+                continue
+            if self.store:
+                shard.add_batch(timestamps, values, conditions)
+            self.counts['readings'] += len(timestamps)
+
+            backfilled = self._backfilled.get(home_id)
+            fresh = timestamps > backfilled if backfilled is not None else np.ones(len(timestamps), dtype=bool)
+            flags = monitor.detect_batch(timestamps[fresh], values[fresh])
+            self.counts['anomalies'] += int(np.count_nonzero(flags.any(axis=1)))
+
+            row = values[-1]
+            current = EnergyData(
+                timestamp=timestamps[-1].astype(datetime),
+                production=float(row[FIELDS.index('production')]),
+                consumption=float(row[FIELDS.index('consumption')]),
+                battery_level=float(row[FIELDS.index('battery_level')]),
+                weather_data={'temperature': float(row[FIELDS.index('temperature')]),
+                              'cloud_cover': float(row[FIELDS.index('cloud_cover')]),
+                              'condition': str(conditions[-1])}
+            )
+            anomalies = monitor.describe_flags(flags[-1]) if len(flags) and fresh[-1] else []
+            refreshes.append(_Refresh(home_id, current, anomalies, min(item.entered for item in items)))
+        return refreshes
+
+    def _monitor_for(self, shard: DataStore) -> MonitoringAgent:
+        monitor = self._monitors.get(shard.home_id)
+        if monitor is None:
+            with shard.lock:
+                # Shares the shard's readings and learns its baseline from them
+                monitor = MonitoringAgent(shard.home_id, store=shard.readings)
+                if len(shard.readings):
+                    self._backfilled[shard.home_id] = shard.readings.timestamps[-1]
+            self._monitors[shard.home_id] = monitor
+        return monitor
+
+    async def _predict(self, batch: List[_Refresh]):
+        newest: Dict[str, _Refresh] = {}
+        for item in batch:
+            previous = newest.get(item.home_id)
+            if previous is not None:
+                # Keep the newest reading, but the latency of the oldest one
+                item.entered = min(item.entered, previous.entered)
+                item.anomalies = item.anomalies or previous.anomalies
+            newest[item.home_id] = item
+
+        shards = {home_id: self.homes.get(home_id) for home_id in newest}
+        predictors = await asyncio.gather(*(self._predictor(shard) for shard in shards.values()))
+        agents = {home_id: agent for home_id, agent in zip(shards, predictors) if agent is not None}
+
+        stale = {}
+        for home_id, agent in agents.items():
+            hour = newest[home_id].current.timestamp.replace(minute=0, second=0, microsecond=0)
+            forecast = self._forecasts.get(home_id)
+            if (forecast is None or forecast.model_version != agent.model_version
+                    or hour - forecast.hour >= self.forecast_every):
+                stale[home_id] = hour
+        if stale:
+            predictions = await self._in_thread(
+                predict_fleet,
+                {home_id: agents[home_id] for home_id in stale},
+                {home_id: newest[home_id].current for home_id in stale},
+                24, timedelta(hours=1),
+                {home_id: shards[home_id].recent_features() for home_id in stale}
+            )
+            for home_id, hour in stale.items():
+                self._forecasts[home_id] = _Forecast(agents[home_id].model_version, hour, predictions[home_id])
+            self.counts['forecasts'] += len(stale)
+
+        for home_id, item in newest.items():
+            forecast = self._forecasts.get(home_id) if home_id in agents else None
+            await self._put('optimize', _Plan(
+                home_id, item.current, item.anomalies,
+                forecast.predictions if forecast is not None else [],
+                forecast.model_version if forecast is not None else None,
+                item.entered
+            ))
+
+    async def _predictor(self, shard: DataStore) -> Optional[PredictionAgent]:
+        """The shard's trained predictor, if any; starts training when it is missing or stale"""
+        if shard.home_id not in self._training:
+            job = await self._in_thread(shard.training_job)
+            if job is not None:
+                self._training[shard.home_id] = asyncio.create_task(
+                    self._train(shard, job), name=f"pipeline-train-{shard.home_id}")
+        predictor = shard.predictor
+        return predictor if predictor is not None and predictor.is_trained else None
+
+    async def _train(self, shard: DataStore, job: tuple):
+        try:
+            if self.execution is not None:
+                agent = await self.execution.run_cpu(fit_predictor, *job, key=("train", shard.home_id))
+            else:
+                agent = await asyncio.to_thread(fit_predictor, *job)
+            await self._in_thread(shard.finish_training, agent)
+            self.counts['trainings'] += 1
+        except Overloaded:
+            # Keep forecasting with the current model; a later batch retries
+            self.counts['training_skipped'] += 1
+        except Exception as e:
+            self.last_error = f"train {shard.home_id}: {e!r}"
+        finally:
+            self._training.pop(shard.home_id, None)
+
+    async def _optimize(self, batch: List[_Plan]):
+        results = await self._in_thread(self._optimize_homes, batch)
+        done = time.perf_counter()
+        for plan, result in zip(batch, results):
+            PIPELINE_LATENCY.observe(done - plan.entered)
+            self.latest[plan.home_id] = result
+            self.counts['results'] += 1
+            if self.on_result is not None:
+                self.on_result({**result, 'latency_s': done - plan.entered})
+
+    def _optimize_homes(self, batch: Sequence[_Plan]) -> List[Dict]:
+        results: List[Optional[Dict]] = [None] * len(batch)
+        rule = []
+        for index, plan in enumerate(batch):
+            if not plan.predictions:
+                rule.append(index)
+                continue
+            optimizer = self._optimizers.get(plan.home_id)
+            if optimizer is None:
+                optimizer = self._optimizers[plan.home_id] = OptimizationAgent(plan.home_id)
+            optimized = optimizer.optimize_usage(plan.current, plan.predictions)
+            self.counts['plans'] += 1
+            results[index] = self._result(plan, optimized['actions'], optimized['recommendations'])
+
+        if rule:
+            # Homes without a forecast yet: the fleet rule for all of them at once
+            currents = [batch[index].current for index in rule]
+            actions = fleet_actions(
+                np.array([current.production for current in currents]),
+                np.array([current.consumption for current in currents]),
+                np.array([current.battery_level for current in currents]),
+                np.array([self.homes.get(batch[index].home_id).battery_capacity for index in rule])
+            )
+            for position, index in enumerate(rule):
+                results[index] = self._result(batch[index], {
+                    action: float(actions[name][position]) for name, action in RULE_ACTIONS.items()
+                    if actions[name][position] > 0
+                }, [])
+        return results
+
+    @staticmethod
+    def _result(plan: _Plan, actions: Dict[str, float], recommendations: List[str]) -> Dict:
+        return {
+            'home_id': plan.home_id,
+            'timestamp': plan.current.timestamp,
+            'anomalies': plan.anomalies,
+            'model_version': plan.model_version,
+            'forecast_hours': len(plan.predictions),
+            'actions': actions,
+            'recommendations': recommendations
+        }
+
+    def stats(self) -> Dict:
+        return {
+            'running': self.running,
+            'queue_depth': {name: queue.qsize() for name, queue in self.queues.items()},
+            'peak_queue_depth': dict(self.peak_depth),
+            'queue_size': self.queue_size,
+            'batch_size': self.batch_size,
+            'max_delay_s': self.max_delay,
+            'last_error': self.last_error,
+            **self.counts
+        }
+
+
+async def replay(pipeline: Pipeline, fleet: Dict[str, Columns], speed: float = float('inf')) -> Dict:
+    """Feed a fleet's readings through the pipeline at `speed` x real time
+
+    Readings of all homes are merged in timestamp order and submitted one
+    by one when their (scaled) time comes; speed=inf submits as fast as
+    the pipeline accepts them. `lag_s` is how far submission fell behind
+    the schedule, through backpressure: a replay is sustained when it
+    stays near zero, so raising `speed` until it is not finds the
+    sustainable throughput.
+    """
+    home_ids = sorted(fleet)
+    timestamps = np.concatenate([np.asarray(fleet[home_id][0], dtype='datetime64[us]') for home_id in home_ids])
+    homes = np.repeat(np.arange(len(home_ids)), [len(fleet[home_id][0]) for home_id in home_ids])
+    rows = np.concatenate([np.arange(len(fleet[home_id][0])) for home_id in home_ids])
+    order = np.argsort(timestamps, kind='stable')
+    timestamps, homes, rows = timestamps[order], homes[order], rows[order]
+    if not len(timestamps):
+        return {'readings': 0}
+    offsets = (timestamps - timestamps[0]) / np.timedelta64(1, 's') / speed
+
+    latencies: List[float] = []
+    on_result = pipeline.on_result
+    pipeline.on_result = lambda result: (latencies.append(result['latency_s']),
+                                         on_result(result) if on_result else None)
+    started = not pipeline.running
+    if started:
+        pipeline.start()
+    loop = asyncio.get_running_loop()
+    begin = loop.time()
+    lag = 0.0
+    try:
+        for offset, home, row in zip(offsets.tolist(), homes.tolist(), rows.tolist()):
+            delay = begin + offset - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                lag = max(lag, -delay)
+            timestamp, values, conditions = fleet[home_ids[home]]
+            await pipeline.submit(home_ids[home], (timestamp[row:row + 1], values[row:row + 1],
+                                                   conditions[row:row + 1]))
+        submitted = loop.time() - begin
+        await pipeline.drain()
+        elapsed = loop.time() - begin
+    finally:
+        pipeline.on_result = on_result
+        if started:
+            await pipeline.stop(drain=False)
+
+    simulated = float((timestamps[-1] - timestamps[0]) / np.timedelta64(1, 's'))
+    latency = np.array(latencies) if latencies else np.zeros(1)
+    return {
+        'readings': len(timestamps),
+        'homes': len(home_ids),
+        'speed': speed,
+        'simulated_s': simulated,
+        'submit_s': submitted,
+        'wall_s': elapsed,
+        'offered_per_s': len(timestamps) / (simulated / speed) if simulated and np.isfinite(speed) else None,
+        'throughput_per_s': len(timestamps) / elapsed if elapsed else None,
+        'lag_s': lag,
+        'results': len(latencies),
+        'latency_p50_ms': float(np.percentile(latency, 50) * 1000),
+        'latency_p99_ms': float(np.percentile(latency, 99) * 1000),
+        'latency_mean_ms': float(latency.mean() * 1000),
+        'pipeline': pipeline.stats()
+    }
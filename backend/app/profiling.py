@@ -0,0 +1,60 @@
+from collections import Counter
+from threading import Lock, get_ident
+from types import FrameType
+from typing import Dict, List, Optional
+import os
+import sys
+import time
+
+# Only one profile runs at a time per process
+_running = Lock()
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    # ';' separates frames in the collapsed format
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}".replace(";", ":")
+
+
+def _stack(frame: Optional[FrameType], limit: int) -> List[str]:
+    names = []
+    while frame is not None and len(names) < limit:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.reverse()  # Root first
+    return names
+
+
+def sample_stacks(seconds: float, interval: float = 0.005, max_depth: int = 128) -> Dict[str, int]:
+    """Sample the Python stacks of every thread for `seconds`
+
+    Every `interval` seconds the current frame of each thread (except the
+    sampling one) is walked and counted, so the overhead is bounded by the
+    sampling rate rather than by the work being profiled. Returns counts
+    keyed by collapsed stack ("thread;root;...;leaf"), the input format of
+    flamegraph.pl, speedscope and inferno.
+    """
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        own_thread = get_ident()
+        counts: Counter = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                counts[";".join([f"thread-{thread_id}"] + _stack(frame, max_depth))] += 1
+            time.sleep(interval)
+        return dict(counts)
+    finally:
+        _running.release()
+
+
+def collapsed(counts: Dict[str, int]) -> str:
+    """Render sampled stacks as collapsed-stack text, one "stack count" per line"""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
@@ -0,0 +1,125 @@
+from collections import OrderedDict
+from pathlib import Path
+from threading import RLock
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+import os
+
+from .energy_agents import PredictionAgent
+from .metrics import timed
+
+
+class ModelRegistry:
+    """On-disk registry of trained PredictionAgents
+
+    Each save writes `<root>/<home_id>/<model_version>.joblib`, where the
+    version is the agent's training-data watermark, so older versions stay
+    around until pruned. Agents are loaded lazily on first request with
+    joblib's memory-mapped arrays and kept in an LRU cache; once the summed
+    size of the loaded model files exceeds `memory_budget` bytes the least
+    recently used homes are evicted.
+    """
+
+    def __init__(self, root: str, memory_budget: int = 512 * 1024 * 1024,
+                 keep_versions: int = 3, mmap: bool = True):
+        self.root = Path(root)
+        self.memory_budget = memory_budget
+        self.keep_versions = max(1, keep_versions)
+        self.mmap = mmap
+        self._loaded: 'OrderedDict[str, Tuple[PredictionAgent, int]]' = OrderedDict()
+        self._lock = RLock()
+        self.loads = 0  # Number of agents read from disk
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _home_dir(self, home_id: str) -> Path:
+        return self.root / quote(home_id, safe='')
+
+    def versions(self, home_id: str) -> List[str]:
+        """Saved model versions for a home, oldest first"""
+        home_dir = self._home_dir(home_id)
+        if not home_dir.is_dir():
+            return []
+        return sorted(path.stem for path in home_dir.glob('*.joblib'))
+
+    def latest_version(self, home_id: str) -> Optional[str]:
+        versions = self.versions(home_id)
+        return versions[-1] if versions else None
+
+    def save(self, agent: PredictionAgent) -> str:
+        """Persist a trained agent and make it the cached version for its home"""
+        import joblib
+
+        if not agent.is_trained:
+            raise ValueError("Only trained agents can be saved")
+        home_dir = self._home_dir(agent.home_id)
+        home_dir.mkdir(parents=True, exist_ok=True)
+        path = home_dir / f"{agent.model_version}.joblib"
+        tmp_path = path.with_suffix('.tmp')
+        # Uncompressed so the arrays can be memory-mapped on load
+        joblib.dump(agent.export_state(), tmp_path)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._remember(agent.home_id, agent, path.stat().st_size)
+            self._prune(agent.home_id)
+        return agent.model_version
+
+    def get(self, home_id: str) -> Optional[PredictionAgent]:
+        """Return the latest agent for a home, loading it from disk on first use"""
+        with self._lock:
+            entry = self._loaded.get(home_id)
+            if entry is not None:
+                self._loaded.move_to_end(home_id)
+                return entry[0]
+
+            version = self.latest_version(home_id)
+            if version is None:
+                return None
+            agent, size = self._load(home_id, version)
+            self._remember(home_id, agent, size)
+            return agent
+
+    @timed('registry.load')
+    def _load(self, home_id: str, version: str) -> Tuple[PredictionAgent, int]:
+        import joblib
+
+        path = self._home_dir(home_id) / f"{version}.joblib"
+        state = joblib.load(path, mmap_mode='r' if self.mmap else None)
+        self.loads += 1
+        return PredictionAgent.from_state(state), path.stat().st_size
+
+    def _remember(self, home_id: str, agent: PredictionAgent, size: int):
+        self._loaded[home_id] = (agent, size)
+        self._loaded.move_to_end(home_id)
+        self._enforce_budget()
+
+    def _enforce_budget(self):
+        # The most recently used agent always stays loaded
+        while len(self._loaded) > 1 and self.memory_usage > self.memory_budget:
+            self._loaded.popitem(last=False)
+
+    def _prune(self, home_id: str):
+        for version in self.versions(home_id)[:-self.keep_versions]:
+            (self._home_dir(home_id) / f"{version}.joblib").unlink(missing_ok=True)
+
+    @property
+    def memory_usage(self) -> int:
+        """Summed on-disk size of the loaded model files, in bytes"""
+        return sum(size for _, size in self._loaded.values())
+
+    def evict(self, home_id: str):
+        """Drop a home's agent from memory (it stays on disk)"""
+        with self._lock:
+            self._loaded.pop(home_id, None)
+
+    def loaded_homes(self) -> List[str]:
+        with self._lock:
+            return list(self._loaded)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'loaded_homes': len(self._loaded),
+                'memory_usage': self.memory_usage,
+                'memory_budget': self.memory_budget,
+                'loads': self.loads
+            }
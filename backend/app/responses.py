@@ -0,0 +1,197 @@
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+import json
+import numpy as np
+
+from fastapi.responses import JSONResponse
+
+from .persistence import Columns
+from .store import FIELDS
+
+try:
+    import orjson
+except ImportError:  # Falls back to the stdlib encoder
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson when it is installed
+
+    orjson encodes datetimes and NumPy arrays natively, so handlers can
+    return columns without converting them to lists first.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, default=_to_builtin, separators=(",", ":")).encode("utf-8")
+
+
+def _to_builtin(value: Any) -> Any:
+    if isinstance(value, np.ndarray):
+        if np.issubdtype(value.dtype, np.datetime64):
+            return np.datetime_as_string(value, unit='us').tolist()
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+# Streaming exports --------------------------------------------------------------
+
+def records(columns: Columns) -> Iterator[Dict]:
+    """Chunk rows in the POST /readings shape, so exports can be re-imported"""
+    timestamps, values, conditions = columns
+    stamps = np.datetime_as_string(timestamps, unit='us')
+    for timestamp, row, condition in zip(stamps.tolist(), values.tolist(), conditions):
+        reading = dict(zip(FIELDS, row))
+        yield {
+            'timestamp': timestamp,
+            'production': reading['production'],
+            'consumption': reading['consumption'],
+            'battery_level': reading['battery_level'],
+            'weather_data': {
+                'temperature': reading['temperature'],
+                'cloud_cover': reading['cloud_cover'],
+                'condition': str(condition)
+            }
+        }
+
+
+def ndjson_chunks(chunks: Iterable[Columns]) -> Iterator[bytes]:
+    for columns in chunks:
+        if len(columns[0]):
+            yield b"".join(dumps(record) + b"\n" for record in records(columns))
+
+
+CSV_HEADER = ("timestamp",) + FIELDS + ("condition",)
+
+
+def csv_chunks(chunks: Iterable[Columns]) -> Iterator[bytes]:
+    """CSV with the flat columns POST /readings/batch accepts"""
+    yield (",".join(CSV_HEADER) + "\n").encode("utf-8")
+    for timestamps, values, conditions in chunks:
+        if not len(timestamps):
+            continue
+        stamps = np.datetime_as_string(timestamps, unit='us').tolist()
+        lines = [
+            ",".join([stamp] + [repr(value) for value in row] + [_csv_text(condition)])
+            for stamp, row, condition in zip(stamps, values.tolist(), conditions)
+        ]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _csv_text(value) -> str:
+    text = str(value)
+    if any(char in text for char in ',"\n'):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def arrow_chunks(chunks: Iterable[Columns]) -> Iterator[bytes]:
+    """Arrow IPC stream: the schema, then one record batch per chunk"""
+    import pyarrow as pa
+
+    schema = pa.schema([("timestamp", pa.timestamp("us"))]
+                       + [(name, pa.float64()) for name in FIELDS]
+                       + [("condition", pa.dictionary(pa.int32(), pa.string()))])
+    # The writer keeps the sink it was created with, so write into a buffer
+    # whose contents can be taken after every batch
+    buffer = _DrainableBuffer()
+    writer = pa.ipc.new_stream(buffer, schema)
+    yield buffer.drain()
+    for timestamps, values, conditions in chunks:
+        if not len(timestamps):
+            continue
+        arrays = [pa.array(np.asarray(timestamps, dtype='datetime64[us]'))]
+        arrays += [pa.array(np.ascontiguousarray(values[:, i])) for i in range(len(FIELDS))]
+        arrays.append(pa.array([str(c) for c in conditions]).dictionary_encode().cast(
+            pa.dictionary(pa.int32(), pa.string())))
+        writer.write_batch(pa.record_batch(arrays, schema=schema))
+        yield buffer.drain()
+    writer.close()
+    yield buffer.drain()
+
+
+class _DrainableBuffer:
+    """Minimal writable file object whose contents can be taken in pieces"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+
+def _arrow_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# Media type -> encoder of column chunks
+EXPORT_TYPES: Dict[str, Callable[[Iterable[Columns]], Iterator[bytes]]] = {
+    "application/x-ndjson": ndjson_chunks,
+    "text/csv": csv_chunks,
+    "application/vnd.apache.arrow.stream": arrow_chunks,
+}
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """The export media type that best matches an Accept header, or None
+
+    Entries are ranked by q-value; `*/*`, `application/*` or a missing
+    header select NDJSON, and Arrow is only offered when pyarrow is
+    installed.
+    """
+    available = [media for media in EXPORT_TYPES
+                 if media != "application/vnd.apache.arrow.stream" or _arrow_available()]
+    if not accept:
+        return available[0]
+    ranked = []
+    for position, entry in enumerate(accept.split(",")):
+        media, *params = [part.strip() for part in entry.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            ranked.append((-quality, position, media.lower()))
+    for _, _, media in sorted(ranked):
+        if media in ("application/ndjson", "application/jsonl"):
+            media = "application/x-ndjson"
+        if media in available:
+            return media
+        if media.endswith("/*"):
+            prefix = media[:-1] if media != "*/*" else ""
+            match = next((option for option in available if option.startswith(prefix)), None)
+            if match is not None:
+                return match
+    return None
@@ -0,0 +1,256 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+from .store import FIELDS, to_datetime64
+
+# (name, bucket width, how long buckets are kept after the newest one)
+TIERS = (
+    ('1min', timedelta(minutes=1), timedelta(days=7)),
+    ('15min', timedelta(minutes=15), timedelta(days=90)),
+    ('1h', timedelta(hours=1), timedelta(days=730)),
+    ('1d', timedelta(days=1), None),
+)
+
+# Bucket ids, counts, sums, minimums, maximums
+Partials = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+def _us(delta: timedelta) -> int:
+    return delta // timedelta(microseconds=1)
+
+
+def _group(keys: np.ndarray, count: np.ndarray, sums: np.ndarray, mins: np.ndarray,
+           maxs: np.ndarray) -> Partials:
+    """Combine partial aggregates that share a key; keys must be sorted"""
+    if len(keys) == 1:
+        return keys, count, sums, mins, maxs
+    unique, starts = np.unique(keys, return_index=True)
+    if len(unique) == len(keys):
+        return keys, count, sums, mins, maxs
+    return (unique, np.add.reduceat(count, starts), np.add.reduceat(sums, starts),
+            np.minimum.reduceat(mins, starts), np.maximum.reduceat(maxs, starts))
+
+
+class RollupTier:
+    """Sum/min/max/count of every field per fixed-width time bucket
+
+    Buckets are kept sorted in growable column arrays, so in-order ingest
+    either updates the last buckets in place or appends new ones.
+    """
+
+    def __init__(self, name: str, width: timedelta, retention: Optional[timedelta] = None,
+                 capacity: int = 256):
+        self.name = name
+        self.width = width
+        self.width_us = _us(width)
+        self.retention_buckets = _us(retention) // self.width_us if retention is not None else None
+        self.expired_before: Optional[int] = None  # Bucket id below which data was dropped
+        fields = len(FIELDS)
+        self._size = 0
+        self._buckets = np.empty(capacity, dtype=np.int64)
+        self._count = np.empty(capacity, dtype=np.int64)
+        self._sum = np.empty((capacity, fields), dtype=np.float64)
+        self._min = np.empty((capacity, fields), dtype=np.float64)
+        self._max = np.empty((capacity, fields), dtype=np.float64)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _columns(self) -> List[np.ndarray]:
+        return [self._buckets, self._count, self._sum, self._min, self._max]
+
+    def _reserve(self, count: int):
+        if self._size + count <= len(self._buckets):
+            return
+        capacity = max(len(self._buckets) * 2, self._size + count)
+        resized = []
+        for column in self._columns():
+            grown = np.empty((capacity,) + column.shape[1:], dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            resized.append(grown)
+        self._buckets, self._count, self._sum, self._min, self._max = resized
+
+    def merge(self, partials: Partials):
+        """Fold sorted, unique-keyed partial aggregates into the tier"""
+        keys, count, sums, mins, maxs = partials
+        if not len(keys):
+            return
+        size = self._size
+        if len(keys) == 1 and size and keys[0] >= self._buckets[size - 1]:
+            # Single in-order reading: plain row updates, no fancy indexing
+            if keys[0] == self._buckets[size - 1]:
+                last = size - 1
+                self._count[last] += count[0]
+                self._sum[last] += sums[0]
+                np.minimum(self._min[last], mins[0], out=self._min[last])
+                np.maximum(self._max[last], maxs[0], out=self._max[last])
+            else:
+                self._reserve(1)
+                for column, part in zip(self._columns(), partials):
+                    column[size] = part[0]
+                self._size += 1
+                self._apply_retention()
+            return
+        if size and keys[0] >= self._buckets[size - 1]:
+            # In-order data: only the first key can hit an existing (the last) bucket
+            position = np.full(len(keys), size - 1)
+            existing = np.zeros(len(keys), dtype=bool)
+            existing[0] = keys[0] == self._buckets[size - 1]
+        else:
+            position = np.searchsorted(self._buckets[:size], keys)
+            existing = position < size
+            existing[existing] = self._buckets[position[existing]] == keys[existing]
+
+        # Buckets already present (typically the last one) are updated in place
+        at = position[existing]
+        self._count[at] += count[existing]
+        self._sum[at] += sums[existing]
+        self._min[at] = np.minimum(self._min[at], mins[existing])
+        self._max[at] = np.maximum(self._max[at], maxs[existing])
+
+        new = ~existing
+        added = int(new.sum())
+        if added:
+            self._reserve(added)
+            parts = [keys[new], count[new], sums[new], mins[new], maxs[new]]
+            if size == 0 or keys[new][0] > self._buckets[size - 1]:
+                for column, part in zip(self._columns(), parts):
+                    column[size:size + added] = part
+            else:
+                # Late data: insert and re-sort
+                merged_keys = np.concatenate([self._buckets[:size], parts[0]])
+                order = np.argsort(merged_keys, kind='stable')
+                for column, part in zip(self._columns(), parts):
+                    column[:size + added] = np.concatenate([column[:size], part])[order]
+            self._size = size + added
+        self._apply_retention()
+
+    def _apply_retention(self):
+        if self.retention_buckets is None or not self._size:
+            return
+        cutoff = self._buckets[self._size - 1] - self.retention_buckets
+        drop = int(np.searchsorted(self._buckets[:self._size], cutoff))
+        # Shift only once enough has expired, so the cost is amortized
+        if drop and drop >= max(64, self._size // 4):
+            self.expired_before = int(self._buckets[drop])
+            for column in self._columns():
+                column[:self._size - drop] = column[drop:self._size]
+            self._size -= drop
+
+    def coarsen(self, partials: Partials, width_us: int) -> Partials:
+        """Partials of this tier regrouped into buckets of `width_us`"""
+        keys, count, sums, mins, maxs = partials
+        return _group(keys * self.width_us // width_us, count, sums, mins, maxs)
+
+    def covers(self, start: Optional[datetime]) -> bool:
+        """Whether retention has kept every bucket from `start` on"""
+        if self.expired_before is None:
+            return True
+        if start is None:
+            return False
+        return int(to_datetime64(start).astype(np.int64)) >= self.expired_before * self.width_us
+
+    def query(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict:
+        """Buckets starting in [start, end) as columns"""
+        buckets = self._buckets[:self._size]
+        lo = 0 if start is None else int(np.searchsorted(
+            buckets, int(to_datetime64(start).astype(np.int64)) // self.width_us, side='left'))
+        hi = self._size if end is None else int(np.searchsorted(
+            buckets, -(-int(to_datetime64(end).astype(np.int64)) // self.width_us), side='left'))
+        count = self._count[lo:hi]
+        return {
+            'timestamps': (buckets[lo:hi] * self.width_us).astype('datetime64[us]'),
+            'count': count.copy(),
+            'sum': self._sum[lo:hi].copy(),
+            'min': self._min[lo:hi].copy(),
+            'max': self._max[lo:hi].copy(),
+            'avg': self._sum[lo:hi] / np.maximum(count, 1)[:, None]
+        }
+
+
+class Rollups:
+    """Rollup tiers of one home, each maintained incrementally on ingest
+
+    A batch is aggregated once into 1-minute partials, which are then
+    regrouped for every coarser tier (1 min -> 15 min -> 1 h -> 1 day), so
+    ingest cost grows with the batch and not with the stored history.
+    """
+
+    def __init__(self, tiers: Sequence[Tuple[str, timedelta, Optional[timedelta]]] = TIERS):
+        self.tiers = [RollupTier(name, width, retention) for name, width, retention in tiers]
+        self.by_name = {tier.name: tier for tier in self.tiers}
+
+    def add(self, timestamps: np.ndarray, values: np.ndarray):
+        """Add a column batch (see ReadingStore.extend)"""
+        if not len(timestamps):
+            return
+        values = np.asarray(values, dtype=np.float64).reshape(len(timestamps), len(FIELDS))
+        finest = self.tiers[0]
+        keys = np.asarray(timestamps, dtype='datetime64[us]').astype(np.int64) // finest.width_us
+        if len(keys) > 1:
+            order = np.argsort(keys, kind='stable')
+            keys, values = keys[order], values[order]
+        rows = values
+        partials = _group(keys, np.ones(len(keys), dtype=np.int64), rows, rows, rows)
+        finest.merge(partials)
+        previous = finest
+        for tier in self.tiers[1:]:
+            partials = previous.coarsen(partials, tier.width_us)
+            tier.merge(partials)
+            previous = tier
+
+    def choose(self, start: Optional[datetime], end: Optional[datetime],
+               max_points: int) -> RollupTier:
+        """The finest tier that covers [start, end) in at most `max_points` buckets"""
+        first = self.tiers[-1].query()['timestamps'][:1]
+        if not len(first):
+            return self.tiers[-1]
+        start64 = max(to_datetime64(start), first[0]) if start is not None else first[0]
+        end64 = to_datetime64(end or datetime.now(timezone.utc))
+        for tier in self.tiers:
+            if tier.covers(start) and (end64 - start64) // np.timedelta64(tier.width_us, 'us') <= max_points:
+                return tier
+        return self.tiers[-1]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Indices of `threshold` points chosen by Largest-Triangle-Three-Buckets
+
+    Keeps the first and last point and, from each of the equal-sized
+    buckets in between, the point forming the largest triangle with the
+    previously kept point and the average of the next bucket, which
+    preserves the peaks and troughs a chart needs.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+        area = np.abs((x[previous] - avg_x) * (y[lo:hi] - y[previous])
+                      - (x[previous] - x[lo:hi]) * (avg_y - y[previous]))
+        previous = lo + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+def downsample(timestamps: np.ndarray, series: Sequence[np.ndarray], max_points: int) -> np.ndarray:
+    """Sorted indices of at most `max_points` rows, chosen by LTTB on each series
+
+    Every series gets an equal share of the points, so the peaks of all of
+    them survive.
+    """
+    if len(timestamps) <= max_points:
+        return np.arange(len(timestamps))
+    x = np.asarray(timestamps, dtype='datetime64[us]').astype(np.int64).astype(np.float64)
+    share = max(3, max_points // max(len(series), 1))
+    return np.unique(np.concatenate([lttb(x, y, share) for y in series]))
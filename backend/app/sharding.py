@@ -0,0 +1,96 @@
+from bisect import bisect
+from typing import List, Optional, Sequence
+import hashlib
+import multiprocessing
+import os
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent-hash ring mapping home ids to worker names
+
+    Each worker is placed on the ring `replicas` times, so adding or removing
+    a worker only moves about 1/N of the homes.
+    """
+
+    def __init__(self, nodes: Sequence[str], replicas: int = 64):
+        if not nodes:
+            raise ValueError("HashRing needs at least one node")
+        self.nodes = list(nodes)
+        points = sorted(
+            (_hash(f"{node}#{replica}"), node)
+            for node in self.nodes
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key: str) -> str:
+        index = bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+def worker_name(index: int) -> str:
+    return f"worker-{index}"
+
+
+class WorkerConfig:
+    """This process's place in a multi-worker deployment, read from the environment
+
+    ENERGY_WORKER_COUNT is the number of workers and ENERGY_WORKER_INDEX this
+    worker's index; ENERGY_WORKER_PORT_BASE is the port of worker 0, the
+    others listening on consecutive ports.
+    """
+
+    def __init__(self, count: int = 1, index: int = 0, port_base: int = 8000):
+        self.count = count
+        self.index = index
+        self.port_base = port_base
+        self.name = worker_name(index)
+        self.ring = HashRing([worker_name(i) for i in range(count)]) if count > 1 else None
+
+    @classmethod
+    def from_env(cls) -> 'WorkerConfig':
+        return cls(
+            count=int(os.environ.get("ENERGY_WORKER_COUNT", "1")),
+            index=int(os.environ.get("ENERGY_WORKER_INDEX", "0")),
+            port_base=int(os.environ.get("ENERGY_WORKER_PORT_BASE", "8000"))
+        )
+
+    def owner(self, home_id: str) -> str:
+        return self.ring.owner(home_id) if self.ring is not None else self.name
+
+    def owns(self, home_id: str) -> bool:
+        return self.owner(home_id) == self.name
+
+    def port_of(self, worker: str) -> int:
+        return self.port_base + int(worker.rsplit('-', 1)[1])
+
+
+def _serve_worker(index: int, count: int, host: str, port_base: int, app: str):
+    os.environ["ENERGY_WORKER_COUNT"] = str(count)
+    os.environ["ENERGY_WORKER_INDEX"] = str(index)
+    os.environ["ENERGY_WORKER_PORT_BASE"] = str(port_base)
+    import uvicorn
+    uvicorn.run(app, host=host, port=port_base + index)
+
+
+def run_cluster(workers: int, host: str = "0.0.0.0", port_base: int = 8000,
+                app: str = "app.api:app", processes: Optional[List] = None):
+    """Run one uvicorn process per worker on consecutive ports
+
+    Every worker serves only the homes the hash ring assigns to it and
+    answers 421 with the owner's port for the rest, so a proxy (or the
+    gateway itself) can route by home_id.
+    """
+    context = multiprocessing.get_context("spawn")
+    processes = processes if processes is not None else []
+    for index in range(workers):
+        process = context.Process(target=_serve_worker, args=(index, workers, host, port_base, app))
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()
@@ -0,0 +1,446 @@
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+# Numeric reading fields, in column order of the value block
+FIELDS = ('production', 'consumption', 'battery_level', 'temperature', 'cloud_cover')
+
+# Defaults used when a reading carries no weather information
+WEATHER_DEFAULTS = {'temperature': 20.0, 'cloud_cover': 0.0, 'condition': ''}
+
+# Fields whose peaks are tracked by the rolling windows
+PEAK_FIELDS = ('production', 'consumption')
+
+# Rolling windows maintained incrementally on every append
+DEFAULT_WINDOWS = {
+    '1h': timedelta(hours=1),
+    '24h': timedelta(hours=24),
+    '7d': timedelta(days=7)
+}
+
+
+def to_datetime64(timestamp: datetime) -> np.datetime64:
+    """Convert a datetime to naive datetime64[us] (aware values are taken as UTC)"""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(timestamp, 'us')
+
+
+def weather_value(weather, key: str):
+    """Read a weather field from either a dict or a model object"""
+    if weather is None:
+        return WEATHER_DEFAULTS[key]
+    if isinstance(weather, dict):
+        value = weather.get(key)
+    else:
+        value = getattr(weather, key, None)
+    return WEATHER_DEFAULTS[key] if value is None else value
+
+
+def _readonly(array: np.ndarray) -> np.ndarray:
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+class RollingMax:
+    """Monotonic-deque maximum of readings newer than a moving cutoff
+
+    Each deque holds (timestamp, value) pairs with strictly decreasing values,
+    so pushes and cutoff expiry are amortized O(1) and the current maximum is
+    always at the front. Out-of-order inserts or a cutoff that moves backwards
+    mark the window dirty; it is then rebuilt once from the store in a single
+    vectorized pass.
+    """
+
+    def __init__(self, length: timedelta):
+        self.length = np.timedelta64(length, 'us')
+        self._columns = [FIELDS.index(name) for name in PEAK_FIELDS]
+        self._queues = [deque() for _ in self._columns]
+        self._cutoff = None
+        self.dirty = False
+
+    def push(self, timestamp: np.datetime64, row: np.ndarray):
+        if self.dirty:
+            return
+        for queue, column in zip(self._queues, self._columns):
+            value = row[column]
+            while queue and queue[-1][1] <= value:
+                queue.pop()
+            queue.append((timestamp, value))
+
+    def peaks(self, cutoff: np.datetime64, timestamps: np.ndarray,
+              values: np.ndarray) -> List[Optional[float]]:
+        """Maximum of each peak field over readings with timestamp > cutoff"""
+        if len(timestamps):
+            # Readings evicted by retention must not count either
+            cutoff = max(cutoff, timestamps[0] - np.timedelta64(1, 'us'))
+        if self.dirty or (self._cutoff is not None and cutoff < self._cutoff):
+            self._rebuild(cutoff, timestamps, values)
+        self._cutoff = cutoff
+        result = []
+        for queue in self._queues:
+            while queue and queue[0][0] <= cutoff:
+                queue.popleft()
+            result.append(float(queue[0][1]) if queue else None)
+        return result
+
+    def _rebuild(self, cutoff: np.datetime64, timestamps: np.ndarray, values: np.ndarray):
+        start = int(np.searchsorted(timestamps, cutoff, side='right'))
+        timestamps = timestamps[start:]
+        for index, column in enumerate(self._columns):
+            segment = values[start:, column]
+            keep = np.ones(len(segment), dtype=bool)
+            if len(segment) > 1:
+                # Keep values strictly greater than everything after them
+                later_max = np.maximum.accumulate(segment[::-1])[::-1]
+                keep[:-1] = segment[:-1] > later_max[1:]
+            self._queues[index] = deque(zip(timestamps[keep], segment[keep]))
+        self.dirty = False
+
+    def reset(self):
+        for queue in self._queues:
+            queue.clear()
+        self._cutoff = None
+        self.dirty = False
+
+
+class ReadingStore:
+    """Columnar, append-only store of energy readings
+
+    Readings are kept in one growable float64 block (one column per field in
+    FIELDS), a datetime64 column and an interned weather-condition column.
+    Appends are amortized O(1). When `max_readings` or `retention` is set the
+    store behaves as a sliding window: old rows are dropped by moving the
+    start offset and the live rows are compacted to the front only when the
+    buffer is exhausted, so every view stays a contiguous, zero-copy slice.
+
+    Rows are kept sorted by timestamp (late readings are inserted in place),
+    which makes time-range lookups a binary search. A prefix-sum block gives
+    O(1) range sums and the rolling windows keep their peaks incrementally.
+    """
+
+    def __init__(self, capacity: int = 1024, max_readings: Optional[int] = None,
+                 retention: Optional[timedelta] = None,
+                 windows: Optional[Dict[str, timedelta]] = None):
+        if max_readings is not None and max_readings <= 0:
+            raise ValueError("max_readings must be positive")
+        capacity = max(int(capacity), 16)
+        if max_readings is not None:
+            capacity = min(capacity, 2 * max_readings)
+        self.max_readings = max_readings
+        self.retention = retention
+        self._start = 0
+        self._size = 0
+        self._timestamps = np.empty(capacity, dtype='datetime64[us]')
+        self._values = np.empty((capacity, len(FIELDS)), dtype=np.float64)
+        self._prefix = np.empty((capacity, len(FIELDS)), dtype=np.float64)
+        self._prefix_base = np.zeros(len(FIELDS), dtype=np.float64)
+        self._conditions = np.empty(capacity, dtype=np.int32)
+        self._condition_codes: Dict[str, int] = {}
+        self.condition_names: List[str] = []
+        self.dropped = 0  # Rows evicted by the retention window
+        self.windows = {
+            name: RollingMax(length)
+            for name, length in (DEFAULT_WINDOWS if windows is None else windows).items()
+        }
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def capacity(self) -> int:
+        return len(self._timestamps)
+
+    @property
+    def total_appended(self) -> int:
+        """Number of rows ever appended, including evicted ones"""
+        return self.dropped + self._size
+
+    def condition_code(self, condition: str) -> int:
+        """Intern a weather condition and return its integer code"""
+        code = self._condition_codes.get(condition)
+        if code is None:
+            code = len(self.condition_names)
+            self._condition_codes[condition] = code
+            self.condition_names.append(condition)
+        return code
+
+    def append(self, timestamp: datetime, production: float, consumption: float,
+               battery_level: float, weather_data=None) -> int:
+        """Append one reading and return its position in the store"""
+        self._reserve(1)
+        timestamp = to_datetime64(timestamp)
+        end = self._start + self._size
+        if self._size and timestamp < self._timestamps[end - 1]:
+            index = self._make_gap(timestamp)
+        else:
+            index = self._size
+        position = self._start + index
+        self._timestamps[position] = timestamp
+        row = self._values[position]
+        row[0] = production
+        row[1] = consumption
+        row[2] = battery_level
+        row[3] = weather_value(weather_data, 'temperature')
+        row[4] = weather_value(weather_data, 'cloud_cover')
+        self._conditions[position] = self.condition_code(str(weather_value(weather_data, 'condition')))
+        self._size += 1
+        if index == self._size - 1:
+            self._prefix[position] = self._prefix_at(index - 1) + row
+            for window in self.windows.values():
+                window.push(timestamp, row)
+        else:
+            self._refresh_prefix(index)
+            for window in self.windows.values():
+                window.dirty = True
+        dropped = self._apply_retention()
+        return index - dropped
+
+    def append_reading(self, reading) -> int:
+        """Append an EnergyData/EnergyReading-like object"""
+        return self.append(reading.timestamp, reading.production, reading.consumption,
+                           reading.battery_level, reading.weather_data)
+
+    def extend(self, timestamps: np.ndarray, values: np.ndarray, conditions: Sequence[str]) -> int:
+        """Append a batch of readings in one operation and return how many were stored
+
+        `values` is a (rows, len(FIELDS)) array in FIELDS order. Batches that
+        start at or after the newest stored reading are copied straight to
+        the end; otherwise only the overlapping tail is re-sorted.
+        """
+        timestamps = np.asarray(timestamps, dtype='datetime64[us]')
+        count = len(timestamps)
+        if count == 0:
+            return 0
+        values = np.asarray(values, dtype=np.float64).reshape(count, len(FIELDS))
+        names, inverse = np.unique(np.asarray(conditions, dtype=object).astype(str), return_inverse=True)
+        lookup = np.array([self.condition_code(str(name)) for name in names], dtype=np.int32)
+        codes = lookup[inverse.reshape(-1)]
+
+        self._reserve(count)
+        end = self._start + self._size
+        if self._size and timestamps.min() < self._timestamps[end - 1]:
+            lo = int(np.searchsorted(self._timestamps[self._slice(None, None)], timestamps.min(), side='right'))
+        else:
+            lo = self._size
+        rows = slice(end, end + count)
+        self._timestamps[rows] = timestamps
+        self._values[rows] = values
+        self._conditions[rows] = codes
+        self._size += count
+
+        tail = slice(self._start + lo, self._start + self._size)
+        order = np.argsort(self._timestamps[tail], kind='stable')
+        if lo < self._size - count or (np.diff(order) != 1).any():
+            self._timestamps[tail] = self._timestamps[tail][order]
+            self._values[tail] = self._values[tail][order]
+            self._conditions[tail] = self._conditions[tail][order]
+        self._refresh_prefix(lo)
+        # Peaks are rebuilt in one vectorized pass on the next query
+        for window in self.windows.values():
+            window.dirty = True
+        self._apply_retention()
+        return count
+
+    def _make_gap(self, timestamp: np.datetime64) -> int:
+        """Shift later rows right by one so a late reading can be inserted in order"""
+        index = int(np.searchsorted(self._timestamps[self._slice(None, None)], timestamp, side='right'))
+        source = slice(self._start + index, self._start + self._size)
+        target = slice(source.start + 1, source.stop + 1)
+        self._timestamps[target] = self._timestamps[source]
+        self._values[target] = self._values[source]
+        self._conditions[target] = self._conditions[source]
+        return index
+
+    def _prefix_at(self, index: int) -> np.ndarray:
+        """Prefix sum of local rows [0, index] (-1 is the empty prefix)"""
+        if index < 0:
+            return self._prefix_base
+        return self._prefix[self._start + index]
+
+    def _refresh_prefix(self, index: int):
+        """Recompute prefix sums from a local index to the end"""
+        rows = slice(self._start + index, self._start + self._size)
+        np.cumsum(self._values[rows], axis=0, out=self._prefix[rows])
+        self._prefix[rows] += self._prefix_at(index - 1)
+
+    def _reserve(self, count: int):
+        """Make room for `count` more rows at the end of the buffer"""
+        end = self._start + self._size
+        if end + count <= self.capacity:
+            return
+        needed = self._size + count
+        if self.max_readings is not None and needed <= self.capacity and self._start > 0:
+            self._compact(self.capacity)
+            return
+        new_capacity = self.capacity
+        while new_capacity < needed:
+            new_capacity *= 2
+        if self.max_readings is not None:
+            new_capacity = max(min(new_capacity, 2 * self.max_readings), needed)
+        self._compact(new_capacity)
+
+    def _compact(self, capacity: int):
+        """Move the live rows to the front of a buffer of the given capacity"""
+        live = slice(self._start, self._start + self._size)
+        if capacity == self.capacity:
+            timestamps, values, conditions = self._timestamps, self._values, self._conditions
+            prefix = self._prefix
+        else:
+            timestamps = np.empty(capacity, dtype=self._timestamps.dtype)
+            values = np.empty((capacity, len(FIELDS)), dtype=self._values.dtype)
+            prefix = np.empty((capacity, len(FIELDS)), dtype=self._prefix.dtype)
+            conditions = np.empty(capacity, dtype=self._conditions.dtype)
+        timestamps[:self._size] = self._timestamps[live]
+        values[:self._size] = self._values[live]
+        # Rebase the prefix sums so they stay small as history rolls over
+        prefix[:self._size] = self._prefix[live] - self._prefix_base
+        conditions[:self._size] = self._conditions[live]
+        self._timestamps, self._values, self._conditions = timestamps, values, conditions
+        self._prefix = prefix
+        self._prefix_base = np.zeros(len(FIELDS), dtype=np.float64)
+        self._start = 0
+
+    def _apply_retention(self) -> int:
+        drop = 0
+        if self.max_readings is not None and self._size > self.max_readings:
+            drop = self._size - self.max_readings
+        if self.retention is not None and self._size:
+            timestamps = self._timestamps[self._slice(None, None)]
+            cutoff = timestamps[-1] - np.timedelta64(self.retention)
+            drop = max(drop, int(np.searchsorted(timestamps, cutoff, side='left')))
+        if drop:
+            self._drop_oldest(drop)
+        return drop
+
+    def _drop_oldest(self, count: int):
+        self._prefix_base = self._prefix_at(count - 1).copy()
+        self._start += count
+        self._size -= count
+        self.dropped += count
+        if self._size == 0:
+            self.clear()
+
+    def clear(self):
+        """Drop all rows, keeping the allocated buffers"""
+        self.dropped += self._size
+        self._start = 0
+        self._size = 0
+        self._prefix_base = np.zeros(len(FIELDS), dtype=np.float64)
+        for window in self.windows.values():
+            window.reset()
+
+    # Zero-copy views ---------------------------------------------------------
+
+    def _slice(self, start: Optional[int], stop: Optional[int]) -> slice:
+        start, stop, _ = slice(start, stop).indices(self._size)
+        return slice(self._start + start, self._start + max(start, stop))
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return _readonly(self._timestamps[self._slice(None, None)])
+
+    @property
+    def condition_codes(self) -> np.ndarray:
+        return _readonly(self._conditions[self._slice(None, None)])
+
+    def column(self, name: str, start: Optional[int] = None,
+               stop: Optional[int] = None) -> np.ndarray:
+        """Read-only view of one numeric field"""
+        return _readonly(self._values[self._slice(start, stop), FIELDS.index(name)])
+
+    def values(self, start: Optional[int] = None, stop: Optional[int] = None) -> np.ndarray:
+        """Read-only (rows, len(FIELDS)) view of the numeric block"""
+        return _readonly(self._values[self._slice(start, stop)])
+
+    def to_frame(self, start: Optional[int] = None, stop: Optional[int] = None):
+        """Build a timestamp-indexed DataFrame over the stored columns without copying them"""
+        import pandas as pd
+
+        rows = self._slice(start, stop)
+        frame = pd.DataFrame(
+            _readonly(self._values[rows]),
+            columns=list(FIELDS),
+            index=pd.DatetimeIndex(_readonly(self._timestamps[rows]), name='timestamp'),
+            copy=False
+        )
+        frame['condition'] = pd.Categorical.from_codes(
+            self._conditions[rows], categories=pd.Index(self.condition_names, dtype=object)
+        )
+        return frame
+
+    # Time-range queries ------------------------------------------------------
+
+    def index_range(self, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None) -> Tuple[int, int]:
+        """Local row bounds [lo, hi) of readings with start <= timestamp < end"""
+        timestamps = self._timestamps[self._slice(None, None)]
+        lo = 0 if start is None else int(np.searchsorted(timestamps, to_datetime64(start), side='left'))
+        hi = self._size if end is None else int(np.searchsorted(timestamps, to_datetime64(end), side='left'))
+        return lo, max(lo, hi)
+
+    def range_sum(self, lo: int, hi: int) -> np.ndarray:
+        """Per-field sums over local rows [lo, hi) in O(1)"""
+        if hi <= lo:
+            return np.zeros(len(FIELDS), dtype=np.float64)
+        return self._prefix_at(hi - 1) - self._prefix_at(lo - 1)
+
+    def range_stats(self, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None) -> Dict:
+        """Count, averages and peaks of readings in [start, end)"""
+        lo, hi = self.index_range(start, end)
+        peaks = [None] * len(PEAK_FIELDS)
+        if hi > lo:
+            block = self._values[self._start + lo:self._start + hi]
+            peaks = [float(block[:, FIELDS.index(name)].max()) for name in PEAK_FIELDS]
+        return self._stats(hi - lo, self.range_sum(lo, hi), peaks)
+
+    def window_stats(self, name: str, now: Optional[datetime] = None) -> Dict:
+        """Stats of readings newer than `now - window` in O(log n)"""
+        window = self.windows[name]
+        cutoff = to_datetime64(now or datetime.now(timezone.utc)) - window.length
+        live = self._slice(None, None)
+        timestamps = self._timestamps[live]
+        lo = int(np.searchsorted(timestamps, cutoff, side='right'))
+        peaks = window.peaks(cutoff, timestamps, self._values[live])
+        return self._stats(self._size - lo, self.range_sum(lo, self._size), peaks)
+
+    def _stats(self, count: int, sums: np.ndarray, peaks: List[Optional[float]]) -> Dict:
+        stats = {'total_readings': count}
+        for name in PEAK_FIELDS:
+            stats[f'avg_{name}'] = float(sums[FIELDS.index(name)]) / count if count else None
+        for name, peak in zip(PEAK_FIELDS, peaks):
+            stats[f'peak_{name}'] = peak
+        return stats
+
+    # Row access --------------------------------------------------------------
+
+    def row(self, index: int) -> Dict:
+        """Materialize one reading as a plain dict"""
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("reading index out of range")
+        position = self._start + index
+        values = self._values[position]
+        return {
+            'timestamp': self._timestamps[position].item(),
+            'production': float(values[0]),
+            'consumption': float(values[1]),
+            'battery_level': float(values[2]),
+            'weather_data': {
+                'temperature': float(values[3]),
+                'cloud_cover': float(values[4]),
+                'condition': self.condition_names[self._conditions[position]]
+            }
+        }
+
+    def rows(self, start: Optional[int] = None, stop: Optional[int] = None) -> Iterator[Dict]:
+        rows = self._slice(start, stop)
+        for position in range(rows.start - self._start, rows.stop - self._start):
+            yield self.row(position)
+
+    def latest(self) -> Optional[Dict]:
+        return self.row(-1) if self._size else None
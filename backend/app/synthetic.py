@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import numpy as np
+
+from .energy_agents import EnergyData
+from .persistence import Columns
+from .store import FIELDS, ReadingStore
+
+# Cloud cover above these limits is reported as the next condition
+CONDITIONS = (('sunny', 0.3), ('cloudy', 0.7), ('rainy', np.inf))
+
+
+def generate_fleet(homes: int, days: int, step: timedelta = timedelta(hours=1),
+                   start: datetime = datetime(2024, 6, 1), seed: int = 0,
+                   battery_capacity: float = 13.5) -> Dict[str, Columns]:
+    """Seeded synthetic readings for `homes` homes over `days` days
+
+    Every home gets its own panel size, base load and daily routine.
+    Production follows a clear-sky curve whose day length varies with the
+    season, dimmed by day-to-day weather; consumption has morning and
+    evening peaks plus heating/cooling load, and the battery absorbs the
+    net balance within 20-90% of `battery_capacity`. Returns column
+    batches (see ReadingStore.extend) keyed by home id; the same seed
+    always gives the same fleet.
+    """
+    rng = np.random.default_rng(seed)
+    steps = int(timedelta(days=days) / step)
+    step_hours = step / timedelta(hours=1)
+    timestamps = np.datetime64(start, 'us') + np.arange(steps) * np.timedelta64(step)
+    hour = (timestamps - timestamps.astype('datetime64[D]')) / np.timedelta64(1, 'h')
+    day_of_year = (timestamps.astype('datetime64[D]') - timestamps.astype('datetime64[Y]')).astype(np.int64)
+    day_index = np.arange(steps) * step_hours // 24
+    day_index = day_index.astype(np.int64)
+
+    # Fleet-wide weather with a little local variation per home
+    season = np.cos(2 * np.pi * (day_of_year - 172) / 365)  # 1 at midsummer
+    daily_cloud = np.clip(rng.beta(0.8, 1.2, days + 1), 0, 1)
+    cloud = np.clip(daily_cloud[day_index][None, :] + rng.normal(0, 0.1, (homes, steps)), 0, 1)
+    temperature = (12 + 10 * season + 6 * np.sin(2 * np.pi * (hour - 9) / 24))[None, :] \
+        + rng.normal(0, 1.5, (homes, steps))
+
+    # Solar production: half-sine between sunrise and sunset
+    day_length = 12 + 4 * season
+    sunrise = 12 - day_length / 2
+    daylight = np.clip((hour - sunrise) / day_length, 0, 1)
+    clear_sky = np.sin(np.pi * daylight) ** 1.5
+    panel_kw = rng.uniform(3, 9, homes)[:, None]
+    production = panel_kw * clear_sky[None, :] * (1 - 0.75 * cloud ** 3) * step_hours
+    production *= rng.uniform(0.95, 1.05, (homes, steps))
+
+    # Load: base + morning/evening peaks + heating/cooling
+    base = rng.uniform(0.3, 0.8, homes)[:, None]
+    morning = rng.uniform(0.5, 1.5, homes)[:, None] * np.exp(-((hour - 7.5) / 1.2) ** 2)[None, :]
+    evening = rng.uniform(1.0, 2.5, homes)[:, None] * np.exp(-((hour - 19) / 2.0) ** 2)[None, :]
+    hvac = 0.08 * np.abs(temperature - 20)
+    consumption = (base + morning + evening + hvac) * step_hours
+    consumption *= rng.lognormal(0, 0.15, (homes, steps))
+
+    # Battery follows the net balance within its bounds
+    battery = np.empty((homes, steps))
+    level = np.full(homes, battery_capacity * 0.5)
+    net = production - consumption
+    for i in range(steps):
+        level = np.clip(level + net[:, i], battery_capacity * 0.2, battery_capacity * 0.9)
+        battery[:, i] = level
+
+    limits = np.array([limit for _, limit in CONDITIONS])
+    names = np.array([name for name, _ in CONDITIONS], dtype=object)
+    conditions = names[np.searchsorted(limits, cloud, side='left')]
+
+    fleet = {}
+    for index in range(homes):
+        values = np.empty((steps, len(FIELDS)), dtype=np.float64)
+        values[:, FIELDS.index('production')] = production[index]
+        values[:, FIELDS.index('consumption')] = consumption[index]
+        values[:, FIELDS.index('battery_level')] = battery[index]
+        values[:, FIELDS.index('temperature')] = temperature[index]
+        values[:, FIELDS.index('cloud_cover')] = cloud[index]
+        fleet[f"home-{index:05d}"] = (timestamps.copy(), values, conditions[index])
+    return fleet
+
+
+def to_store(columns: Columns, capacity: Optional[int] = None) -> ReadingStore:
+    store = ReadingStore(capacity=capacity or max(len(columns[0]), 1))
+    store.extend(*columns)
+    return store
+
+
+def to_records(columns: Columns) -> List[Dict]:
+    """Readings as API request bodies (see POST /readings)"""
+    timestamps, values, conditions = columns
+    return [
+        {
+            'timestamp': str(timestamp),
+            'production': row[FIELDS.index('production')],
+            'consumption': row[FIELDS.index('consumption')],
+            'battery_level': row[FIELDS.index('battery_level')],
+            'weather_data': {
+                'temperature': row[FIELDS.index('temperature')],
+                'cloud_cover': row[FIELDS.index('cloud_cover')],
+                'condition': str(condition)
+            }
+        }
+        for timestamp, row, condition in zip(timestamps, values.tolist(), conditions)
+    ]
+
+
+def to_energy_data(columns: Columns) -> List[EnergyData]:
+    """Readings as EnergyData for driving the agents directly"""
+    return [
+        EnergyData(
+            timestamp=datetime.fromisoformat(record['timestamp']),
+            production=record['production'],
+            consumption=record['consumption'],
+            battery_level=record['battery_level'],
+            weather_data=record['weather_data']
+        )
+        for record in to_records(columns)
+    ]
@@ -0,0 +1,123 @@
+from datetime import timedelta
+from typing import Optional, Sequence, Tuple
+from weakref import WeakKeyDictionary
+import numpy as np
+
+from .features import HORIZON
+
+INTERVAL_METHODS = ('conformal', 'quantile')
+
+# Calibration scores kept per step ahead; older ones are replaced as new rows are scored
+MAX_SCORES = 2048
+
+# Scores are kept per STEP ahead of the newest known reading, up to HORIZON
+STEP = timedelta(hours=1)
+STEPS = HORIZON // STEP
+
+# Leaf value tables by forest, with the identities of the trees they were built from
+_tables: 'WeakKeyDictionary' = WeakKeyDictionary()
+
+
+def _leaf_table(forest) -> Tuple[np.ndarray, np.ndarray]:
+    """Leaf values of every tree stacked into one (nodes, outputs) table, and each tree's offset"""
+    signature = tuple(id(tree) for tree in forest.estimators_)
+    cached = _tables.get(forest)
+    if cached is not None and cached[0] == signature:
+        return cached[1], cached[2]
+    values = [tree.tree_.value[:, :, 0] for tree in forest.estimators_]
+    offsets = np.cumsum([0] + [len(value) for value in values[:-1]])
+    table = np.concatenate(values)
+    _tables[forest] = (signature, table, offsets)
+    return table, offsets
+
+
+def tree_predictions(forest, X: np.ndarray) -> np.ndarray:
+    """Prediction of every tree for every row, shaped (rows, trees, outputs)
+
+    One `apply` call finds the leaf of each row in each tree and one
+    gather from the stacked leaf table reads their values, so the cost
+    does not include a Python call per tree. The mean over trees equals
+    forest.predict(X).
+    """
+    leaves = forest.apply(X)
+    table, offsets = _leaf_table(forest)
+    return table[leaves + offsets]
+
+
+def steps_ahead(timestamps: np.ndarray, known: Optional[np.datetime64]) -> np.ndarray:
+    """Step of each forecast row: 0 up to one STEP after `known`, capped at STEPS - 1"""
+    timestamps = np.asarray(timestamps, dtype='datetime64[us]')
+    if known is None:
+        return np.full(len(timestamps), STEPS - 1)
+    offsets = (timestamps - known) / np.timedelta64(STEP, 'us')
+    return np.clip(np.ceil(offsets) - 1, 0, STEPS - 1).astype(np.int64)
+
+
+class ConformalCalibration:
+    """Normalized nonconformity scores |y - mean| / (spread + floor) per step ahead and target
+
+    An interval mean +/- q * (spread + floor), with q the coverage quantile
+    of the scores, covers new values at that rate when they behave like
+    the scored rows. Scores come from forecasts of readings the models had
+    not been fitted on, made the way predict_horizon makes them (history
+    features as of the forecast's start, weather held at its last
+    reading): the newest rows held out of a full fit, and new readings
+    before each incremental update, so the scores follow drift. Errors
+    grow with the distance from the last reading, so each step ahead has
+    its own scores; steps without any use those of all steps.
+    """
+
+    def __init__(self, floor: Sequence[float], steps: int = STEPS, max_scores: int = MAX_SCORES):
+        self.floor = np.asarray(floor, dtype=np.float64)
+        self.max_scores = max_scores
+        self.scores = [np.empty((0, len(self.floor)), dtype=np.float64) for _ in range(steps)]
+
+    def __len__(self) -> int:
+        return sum(len(scores) for scores in self.scores)
+
+    def update(self, y: np.ndarray, mean: np.ndarray, spread: np.ndarray, steps: np.ndarray):
+        scores = np.abs(y - mean) / (spread + self.floor)
+        for step in np.unique(steps):
+            self.scores[step] = np.concatenate([self.scores[step], scores[steps == step]])[-self.max_scores:]
+
+    def quantile(self, coverage: float, steps: np.ndarray) -> np.ndarray:
+        """(rows, targets) score quantiles of each row's step, with the finite-sample correction"""
+        pooled = _corrected_quantile(np.concatenate(self.scores), coverage)
+        by_step = np.array([
+            _corrected_quantile(scores, coverage) if len(scores) else pooled
+            for scores in self.scores
+        ])
+        return by_step[steps]
+
+    def bounds(self, mean: np.ndarray, spread: np.ndarray, coverage: float,
+               steps: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        half_width = self.quantile(coverage, steps) * (spread + self.floor)
+        return mean - half_width, mean + half_width
+
+
+def _corrected_quantile(scores: np.ndarray, coverage: float) -> np.ndarray:
+    count = len(scores)
+    if not count:
+        return np.zeros(scores.shape[1])
+    level = min(1.0, np.ceil((count + 1) * coverage) / count)
+    return np.quantile(scores, level, axis=0)
+
+
+def quantile_bounds(predictions: np.ndarray, coverage: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Central `coverage` interval of the tree predictions, (rows, outputs) each"""
+    tail = (1.0 - coverage) / 2
+    lower, upper = np.quantile(predictions, [tail, 1.0 - tail], axis=1)
+    return lower, upper
+
+
+def interval_confidence(predicted: np.ndarray, lower: np.ndarray, upper: np.ndarray,
+                        scale: Optional[float]) -> np.ndarray:
+    """Confidence in (0, 1] per row, falling as the intervals widen
+
+    exp(-total width / (total |prediction| + scale)): `scale` (a typical
+    target magnitude) keeps near-zero predictions, such as solar output at
+    night, from turning small absolute widths into low confidence.
+    """
+    width = np.sum(upper - lower, axis=-1)
+    magnitude = np.sum(np.abs(predicted), axis=-1) + (scale or 1.0)
+    return np.exp(-width / magnitude)
@@ -0,0 +1,215 @@
+"""Benchmarks of the agents and API on a seeded synthetic fleet
+
+Run from the backend directory:
+
+    python -m benchmarks.run --homes 20 --days 30 --output results.json
+    python -m benchmarks.run --compare results.json
+
+Each benchmark reports calls, throughput, p50/p99/mean latency and the
+peak memory (tracemalloc) of one extra call. Results are written as JSON
+together with the commit they were measured on, and `--compare` prints
+the change against an earlier results file. The pipeline benchmark
+replays the fleet through the agent pipeline at `--replay-speed` x real
+time; its latency is per reading, from submission to actions.
+"""
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+
+from app.energy_agents import MonitoringAgent, OptimizationAgent, PredictionAgent
+from app.homes import DataStore, HomeShards
+from app.pipeline import Pipeline, replay
+from app.synthetic import generate_fleet, to_energy_data, to_records, to_store
+
+
+def measure(fn: Callable[[int], object], calls: int, items_per_call: int = 1) -> Dict:
+    """Time `calls` calls of fn(i), then one traced call for peak memory"""
+    latencies = np.empty(calls)
+    started = time.perf_counter()
+    for i in range(calls):
+        begin = time.perf_counter()
+        fn(i)
+        latencies[i] = time.perf_counter() - begin
+    total = time.perf_counter() - started
+
+    tracemalloc.start()
+    fn(calls % max(calls, 1))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'calls': calls,
+        'items': calls * items_per_call,
+        'total_s': total,
+        'throughput_per_s': calls * items_per_call / total if total else None,
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'mean_ms': float(latencies.mean() * 1000),
+        'peak_memory_bytes': peak
+    }
+
+
+def bench_agents(fleet: Dict, homes: List[str], results: Dict):
+    readings = to_energy_data(fleet[homes[0]])
+    monitor = MonitoringAgent(homes[0])
+    results['monitor.process_reading'] = measure(
+        lambda i: monitor.process_reading(readings[i % len(readings)]), len(readings))
+
+    stores = [to_store(fleet[home_id]) for home_id in homes]
+    agents = [PredictionAgent(home_id) for home_id in homes]
+    results['prediction.train'] = measure(lambda i: agents[i % len(agents)].train(stores[i % len(stores)]),
+                                          len(agents))
+
+    current = readings[-1]
+    predictor = agents[0]
+    results['prediction.predict_next_24h'] = measure(lambda i: predictor.predict_next_24h(current), 200)
+
+    predictions = predictor.predict_next_24h(current)
+    week = predictor.predict_horizon(current, horizon=168)
+    optimizer = OptimizationAgent(homes[0])
+    results['optimization.optimize_usage'] = measure(
+        lambda i: optimizer.optimize_usage(current, predictions), 500)
+    results['optimization.schedule_168h'] = measure(lambda i: optimizer.schedule(current, week), 200)
+
+
+def bench_api(fleet: Dict, homes: List[str], results: Dict):
+    from fastapi.testclient import TestClient
+    from app.api import app
+
+    records = {home_id: to_records(fleet[home_id]) for home_id in homes}
+    with TestClient(app) as client:
+        home_id = homes[0]
+        single = records[home_id]
+        results['api.post_reading'] = measure(
+            lambda i: client.post(f"/homes/{home_id}/readings", json=single[i % len(single)]),
+            min(len(single), 1000))
+
+        batch_homes = homes[1:] or homes
+        results['api.post_readings_batch'] = measure(
+            lambda i: client.post(f"/homes/{batch_homes[i % len(batch_homes)]}/readings/batch",
+                                  json=records[batch_homes[i % len(batch_homes)]]),
+            len(batch_homes), items_per_call=len(single))
+
+        # The first call trains the model; the rest hit the forecast cache
+        results['api.predict_next24h.first'] = measure(
+            lambda i: client.get(f"/homes/{batch_homes[i % len(batch_homes)]}/predict/next24h"),
+            len(batch_homes))
+        results['api.predict_next24h.cached'] = measure(
+            lambda i: client.get(f"/homes/{home_id}/predict/next24h"), 200)
+
+        results['api.optimize'] = measure(
+            lambda i: client.post(f"/homes/{home_id}/optimize", json=single[i % len(single)]), 500)
+
+        fleet_size = 10000
+        rng = np.random.default_rng(0)
+        body = {
+            'home_ids': [f"home-{i:05d}" for i in range(fleet_size)],
+            'production': rng.uniform(0, 6, fleet_size).tolist(),
+            'consumption': rng.uniform(0, 4, fleet_size).tolist(),
+            'battery_level': rng.uniform(2.7, 12.15, fleet_size).tolist()
+        }
+        results['api.optimize_batch'] = measure(lambda i: client.post("/optimize/batch", json=body), 20,
+                                                items_per_call=fleet_size)
+
+        results['api.status'] = measure(lambda i: client.get(f"/homes/{home_id}/status"), 500)
+
+
+def bench_pipeline(fleet: Dict, speed: float, results: Dict):
+    pipeline = Pipeline(HomeShards(lambda home_id: DataStore(home_id)))
+    replayed = asyncio.run(replay(pipeline, fleet, speed))
+    results['pipeline.replay'] = {
+        'calls': replayed['readings'],
+        'items': replayed['readings'],
+        'total_s': replayed['wall_s'],
+        'throughput_per_s': replayed['throughput_per_s'],
+        'p50_ms': replayed['latency_p50_ms'],
+        'p99_ms': replayed['latency_p99_ms'],
+        'mean_ms': replayed['latency_mean_ms'],
+        'peak_memory_bytes': None,
+        'speed': speed,
+        'lag_s': replayed['lag_s'],
+        'pipeline': replayed['pipeline']
+    }
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict, baseline: Dict):
+    """Print the p50 and throughput change of every shared benchmark"""
+    print(f"{'benchmark':40} {'p50 ms':>20} {'throughput/s':>24}")
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        p50_change = (result['p50_ms'] / old['p50_ms'] - 1) * 100 if old['p50_ms'] else 0.0
+        rate_change = ((result['throughput_per_s'] or 0) / old['throughput_per_s'] - 1) * 100 \
+            if old['throughput_per_s'] else 0.0
+        print(f"{name:40} {result['p50_ms']:12.3f} {p50_change:+6.1f}% "
+              f"{result['throughput_per_s'] or 0:16.1f} {rate_change:+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--homes", type=int, default=10)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-api", action="store_true", help="Only benchmark the agents")
+    parser.add_argument("--skip-pipeline", action="store_true", help="Skip the pipeline replay")
+    parser.add_argument("--replay-speed", type=float, default=float('inf'),
+                        help="Pipeline replay speed in x real time (default: as fast as it accepts)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Results JSON to compare against")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    fleet = generate_fleet(args.homes, args.days, seed=args.seed,
+                           start=datetime(2024, 6, 1) - timedelta(days=args.days))
+    homes = sorted(fleet)
+    results: Dict[str, Dict] = {}
+    bench_agents(fleet, homes, results)
+    if not args.skip_api:
+        bench_api(fleet, homes, results)
+    if not args.skip_pipeline:
+        bench_pipeline(fleet, args.replay_speed, results)
+
+    report = {
+        'meta': {
+            'commit': _commit(),
+            'measured_at': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'homes': args.homes,
+            'days': args.days,
+            'seed': args.seed,
+            'duration_s': time.perf_counter() - started
+        },
+        'results': results
+    }
+
+    for name, result in results.items():
+        print(f"{name:40} p50 {result['p50_ms']:9.3f} ms  p99 {result['p99_ms']:9.3f} ms  "
+              f"{result['throughput_per_s'] or 0:12.1f}/s  peak {(result['peak_memory_bytes'] or 0) / 2**20:8.2f} MiB")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import numpy as np
+
+from app.anomaly import AnomalyDetector
+from app.energy_agents import MonitoringAgent
+from app.synthetic import generate_fleet
+
+START = np.datetime64('2024-01-01T00:00', 'us')
+
+
+def _day(day: int) -> np.ndarray:
+    return START + np.timedelta64(day, 'D') + np.arange(24) * np.timedelta64(1, 'h')
+
+
+def _false_positive_rate(detector: AnomalyDetector, days: int, seed: int = 0) -> float:
+    rng = np.random.default_rng(seed)
+    flagged = 0
+    for day in range(days):
+        timestamps = _day(day)
+        values = rng.normal(5.0, 1.0, (24, 1))
+        flagged += np.count_nonzero(detector.score_batch(timestamps, values))
+        detector.update_batch(timestamps, values)
+    return flagged / (days * 24)
+
+
+def test_stationary_false_positive_rate():
+    # z > 4 on Gaussian data: about 6e-5 of readings
+    rate = _false_positive_rate(AnomalyDetector(fields=('production',)), days=300)
+    assert rate < 5e-4
+
+
+def test_quantile_bound_waits_for_enough_samples():
+    detector = AnomalyDetector(fields=('production',))
+    assert detector.quantile_samples == (1000, 1000)
+    for day in range(200):
+        timestamps = _day(day)
+        detector.update_batch(timestamps, np.full((24, 1), 5.0) + (day % 2))
+    # Above every value seen, but well within the z-score threshold
+    flags = detector.score_batch(_day(200)[:1], np.array([[7.0]]))
+    assert flags[0, 0] == 0
+    assert detector.score_batch(_day(200)[:1], np.array([[9.0]]))[0, 0] == 1
+
+
+def test_clean_synthetic_readings_are_rarely_flagged():
+    fleet = generate_fleet(3, 60, start=datetime(2024, 3, 1))
+    flagged = total = 0
+    for home_id, (timestamps, values, _) in fleet.items():
+        monitor = MonitoringAgent(home_id)
+        for lo in range(0, len(timestamps), 24):
+            flags = monitor.detect_batch(timestamps[lo:lo + 24], values[lo:lo + 24])
+            flagged += np.count_nonzero(flags.any(axis=1))
+            total += len(flags)
+    assert flagged / total < 0.01
@@ -0,0 +1,63 @@
+import threading
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+
+from app import api
+from app.execution import ExecutionLayer
+
+
+def _reading(production: float, consumption: float) -> dict:
+    return {"timestamp": datetime.now().isoformat(), "production": production,
+            "consumption": consumption, "battery_level": 5.0,
+            "weather_data": {"temperature": 20.0, "cloud_cover": 0.1, "condition": "sunny"}}
+
+
+def test_baseline_forecast_is_not_certain_after_one_reading():
+    with TestClient(api.app) as client:
+        assert client.post("/homes/baseline/readings", json=_reading(3.0, 2.0)).status_code == 200
+        forecast = client.get("/homes/baseline/predict/next24h").json()
+    assert len(forecast) == 24
+    for hour in forecast:
+        assert hour["confidence"] <= 0.8
+        assert hour["production_upper"] > hour["production_lower"]
+        assert hour["consumption_upper"] > hour["consumption_lower"]
+
+
+def test_cached_forecast_skips_the_pools(monkeypatch):
+    with TestClient(api.app) as client:
+        client.post("/homes/cached/readings", json=_reading(3.0, 2.0))
+        first = client.get("/homes/cached/predict/next24h").json()
+
+        async def unavailable(shard):
+            raise AssertionError("cache hits must not load or train models")
+
+        monkeypatch.setattr(api, "_current_predictor", unavailable)
+        hits = api.forecast_cache.hits
+        assert client.get("/homes/cached/predict/next24h").json() == first
+        assert api.forecast_cache.hits == hits + 1
+        # A new reading invalidates the forecast, so the next request computes one
+        client.post("/homes/cached/readings", json=_reading(4.0, 2.0))
+        assert client.get("/homes/cached/predict/next24h").status_code == 500
+
+
+def test_busy_pool_maps_to_504_then_503(monkeypatch):
+    release = threading.Event()
+
+    def slow_series(*args):
+        release.wait()
+        return {}
+
+    layer = ExecutionLayer(threads=1, max_queue=0, thread_timeout=0.05)
+    monkeypatch.setattr(api, "execution", layer)
+    monkeypatch.setattr(api, "_range_series", slow_series)
+    try:
+        with TestClient(api.app) as client:
+            assert client.get("/homes/busy/readings", params={"resolution": "raw"}).status_code == 504
+            # The timed-out series still holds the only slot
+            response = client.get("/homes/busy/readings", params={"resolution": "raw"})
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == "1"
+    finally:
+        release.set()
+        layer.shutdown()
@@ -0,0 +1,45 @@
+import asyncio
+
+from app.cache import ForecastCache
+
+
+def test_invalidate_drops_only_that_home():
+    cache = ForecastCache(max_entries=3)
+    for hour in range(3):
+        cache.put(('a', 'v1', hour), hour)
+    cache.put(('b', 'v1', 0), 'b')  # Evicts ('a', 'v1', 0)
+    assert cache.get(('a', 'v1', 0)) is None
+    cache.invalidate('a')
+    assert len(cache) == 1
+    assert cache.get(('b', 'v1', 0)) == 'b'
+    cache.put(('a', 'v1', 0), 'fresh')
+    assert cache.get(('a', 'v1', 0)) == 'fresh'
+
+
+def test_forecast_computed_before_invalidation_is_not_cached():
+    cache = ForecastCache()
+    key = ('a', 'v1', 0)
+
+    async def scenario():
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def stale():
+            started.set()
+            await release.wait()
+            return 'stale'
+
+        async def fresh():
+            return 'fresh'
+
+        pending = asyncio.create_task(cache.get_or_compute(key, stale))
+        await started.wait()
+        cache.invalidate('a')  # New readings arrive mid-computation
+        # A caller after the invalidation does not share the stale computation
+        assert await cache.get_or_compute(key, fresh) == 'fresh'
+        release.set()
+        assert await pending == 'stale'
+        return cache.get(key)
+
+    assert asyncio.run(scenario()) == 'fresh'
+    assert cache.misses == 2
@@ -0,0 +1,40 @@
+from itertools import product
+
+import numpy as np
+
+from app.dispatch import _grid_cost, solve_dispatch
+
+EFFICIENCY = 0.81
+
+
+def _objective(path, net, level, buy, sell, terminal_price):
+    """Grid cost of a battery level path minus the value of the energy left"""
+    change = np.diff(np.concatenate([[level], path]))
+    one_way = np.sqrt(EFFICIENCY)
+    grid = np.where(change > 0, change / one_way, change * one_way) - net
+    return float(_grid_cost(grid, buy, sell).sum()) - (path[-1] - level) * terminal_price
+
+
+def test_dispatch_matches_brute_force():
+    rng = np.random.default_rng(0)
+    levels = np.linspace(2.0, 10.0, 5)  # 20%-100% of 10 kWh in 2 kWh steps
+    for _ in range(20):
+        steps = 5
+        net = rng.normal(0.0, 3.0, steps)
+        sell = rng.uniform(0.02, 0.1, steps)
+        buy = sell + rng.uniform(0.0, 0.3, steps)
+        level = float(rng.choice(levels))
+        plan = solve_dispatch(net, level, 10.0, 0.2, 1.0, buy, sell, resolution=2.0,
+                              max_charge_rate=4.0, max_discharge_rate=4.0, efficiency=EFFICIENCY)
+        terminal_price = sell.mean()
+
+        best = min(
+            _objective(np.array(path), net, level, buy, sell, terminal_price)
+            for path in product(levels, repeat=steps)
+            if np.all(np.abs(np.diff(np.concatenate([[level], path]))) <= 4.0 + 1e-9)
+        )
+        assert np.isclose(_objective(plan.battery_level, net, level, buy, sell, terminal_price), best)
+        np.testing.assert_allclose(plan.cost, _objective(plan.battery_level, net, level, buy, sell, 0.0))
+        np.testing.assert_allclose(plan.charge - plan.discharge,
+                                   np.diff(np.concatenate([[level], plan.battery_level])))
+        assert plan.cost <= plan.baseline_cost + (plan.battery_level[-1] - level) * terminal_price + 1e-9
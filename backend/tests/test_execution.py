@@ -0,0 +1,77 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.execution import ExecutionLayer, Overloaded, TaskTimeout
+
+
+def test_full_queue_raises_overloaded():
+    async def scenario(layer, release):
+        running = [asyncio.ensure_future(layer.run_thread(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            await layer.run_thread(time.sleep, 0)
+        release.set()
+        await asyncio.gather(*running)
+        # Finished tasks free their slots
+        assert layer.threads.pending == 0
+        return await layer.run_thread(sum, [1, 2])
+
+    layer = ExecutionLayer(threads=1, max_queue=1)
+    try:
+        assert asyncio.run(scenario(layer, threading.Event())) == 3
+    finally:
+        layer.shutdown()
+
+
+def test_timeout_frees_the_slot_only_when_the_task_ends():
+    async def scenario(layer, release):
+        with pytest.raises(TaskTimeout):
+            await layer.run_thread(release.wait, timeout=0.05)
+        # The timed-out task still runs and holds the only slot
+        with pytest.raises(Overloaded):
+            await layer.run_thread(time.sleep, 0)
+        release.set()
+        while layer.threads.pending:
+            await asyncio.sleep(0.01)
+        return await layer.run_thread(sum, [1, 2])
+
+    layer = ExecutionLayer(threads=1, max_queue=0)
+    try:
+        assert asyncio.run(scenario(layer, threading.Event())) == 3
+    finally:
+        layer.shutdown()
+
+
+def test_calls_with_the_same_key_share_one_task():
+    calls = []
+
+    def work(release):
+        calls.append(1)
+        release.wait()
+        return len(calls)
+
+    async def scenario(layer, release):
+        first = asyncio.ensure_future(layer.run_thread(work, release, key='train'))
+        await asyncio.sleep(0.05)
+        # A caller that times out does not cancel the task it shares
+        with pytest.raises(TaskTimeout):
+            await layer.run_thread(work, release, key='train', timeout=0.05)
+        second = asyncio.ensure_future(layer.run_thread(work, release, key='train'))
+        other = asyncio.ensure_future(layer.run_thread(work, release, key='other'))
+        await asyncio.sleep(0.05)
+        release.set()
+        results = await asyncio.gather(first, second, other)
+        assert layer.stats()['coalesced_keys'] == 0
+        return results
+
+    layer = ExecutionLayer(threads=2, max_queue=2)
+    try:
+        first, second, other = asyncio.run(scenario(layer, threading.Event()))
+    finally:
+        layer.shutdown()
+    assert len(calls) == 2
+    assert first == second
+    assert other in (1, 2)
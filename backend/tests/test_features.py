@@ -0,0 +1,101 @@
+import numpy as np
+
+from app.features import FEATURES, HALF_LIFE, HORIZON, LAGS, WINDOW, FeatureStore
+from app.store import FIELDS
+
+START = np.datetime64('2024-01-01T00:00', 'us')
+
+
+def _readings(count: int, seed: int = 0, max_gap_s: int = 7200):
+    rng = np.random.default_rng(seed)
+    gaps = rng.integers(1, max_gap_s, count).astype('timedelta64[s]').astype('timedelta64[us]')
+    return START + np.cumsum(gaps), rng.uniform(0, 5, (count, len(FIELDS)))
+
+
+def _reference(timestamps: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """History columns computed row by row from their definitions"""
+    half_life = np.timedelta64(HALF_LIFE, 'us')
+    ewma = np.empty_like(targets)
+    ewma[0] = targets[0]
+    for i in range(1, len(targets)):
+        keep = 0.5 ** ((timestamps[i] - timestamps[i - 1]) / half_life)
+        ewma[i] = keep * ewma[i - 1] + (1 - keep) * targets[i]
+
+    def at_or_before(moment) -> int:
+        return max(int(np.searchsorted(timestamps, moment, side='right')) - 1, 0)
+
+    rows = np.zeros((len(targets), len(FEATURES) - 6))
+    for i in range(1, len(targets)):
+        lags = [targets[at_or_before(timestamps[i] - np.timedelta64(lag, 'us'))] for lag in LAGS]
+        anchor = timestamps[i] - np.timedelta64(HORIZON, 'us')
+        window = (timestamps <= anchor) & (timestamps > anchor - np.timedelta64(WINDOW, 'us'))
+        mean = targets[window].mean(axis=0) if window.any() else lags[0]
+        rows[i] = np.concatenate(lags + [mean, ewma[at_or_before(anchor)]])
+    return rows
+
+
+def test_history_features_match_reference():
+    timestamps, values = _readings(400)
+    features = FeatureStore.from_columns(timestamps, values)
+    X, y = features.matrix()
+    np.testing.assert_allclose(X[:, 6:], _reference(timestamps, values[:, :2]), rtol=1e-5, atol=1e-5)
+    np.testing.assert_array_equal(y, values[:, :2])
+
+
+def test_incremental_extend_matches_one_shot():
+    timestamps, values = _readings(500, seed=1)
+    rng = np.random.default_rng(2)
+    features = FeatureStore(capacity=4)
+    lo = 0
+    while lo < len(timestamps):
+        count = int(rng.integers(1, 40))
+        features.extend(timestamps[lo:lo + count], values[lo:lo + count])
+        lo += count
+    np.testing.assert_array_equal(features.matrix()[0],
+                                  FeatureStore.from_columns(timestamps, values).matrix()[0])
+
+
+def test_lags_are_by_time_not_rows():
+    # Minute readings: the 24h lag is the reading a day earlier, not 24 rows back
+    timestamps = START + np.arange(3 * 24 * 60) * np.timedelta64(1, 'm')
+    values = np.zeros((len(timestamps), len(FIELDS)))
+    values[:, 0] = np.arange(len(timestamps))
+    X, _ = FeatureStore.from_columns(timestamps, values).matrix()
+    row = len(timestamps) - 1
+    assert X[row, FEATURES.index('production_lag_24h')] == row - 24 * 60
+
+
+def test_horizon_matches_training_rows():
+    timestamps, values = _readings(600, seed=3, max_gap_s=3600)
+    full = FeatureStore.from_columns(timestamps, values)
+    cut = 500
+    known = FeatureStore.from_columns(timestamps[:cut], values[:cut])
+    ahead = timestamps[cut:][timestamps[cut:] <= timestamps[cut - 1] + np.timedelta64(HORIZON, 'us')]
+    expected = full.matrix()[0][cut:cut + len(ahead), 6:]
+    np.testing.assert_array_equal(known.horizon(ahead, 20.0, 0.0)[:, 6:], expected)
+    # The tail kept for inference is enough to build the same rows
+    np.testing.assert_array_equal(known.tail().horizon(ahead, 20.0, 0.0)[:, 6:], expected)
+
+
+def test_horizon_beyond_readings_repeats_last_cycle():
+    timestamps = START + np.arange(10 * 24) * np.timedelta64(1, 'h')
+    values = np.zeros((len(timestamps), len(FIELDS)))
+    values[:, 0] = np.arange(len(timestamps))
+    features = FeatureStore.from_columns(timestamps, values)
+    # 30 hours after the last reading: yesterday's value is not known yet
+    ahead = timestamps[-1:] + np.timedelta64(30, 'h')
+    lag = features.horizon(ahead, 20.0, 0.0)[0, FEATURES.index('production_lag_24h')]
+    assert lag == len(timestamps) - 1 + 30 - 48
+
+
+def test_keep_last_and_copies():
+    timestamps, values = _readings(300, seed=4)
+    features = FeatureStore.from_columns(timestamps, values)
+    X = features.matrix()[0].copy()
+    features.keep_last(100)
+    assert len(features) == 100 and features.dropped == 200
+    np.testing.assert_array_equal(features.matrix()[0], X[-100:])
+    features.extend(timestamps[-1:] + np.timedelta64(1, 'h'), values[-1:])
+    copy = features.copy()
+    np.testing.assert_array_equal(copy.matrix()[0], features.matrix()[0])
+    assert copy.last_timestamp == features.last_timestamp
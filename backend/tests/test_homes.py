@@ -0,0 +1,104 @@
+import gc
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+
+from app.homes import DataStore
+from app.persistence import SQLiteReadingLog
+from app.registry import ModelRegistry
+from app.store import FIELDS
+from app.synthetic import generate_fleet
+
+
+def _shard(home_id: str, columns, registry: ModelRegistry) -> DataStore:
+    shard = DataStore(home_id, registry=registry)
+    shard.add_batch(*columns)
+    return shard
+
+
+def test_registry_budget_releases_predictors(tmp_path):
+    fleet = generate_fleet(2, 5)
+    registry = ModelRegistry(str(tmp_path), memory_budget=1)
+    first, second = (_shard(home_id, columns, registry) for home_id, columns in fleet.items())
+
+    version = first.get_predictor().model_version
+    assert second.get_predictor() is not None
+    gc.collect()
+    # Only the most recently used model fits the budget, and the shard does not pin it
+    assert registry.loaded_homes() == [second.home_id]
+    assert first.predictor is None
+
+    loads = registry.loads
+    assert first.training_job() is None
+    assert first.predictor.model_version == version
+    assert registry.loads == loads + 1
+
+
+def test_paging_survives_duplicate_timestamps_and_new_readings():
+    start = np.datetime64('2024-01-01T00:00', 'us')
+    # Three readings per timestamp, so pages end in the middle of a group
+    timestamps = np.repeat(start + np.arange(20) * np.timedelta64(1, 'h'), 3)
+    values = np.zeros((len(timestamps), len(FIELDS)))
+    values[:, 0] = np.arange(len(timestamps))
+    shard = DataStore('home')
+    shard.add_batch(timestamps, values, ['sunny'] * len(timestamps))
+
+    seen, position = [], None
+    while True:
+        (page_timestamps, page_values, _), position = shard.page(None, None, limit=7, after=position)
+        seen.extend(page_values[:, 0])
+        if position is None:
+            break
+        # Newer readings arriving between pages do not move the cursor
+        shard.add_batch(page_timestamps[-1:] + np.timedelta64(30, 'D'), np.full((1, len(FIELDS)), -1.0),
+                        ['rain'])
+    assert seen[:len(timestamps)] == list(range(len(timestamps)))
+    assert len(seen) == len(shard.readings)
+
+
+def test_paging_respects_range():
+    start = np.datetime64('2024-01-01T00:00', 'us')
+    timestamps = start + np.arange(48) * np.timedelta64(1, 'h')
+    shard = DataStore('home')
+    shard.add_batch(timestamps, np.zeros((48, len(FIELDS))), [''] * 48)
+    rows, position = [], None
+    while True:
+        (page_timestamps, _, _), position = shard.page(datetime(2024, 1, 1, 6), datetime(2024, 1, 1, 18),
+                                                       limit=5, after=position)
+        rows.extend(page_timestamps)
+        if position is None:
+            break
+    np.testing.assert_array_equal(rows, timestamps[6:18])
+
+
+def test_paging_reaches_past_the_memory_window(tmp_path):
+    now = np.datetime64(datetime.now(timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0), 'us')
+    timestamps = np.repeat(now - np.arange(5 * 24, 0, -1) * np.timedelta64(1, 'h'), 3)
+    values = np.zeros((len(timestamps), len(FIELDS)))
+    values[:, 0] = np.arange(len(timestamps))
+    log = SQLiteReadingLog(str(tmp_path), compact_interval=None)
+    try:
+        log.append('home', timestamps, values, ['sunny'] * len(timestamps))
+        # The oldest days come from segment files, the rest from SQLite
+        log.compact(before=(now - np.timedelta64(3, 'D')).astype(date))
+        shard = DataStore('home', log=log, memory_window=timedelta(days=2))
+        assert len(shard.readings) < len(timestamps)
+
+        seen, position = [], None
+        while True:
+            (_, page_values, _), position = shard.page(None, None, limit=7, after=position)
+            seen.extend(page_values[:, 0])
+            if position is None:
+                break
+        assert seen == list(range(len(timestamps)))
+
+        start, end = timestamps[3 * 24].item(), timestamps[-3 * 24].item()
+        rows, position = [], None
+        while True:
+            (page_timestamps, _, _), position = shard.page(start, end, limit=10, after=position)
+            rows.extend(page_timestamps)
+            if position is None:
+                break
+        np.testing.assert_array_equal(rows, timestamps[3 * 24:-3 * 24])
+    finally:
+        log.close()
@@ -0,0 +1,150 @@
+import os
+import shutil
+import sqlite3
+import time
+from datetime import date
+from threading import Thread
+
+import numpy as np
+
+from app.persistence import SQLiteReadingLog
+from app.store import FIELDS
+
+START = np.datetime64('2024-01-01T00:00', 'us')
+
+
+def _columns(hours: int):
+    timestamps = START + np.arange(hours) * np.timedelta64(1, 'h')
+    values = np.arange(hours * len(FIELDS), dtype=np.float64).reshape(hours, len(FIELDS))
+    return timestamps, values, ['sunny'] * hours
+
+
+def test_compaction_after_crash_does_not_duplicate_rows(tmp_path):
+    log = SQLiteReadingLog(str(tmp_path), compact_interval=None)
+    try:
+        log.append('home', *_columns(48))
+        log.flush()
+        # Crash between writing the segments and deleting the SQLite rows
+        for day in (date(2024, 1, 1), date(2024, 1, 2)):
+            start = int(np.datetime64(day, 'us').astype(np.int64))
+            with log._db_lock:
+                columns = log._select('home', start, start + 86_400_000_000)
+            log._write_segment(log._segment_dir('home', day), columns)
+        # Reads already skip the SQLite copies of the compacted rows
+        assert len(log.read_range('home')[0]) == 48
+        # A late reading for a compacted day is kept, as is a changed duplicate
+        late = START + np.timedelta64(90, 'm')
+        log.append('home', [late, START], np.ones((2, len(FIELDS))), ['rain', 'rain'])
+        log.compact(before=date(2024, 1, 3))
+
+        timestamps, values, _ = log.read_range('home')
+        assert len(timestamps) == 50
+        assert np.all(np.diff(timestamps) >= np.timedelta64(0, 'us'))
+        with log._db_lock:
+            assert log._db.execute("SELECT COUNT(*) FROM readings").fetchone()[0] == 0
+    finally:
+        log.close()
+
+
+def _sqlite_rows(log: SQLiteReadingLog) -> int:
+    with log._db_lock:
+        return log._db.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+
+
+def test_interrupted_segment_replacement_is_recovered(tmp_path):
+    log = SQLiteReadingLog(str(tmp_path), compact_interval=None)
+    log.append('home', *_columns(24))
+    log.compact(before=date(2024, 1, 2))
+    late = START + np.timedelta64(30, 'm')
+    log.append('home', [late], np.ones((1, len(FIELDS))), ['rain'])
+    log.flush()
+    # Crash after the segment was moved aside, before the new one took its place
+    path = log._segment_dir('home', date(2024, 1, 1))
+    shutil.copytree(path, path.with_name(path.name + ".tmp"))
+    os.replace(path, path.with_name(path.name + ".old"))
+    assert len(log.read_range('home')[0]) == 25
+    log.close()
+
+    log = SQLiteReadingLog(str(tmp_path), compact_interval=None)
+    try:
+        assert path.is_dir()
+        assert sorted(p.name for p in path.parent.iterdir()) == [path.name]
+        log.compact(before=date(2024, 1, 2))
+        assert len(log.read_range('home')[0]) == 25
+    finally:
+        log.close()
+
+
+def test_compaction_waits_for_reads(tmp_path):
+    log = SQLiteReadingLog(str(tmp_path), compact_interval=None)
+    try:
+        log.append('home', *_columns(48))
+        log.flush()
+        compaction = Thread(target=log.compact, kwargs={'before': date(2024, 1, 3)})
+        with log._file_lock("segments", shared=True):
+            # A read in progress: nothing may move from SQLite into segments
+            compaction.start()
+            time.sleep(0.2)
+            assert _sqlite_rows(log) == 48
+            assert not log.segments_dir.joinpath('home').exists()
+        compaction.join()
+        assert _sqlite_rows(log) == 0
+        assert len(log.read_range('home')[0]) == 48
+    finally:
+        log.close()
+
+
+def test_workers_sharing_a_directory_compact_safely(tmp_path):
+    # Two logs on one directory, as cluster workers have
+    logs = [SQLiteReadingLog(str(tmp_path), compact_interval=None) for _ in range(2)]
+    try:
+        for index, log in enumerate(logs):
+            timestamps, values, conditions = _columns(24 * 10)
+            log.append(f'home-{index}', timestamps, values, conditions)
+            log.append('shared', timestamps[index::2], values[index::2], conditions[index::2])
+            log.flush()
+        threads = [Thread(target=log.compact, kwargs={'before': date(2024, 1, 11)}) for log in logs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for log in logs:
+            assert len(log.read_range('shared')[0]) == 240
+            assert [len(log.read_range(f'home-{index}')[0]) for index in range(2)] == [240, 240]
+        assert _sqlite_rows(logs[0]) == 0
+    finally:
+        for log in logs:
+            log.close()
+
+
+class _FlakyConnection:
+    """Connection whose next `failures` inserts fail as if the database were locked"""
+
+    def __init__(self, db: sqlite3.Connection, failures: int):
+        self.db = db
+        self.failures = failures
+
+    def executemany(self, sql, rows):
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return self.db.executemany(sql, rows)
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+
+def test_writer_retries_failed_commits(tmp_path):
+    log = SQLiteReadingLog(str(tmp_path), commit_interval=0.01, compact_interval=None)
+    try:
+        log._db = _FlakyConnection(log._db, failures=2)
+        log.append('home', *_columns(10))
+        deadline = time.monotonic() + 5
+        # last_error is cleared by the writer's first successful commit
+        while (log.write_errors < 2 or log.last_error is not None) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert log.write_errors == 2
+        assert log.last_error is None
+        assert len(log.read_range('home')[0]) == 10
+    finally:
+        log.close()
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+
+from app import pipeline as pipeline_module
+from app.homes import DataStore, HomeShards, fit_predictor
+from app.pipeline import Pipeline, replay
+from app.synthetic import generate_fleet
+
+
+def _readings(columns, lo: int, hi: int):
+    return tuple(column[lo:hi] for column in columns)
+
+
+def test_replay_gives_every_reading_actions():
+    fleet = generate_fleet(3, 2)
+    pipeline = Pipeline(HomeShards(DataStore), max_delay=0.005)
+    stats = asyncio.run(replay(pipeline, fleet))
+    assert stats['readings'] == stats['pipeline']['readings'] == 3 * 48
+    assert stats['pipeline']['errors'] == 0
+    # Results are merged per home within a batch, but every home ends with one
+    assert set(pipeline.latest) == set(fleet)
+    for home_id, (timestamps, _, _) in fleet.items():
+        assert pipeline.latest[home_id]['timestamp'] == timestamps[-1].astype(object)
+
+
+def test_slow_training_does_not_block_ingestion(monkeypatch):
+    release = threading.Event()
+
+    def slow_fit(*job):
+        # Stands in for a long fit in the process pool
+        while not release.is_set():
+            time.sleep(0.01)
+        return fit_predictor(*job)
+
+    monkeypatch.setattr(pipeline_module, 'fit_predictor', slow_fit)
+    columns = generate_fleet(1, 5)['home-00000']
+
+    async def scenario():
+        pipeline = Pipeline(HomeShards(DataStore), queue_size=4, max_delay=0.001)
+        pipeline.start()
+        await pipeline.submit('home', _readings(columns, 0, 48))
+        await pipeline.drain()
+        assert set(pipeline._training) == {'home'}
+
+        # Far more readings than the queues hold, while the fit is still running
+        started = time.perf_counter()
+        for row in range(48, 96):
+            await pipeline.submit('home', _readings(columns, row, row + 1))
+        await pipeline.drain()
+        elapsed = time.perf_counter() - started
+        assert pipeline.latest['home']['model_version'] is None  # Fleet rule meanwhile
+
+        release.set()
+        await pipeline.wait_for_training()
+        await pipeline.submit('home', _readings(columns, 96, 97))
+        await pipeline.drain()
+        await pipeline.stop()
+        return pipeline, elapsed
+
+    pipeline, elapsed = asyncio.run(scenario())
+    assert elapsed < 2.0
+    assert pipeline.counts["trainings"] == 1
+    assert pipeline.latest['home']['model_version'] is not None
+    assert pipeline.latest['home']['forecast_hours'] == 24
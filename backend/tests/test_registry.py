@@ -0,0 +1,52 @@
+from app.energy_agents import PredictionAgent
+from app.registry import ModelRegistry
+from app.store import ReadingStore
+from app.synthetic import generate_fleet
+
+
+def _agents(count: int):
+    """Copies of one trained agent under `count` home ids"""
+    (columns,) = generate_fleet(1, 5).values()
+    store = ReadingStore()
+    store.extend(*columns)
+    agent = PredictionAgent('home-0', n_estimators=10)
+    assert agent.train(store)
+    state = agent.export_state()
+    return [PredictionAgent.from_state(dict(state, home_id=f'home-{i}')) for i in range(count)]
+
+
+def test_memory_budget_evicts_least_recently_used(tmp_path):
+    agents = _agents(3)
+    sizing = ModelRegistry(str(tmp_path / 'sizing'))
+    sizing.save(agents[0])
+    size = sizing.memory_usage
+
+    registry = ModelRegistry(str(tmp_path / 'models'), memory_budget=2 * size + size // 2)
+    for agent in agents[:2]:
+        registry.save(agent)
+    assert registry.loaded_homes() == ['home-0', 'home-1']
+    assert registry.memory_usage == 2 * size
+
+    # A hit makes home-0 the most recently used, so home-1 goes first
+    assert registry.get('home-0') is agents[0]
+    registry.save(agents[2])
+    assert registry.loaded_homes() == ['home-0', 'home-2']
+    assert registry.memory_usage <= registry.memory_budget
+
+    # An evicted home is loaded from disk again, evicting the next in line
+    loads = registry.loads
+    reloaded = registry.get('home-1')
+    assert reloaded.model_version == agents[1].model_version
+    assert registry.loads == loads + 1
+    assert registry.loaded_homes() == ['home-2', 'home-1']
+    assert registry.get('home-1') is reloaded
+    assert registry.loads == loads + 1
+
+
+def test_budget_keeps_the_most_recent_agent(tmp_path):
+    agent, = _agents(1)
+    registry = ModelRegistry(str(tmp_path), memory_budget=1)
+    registry.save(agent)
+    # Over budget on its own, but evicting it would only force a reload
+    assert registry.loaded_homes() == ['home-0']
+    assert registry.stats()['memory_usage'] > registry.memory_budget
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from app.homes import DataStore
+from app.persistence import SQLiteReadingLog
+from app.rollups import Rollups, RollupTier
+from app.store import FIELDS
+from app.synthetic import generate_fleet
+
+START = np.datetime64('2024-01-01T00:00', 'us')
+
+
+def _minutes(count: int, offset: int = 0) -> np.ndarray:
+    return START + (offset + np.arange(count)) * np.timedelta64(1, 'm')
+
+
+def test_tiers_match_direct_aggregation():
+    rng = np.random.default_rng(0)
+    timestamps = _minutes(3 * 24 * 60)
+    values = rng.random((len(timestamps), len(FIELDS)))
+    rollups = Rollups()
+    # Uneven batches, one of them late, must give the same buckets as one pass
+    order = rng.permutation(len(timestamps))
+    late, rest = np.sort(order[:500]), np.sort(order[500:])
+    for chunk in np.array_split(rest, 7):
+        rollups.add(timestamps[chunk], values[chunk])
+    rollups.add(timestamps[late], values[late])
+
+    hours = (timestamps - START) // np.timedelta64(1, 'h')
+    result = rollups.by_name['1h'].query()
+    assert len(result['timestamps']) == 72
+    assert np.all(result['count'] == 60)
+    for field in range(len(FIELDS)):
+        np.testing.assert_allclose(result['sum'][:, field], np.bincount(hours, values[:, field]))
+        np.testing.assert_array_equal(result['max'][:, field],
+                                      [values[hours == h, field].max() for h in range(72)])
+    assert rollups.by_name['1d'].query()['count'].tolist() == [1440] * 3
+
+
+def test_retention_drops_old_buckets_and_reports_coverage():
+    tier = RollupTier('1min', timedelta(minutes=1), retention=timedelta(hours=2))
+    assert tier.covers(None)
+    keys = np.arange(1000)
+    ones = np.ones((len(keys), len(FIELDS)))
+    tier.merge((keys, np.ones(len(keys), dtype=np.int64), ones, ones, ones))
+    assert len(tier) < 1000
+    assert tier.query()['timestamps'][-1] == np.datetime64(999, 'm')
+    first = int(tier.query()['timestamps'][0].astype(np.int64)) // tier.width_us
+    assert tier.expired_before == first
+    assert 999 - first >= tier.retention_buckets
+    epoch = datetime(1970, 1, 1)
+    assert not tier.covers(None)
+    assert not tier.covers(epoch + timedelta(minutes=first - 1))
+    assert tier.covers(epoch + timedelta(minutes=first))
+
+
+def test_restore_rebuilds_rollups_beyond_memory_window(tmp_path):
+    now = datetime.now(timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+    timestamps, values, conditions = generate_fleet(1, 90, start=now - timedelta(days=90))['home-00000']
+    log = SQLiteReadingLog(str(tmp_path), compact_interval=None)
+    try:
+        store = DataStore('home', log=log, memory_window=timedelta(days=30))
+        store.add_batch(timestamps, values, conditions)
+        log.compact()
+
+        restarted = DataStore('home', log=log, memory_window=timedelta(days=30))
+        start = now - timedelta(days=80)
+        tier = restarted.rollups.choose(start, None, 2000)
+        assert tier.name == '1h'
+        result = tier.query(start, None)
+        assert len(result['timestamps']) == 80 * 24
+        np.testing.assert_allclose(result['sum'].sum(axis=0),
+                                   values[timestamps >= np.datetime64(start, 'us')].sum(axis=0))
+        assert len(restarted.readings) < len(timestamps)
+    finally:
+        log.close()
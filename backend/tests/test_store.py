@@ -0,0 +1,103 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from app.store import FIELDS, ReadingStore
+
+START = np.datetime64('2024-01-01T00:00', 'us')
+MINUTE = np.timedelta64(1, 'm')
+
+
+def _check(store: ReadingStore, expected):
+    timestamps = np.array([ts for ts, _, _ in expected], dtype='datetime64[us]')
+    values = np.array([row for _, _, row in expected]).reshape(len(expected), len(FIELDS))
+    np.testing.assert_array_equal(store.timestamps, timestamps)
+    np.testing.assert_array_equal(store.values(), values)
+    rng = np.random.default_rng(len(expected))
+    for lo, hi in rng.integers(0, len(expected) + 1, (20, 2)):
+        np.testing.assert_allclose(store.range_sum(lo, hi), values[lo:hi].sum(axis=0), atol=1e-9)
+    cutoff = timestamps[-1] - np.timedelta64(1, 'h')
+    recent = values[timestamps > cutoff]
+    stats = store.window_stats('1h', timestamps[-1].item())
+    assert stats['total_readings'] == len(recent)
+    assert stats['peak_production'] == recent[:, 0].max()
+
+
+def test_ring_buffer_matches_sorted_reference():
+    # Small capacity and window: the buffer wraps, compacts and grows many times
+    rng = np.random.default_rng(0)
+    store = ReadingStore(capacity=16, max_readings=50)
+    expected = []  # (timestamp, insertion order, values), kept sorted like the store
+    order = 0
+    newest = 0
+    for _ in range(300):
+        if rng.random() < 0.7:
+            # One reading, late by up to 30 minutes a third of the time
+            minute = newest + 1 if rng.random() < 0.67 else newest - int(rng.integers(0, 30))
+            row = rng.random(len(FIELDS))
+            store.append((START + minute * MINUTE).item(), *row[:3],
+                         {'temperature': row[3], 'cloud_cover': row[4], 'condition': 'sunny'})
+            batch = [(START + minute * MINUTE, order, row)]
+        else:
+            # A batch, sometimes overlapping the newest rows
+            count = int(rng.integers(1, 20))
+            minutes = newest - int(rng.integers(0, 10)) + np.sort(rng.integers(0, 40, count))
+            rows = rng.random((count, len(FIELDS)))
+            store.extend(START + minutes * MINUTE, rows, ['rain'] * count)
+            batch = [(START + m * MINUTE, order + i, row) for i, (m, row) in enumerate(zip(minutes, rows))]
+        order += len(batch)
+        newest = max(newest, max(int((ts - START) // MINUTE) for ts, _, _ in batch))
+        expected = sorted(expected + batch, key=lambda item: (item[0], item[1]))[-50:]
+        _check(store, expected)
+    assert store.total_appended == order
+
+
+def test_retention_by_time_keeps_prefix_sums_exact():
+    store = ReadingStore(capacity=16, retention=timedelta(hours=2))
+    values = np.ones((600, len(FIELDS)))
+    timestamps = START + np.arange(600) * MINUTE
+    for chunk in np.array_split(np.arange(600), 13):
+        store.extend(timestamps[chunk], values[chunk], [''] * len(chunk))
+    assert len(store) == 121
+    assert store.timestamps[0] == timestamps[-1] - np.timedelta64(2, 'h')
+    np.testing.assert_allclose(store.range_sum(0, len(store)), 121.0)
+    stats = store.range_stats(datetime(2024, 1, 1, 9), None)
+    assert stats['total_readings'] == 60 and stats['avg_production'] == 1.0
+
+
+def test_rolling_windows_match_brute_force():
+    rng = np.random.default_rng(1)
+    store = ReadingStore(capacity=16)
+    minutes = np.cumsum(rng.integers(1, 90, 400))
+    timestamps = START + minutes * MINUTE
+    values = rng.random((400, len(FIELDS)))
+    for row in range(400):
+        store.append(timestamps[row].item(), *values[row, :3],
+                     {'temperature': values[row, 3], 'cloud_cover': values[row, 4]})
+        if row % 37:
+            continue
+        for name, window in store.windows.items():
+            now = timestamps[row] + np.timedelta64(int(rng.integers(0, 120)), 'm')
+            inside = (timestamps[:row + 1] > now - np.timedelta64(window.length)) & (timestamps[:row + 1] <= now)
+            stats = store.window_stats(name, now.item())
+            assert stats['total_readings'] == inside.sum()
+            if inside.any():
+                assert np.isclose(stats['avg_consumption'], values[:row + 1][inside, 1].mean())
+                assert stats['peak_production'] == values[:row + 1][inside, 0].max()
+            else:
+                assert stats['peak_production'] is None
+
+
+def test_window_stats_default_to_utc_now(monkeypatch):
+    # Ahead of UTC: a local clock would put every stored reading out of the 1h window
+    monkeypatch.setenv('TZ', 'Asia/Tokyo')
+    time.tzset()
+    try:
+        store = ReadingStore()
+        recent = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=30)
+        store.append(recent, 1.0, 2.0, 3.0)
+        assert store.window_stats('1h')['total_readings'] == 1
+    finally:
+        monkeypatch.undo()
+        time.tzset()
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import numpy as np
+
+from app.energy_agents import EnergyData, PredictionAgent
+from app.features import FeatureStore
+from app.synthetic import generate_fleet
+from app.uncertainty import STEPS, ConformalCalibration, steps_ahead, tree_predictions
+
+START = np.datetime64('2024-01-01T00:00', 'us')
+
+
+def test_steps_ahead():
+    timestamps = START + np.array([0, 30, 60, 61, 24 * 60, 48 * 60]) * np.timedelta64(1, 'm')
+    np.testing.assert_array_equal(steps_ahead(timestamps, START), [0, 0, 0, 1, 23, STEPS - 1])
+    np.testing.assert_array_equal(steps_ahead(timestamps[:2], None), [STEPS - 1] * 2)
+
+
+def test_calibration_is_per_step_with_pooled_fallback():
+    calibration = ConformalCalibration([0.0], steps=3)
+    errors = np.concatenate([np.full(50, 1.0), np.full(50, 3.0)])[:, None]
+    steps = np.repeat([0, 1], 50)
+    calibration.update(errors, np.zeros_like(errors), np.ones_like(errors), steps)
+    q = calibration.quantile(0.8, np.array([0, 1, 2]))[:, 0]
+    assert q[0] == 1.0 and q[1] == 3.0
+    # Step 2 has no scores and uses all of them
+    assert q[2] == 3.0
+
+
+def test_tree_predictions_average_to_forest_prediction():
+    from sklearn.ensemble import RandomForestRegressor
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(200, 4))
+    y = np.column_stack([X[:, 0] * 2 + rng.normal(size=200), X[:, 1]])
+    forest = RandomForestRegressor(n_estimators=20, random_state=0).fit(X, y)
+    stacked = tree_predictions(forest, X[:10])
+    assert stacked.shape == (10, 20, 2)
+    np.testing.assert_allclose(stacked.mean(axis=1), forest.predict(X[:10]))
+
+
+def test_day_ahead_interval_coverage():
+    """Backtest of 24h forecasts made like the API makes them: intervals should cover near the nominal 80%"""
+    hits = []
+    for home_id, (timestamps, values, _) in generate_fleet(2, 40, seed=3, start=datetime(2024, 4, 1)).items():
+        for origin in range(len(timestamps) - 8 * 24, len(timestamps) - 23, 48):
+            known = FeatureStore.from_columns(timestamps[:origin], values[:origin])
+            agent = PredictionAgent(home_id, n_estimators=30, parallel_fit=False)
+            assert agent.train(known)
+            last = values[origin - 1]
+            current = EnergyData(timestamp=timestamps[origin].astype(datetime), production=last[0],
+                                 consumption=last[1], battery_level=last[2],
+                                 weather_data={'temperature': last[3], 'cloud_cover': last[4]})
+            predictions = agent.predict_next_24h(current, known.tail())
+            lower = np.array([[p.production_lower, p.consumption_lower] for p in predictions])
+            upper = np.array([[p.production_upper, p.consumption_upper] for p in predictions])
+            actual = values[origin:origin + 24, :2]
+            hits.append((actual >= lower) & (actual <= upper))
+    coverage = np.concatenate(hits).mean(axis=0)
+    assert (coverage > 0.7).all() and (coverage < 0.97).all(), coverage